@@ -1,7 +1,15 @@
-from typing import Callable
+from typing import Callable, Literal
 
 import numpy as np
 
+CENTRAL_STEP = 1e-4
+"""The step h of the central difference."""
+
+COMPLEX_STEP = 1e-20
+"""The step h of the complex step, it can be tiny, since nothing cancels."""
+
+DiffMethod = Literal["central", "complex"]
+
 
 def numerical_diff_1d(f: Callable[[float], float], x0: float) -> float:
     """Calculate numerical differentiation for a 1-dimensional function.
@@ -41,3 +49,102 @@ def numerical_partial_diff(
         np.typing.NDArray[np.floating]: Numerical differentiation.
     """
     raise NotImplementedError
+
+
+def numerical_diff_points(
+    f: Callable[[np.typing.NDArray[np.number]], np.typing.NDArray[np.number]],
+    x: np.typing.NDArray[np.floating],
+    method: DiffMethod = "central",
+    h: float | None = None,
+) -> np.typing.NDArray[np.floating]:
+    """Calculate the derivative of a 1-dimensional function at many points.
+
+    The f is vectorized, it's applied to every element of an array, like
+    np.sin, so all points are differentiated by one or two calls of f:
+        central: diff = (f(x + h) - f(x - h)) / (2 * h)
+        complex: diff = Im(f(x + i * h)) / h
+
+    The complex step doesn't subtract close values, so the derivative of an
+    analytic function is exact to the machine precision, from one call of f.
+    The f has to accept complex numbers, and not use operations like np.abs,
+    np.maximum or comparisons, which aren't analytic.
+
+    Parameters:
+        f : Callable
+            The vectorized function to differentiate.
+        x : np.typing.NDArray[np.floating]
+            The points to differentiate, any shape.
+        method : DiffMethod
+            "central" or "complex".
+        h : float | None
+            The step, None for `CENTRAL_STEP` or `COMPLEX_STEP`.
+
+    Returns:
+        np.typing.NDArray[np.floating]: The derivatives, shaped like x.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if method == "complex":
+        h = COMPLEX_STEP if h is None else h
+        return np.imag(f(x + 1j * h)) / h
+    if method == "central":
+        h = CENTRAL_STEP if h is None else h
+        values = np.asarray(f(np.stack([x + h, x - h])))
+        diff: np.typing.NDArray[np.floating] = (values[0] - values[1]) / (2 * h)
+        return diff
+    raise ValueError(f"Unknown method: {method}.")
+
+
+def numerical_partial_diff_points(
+    f: Callable[[np.typing.NDArray[np.number]], np.typing.NDArray[np.number]],
+    x: np.typing.NDArray[np.floating],
+    axis: tuple[int, ...],
+    method: DiffMethod = "central",
+    h: float | None = None,
+) -> np.typing.NDArray[np.floating]:
+    """Calculate the partial derivative of a function at many points.
+
+    The f is batched: it takes the points stacked along the first axis,
+    shape (N, *shape), and returns their N values, like
+        lambda x: np.sum(x**2, axis=tuple(range(1, x.ndim)))
+    The points are perturbed at the position axis of a point, and evaluated
+    by one call of f for the complex step, or two for the central difference
+    (see `numerical_diff_points`).
+
+    Parameters:
+        f : Callable
+            The batched function to differentiate.
+        x : np.typing.NDArray[np.floating]
+            The points to differentiate, shape (N, *shape).
+        axis : tuple[int, ...]
+            The position of the variable in a point, like in
+            `numerical_partial_diff`.
+        method : DiffMethod
+            "central" or "complex".
+        h : float | None
+            The step, None for `CENTRAL_STEP` or `COMPLEX_STEP`.
+
+    Returns:
+        np.typing.NDArray[np.floating]: The N partial derivatives.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    assert len(axis) == x.ndim - 1, "The axis is a position in a point."
+    index: tuple[slice | int, ...] = (slice(None), *axis)
+    if method == "complex":
+        h = COMPLEX_STEP if h is None else h
+        perturbed = x.astype(np.complex128)
+        perturbed[index] += 1j * h
+        return np.imag(np.asarray(f(perturbed))) / h
+    if method == "central":
+        h = CENTRAL_STEP if h is None else h
+        num = x.shape[0]
+        plus: tuple[slice | int, ...] = (slice(None, num), *axis)
+        minus: tuple[slice | int, ...] = (slice(num, None), *axis)
+        perturbed = np.concatenate([x, x])
+        perturbed[plus] += h
+        perturbed[minus] -= h
+        values = np.asarray(f(perturbed))
+        diffs: np.typing.NDArray[np.floating] = (
+            values[:num] - values[num:]
+        ) / (2 * h)
+        return diffs
+    raise ValueError(f"Unknown method: {method}.")
@@ -1,7 +1,11 @@
-from typing import Callable
+import multiprocessing
+from typing import Any, Callable
 
 import numpy as np
 
+DELTA = 1e-4
+"""The step h of the central difference."""
+
 
 def numerical_gradient(
     f: Callable[[np.typing.NDArray[np.floating]], float],
@@ -29,6 +33,140 @@ def numerical_gradient(
     raise NotImplementedError
 
 
+def numerical_gradient_batched(
+    f: Callable[[np.typing.NDArray[np.floating]], Any],
+    x: np.typing.NDArray[np.floating],
+    vectorized: bool = False,
+    block_size: int = 256,
+    num_workers: int = 0,
+    h: float = DELTA,
+    context: Any | None = None,
+) -> np.typing.NDArray[np.floating]:
+    """Calculate the numerical gradient for blocks of coordinates at once.
+
+    It's the same central difference as `numerical_gradient`, i.e.
+        grad_i = (f(x + h e_i) - f(x - h e_i)) / (2 * h)
+    but instead of 2 * x.size sequential calls of f:
+        - vectorized: f takes the stacked points, shape (K, *x.shape), and
+          returns the K values. Every call evaluates the 2 * block_size
+          perturbed copies of x of a block of coordinates.
+        - otherwise: the blocks of coordinates are evaluated in the current
+          process, or spread over a pool of num_workers processes, every
+          worker perturbs its own copy of x. The pool is worth its startup
+          only when f is expensive, like the loss of a large network.
+
+    The x is restored (or not modified) afterwards.
+
+    Parameters:
+        f : Callable
+            The function, see the modes above. For the process pool, it may
+            read x by reference (like the parameters of a network) with the
+            fork context, with the spawn context it has to be picklable.
+        x : np.typing.NDArray[np.floating]
+            Point to differentiate.
+        vectorized : bool
+            If True, f is evaluated on stacked points.
+        block_size : int
+            The number of the coordinates of a block, which bounds the memory
+            of the stacked points (2 * block_size copies of x).
+        num_workers : int
+            The number of the processes if not vectorized, 0 runs in the
+            current process.
+        h : float
+            The step of the central difference.
+        context : multiprocessing context | None
+            The context for creating the processes.
+
+    Returns:
+        np.typing.NDArray[np.floating]: Numerical gradient.
+    """
+    assert block_size >= 1
+    blocks = [
+        np.arange(start, min(start + block_size, x.size))
+        for start in range(0, x.size, block_size)
+    ]
+    # C-ordered, so the flat gradient is a view whatever the layout of x is
+    grad = np.zeros(x.shape, dtype=x.dtype)
+    flat_grad = grad.reshape(-1)
+    if vectorized:
+        for indices in blocks:
+            flat_grad[indices] = _stacked_differences(f, x, indices, h)
+        return grad
+
+    if num_workers == 0:
+        for indices in blocks:
+            flat_grad[indices] = _central_differences(f, x, indices, h)
+        return grad
+
+    ctx = context if context is not None else multiprocessing.get_context()
+    with ctx.Pool(
+        num_workers, initializer=_init_worker, initargs=(f, x, h)
+    ) as pool:
+        for indices, values in zip(
+            blocks, pool.imap(_worker_differences, blocks)
+        ):
+            flat_grad[indices] = values
+    return grad
+
+
+def _stacked_differences(
+    f: Callable[[np.typing.NDArray[np.floating]], Any],
+    x: np.typing.NDArray[np.floating],
+    indices: np.typing.NDArray[np.intp],
+    h: float,
+) -> np.typing.NDArray[np.floating]:
+    num = indices.size
+    # the first half is x + h e_i, the second half is x - h e_i
+    points = np.repeat(x.reshape(1, -1), 2 * num, axis=0)
+    rows = np.arange(num)
+    points[rows, indices] += h
+    points[rows + num, indices] -= h
+    values = np.asarray(f(points.reshape(2 * num, *x.shape)))
+    result: np.typing.NDArray[np.floating] = (values[:num] - values[num:]) / (
+        2 * h
+    )
+    return result
+
+
+def _central_differences(
+    f: Callable[[np.typing.NDArray[np.floating]], Any],
+    x: np.typing.NDArray[np.floating],
+    indices: np.typing.NDArray[np.intp],
+    h: float,
+) -> np.typing.NDArray[np.floating]:
+    result = np.empty(indices.size, dtype=np.float64)
+    # index x itself, a flat view would be a copy for a non-contiguous x
+    for k, coords in enumerate(zip(*np.unravel_index(indices, x.shape))):
+        value = x[coords]
+        x[coords] = value + h
+        f_plus = f(x)
+        x[coords] = value - h
+        f_minus = f(x)
+        x[coords] = value
+        result[k] = (f_plus - f_minus) / (2 * h)
+    return result
+
+
+# the function and the point of a worker process, set by the initializer
+_worker_args: tuple[Any, ...] = ()
+
+
+def _init_worker(
+    f: Callable[[np.typing.NDArray[np.floating]], Any],
+    x: np.typing.NDArray[np.floating],
+    h: float,
+) -> None:
+    global _worker_args
+    _worker_args = (f, x, h)
+
+
+def _worker_differences(
+    indices: np.typing.NDArray[np.intp],
+) -> np.typing.NDArray[np.floating]:
+    f, x, h = _worker_args
+    return _central_differences(f, x, indices, h)
+
+
 def numerical_gradient_descend(
     f: Callable[[np.typing.NDArray[np.floating]], float],
     x: np.typing.NDArray[np.floating],
@@ -77,6 +77,12 @@ class TwoLayerNN:
     ) -> dict[str, NDArray[np.floating]]:
         """Calculate the numerical gradient.
 
+        The loss of every parameter perturbation is independent, so for the
+        larger networks `numerical_gradient_batched(..., num_workers=4)` can
+        spread the coordinates of a parameter over processes: the loss reads
+        the parameter array by reference, which is perturbed in the worker's
+        forked copy of the network.
+
         Parameters:
             x (NDArray[np.floating]): Input data.
             t (NDArray[np.floating]): Target output.
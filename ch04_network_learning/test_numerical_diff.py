@@ -4,8 +4,11 @@ import numpy as np
 import pytest
 
 from ch04_network_learning.b_numerical_diffirentiation import (
+    DiffMethod,
     numerical_diff_1d,
+    numerical_diff_points,
     numerical_partial_diff,
+    numerical_partial_diff_points,
 )
 
 ATOL = 1e-4
@@ -97,3 +100,63 @@ def test_numerical_partial_diff(
 ) -> None:
     result = numerical_partial_diff(f=f, x0=x, axis=axis)
     assert np.allclose(result, expected, atol=ATOL)
+
+
+@pytest.mark.parametrize(
+    "f, df, x",
+    [
+        (np.sin, np.cos, np.linspace(-3.0, 3.0, 7)),
+        (np.exp, np.exp, np.array([[0.0, 1.0], [-1.0, 2.0]])),
+        (np.log, lambda x: 1 / x, np.array([0.5, 2.0, 10.0])),
+        (lambda x: x**3 - 2 * x, lambda x: 3 * x**2 - 2, np.arange(5.0)),
+        (np.tan, lambda x: 1 / np.cos(x) ** 2, np.array([0.1, np.pi / 6])),
+    ],
+)
+@pytest.mark.parametrize(
+    "method, atol", [("central", ATOL), ("complex", 1e-14)]
+)
+def test_numerical_diff_points(
+    f: Callable[[np.typing.NDArray[np.number]], np.typing.NDArray[np.number]],
+    df: Callable[
+        [np.typing.NDArray[np.floating]], np.typing.NDArray[np.floating]
+    ],
+    x: np.typing.NDArray[np.floating],
+    method: DiffMethod,
+    atol: float,
+) -> None:
+    result = numerical_diff_points(f, x, method=method)
+    assert result.shape == x.shape
+    assert np.allclose(result, df(x), rtol=atol, atol=atol)
+
+
+@pytest.mark.parametrize(
+    "method, atol", [("central", ATOL), ("complex", 1e-13)]
+)
+def test_numerical_partial_diff_points(method: DiffMethod, atol: float) -> None:
+    x = np.random.default_rng(0).uniform(0.5, 2.0, size=(6, 2, 3))
+
+    def f(
+        points: np.typing.NDArray[np.number],
+    ) -> np.typing.NDArray[np.number]:
+        values: np.typing.NDArray[np.number] = np.sum(
+            points**2, axis=(1, 2)
+        ) * np.exp(points[:, 0, 1])
+        return values
+
+    expected = 2 * x[:, 1, 2] * np.exp(x[:, 0, 1])
+    result = numerical_partial_diff_points(f, x, axis=(1, 2), method=method)
+    assert result.shape == (6,)
+    assert np.allclose(result, expected, rtol=atol, atol=atol)
+    # the derivative along the position in the exponent too
+    expected = (2 * x[:, 0, 1] + np.sum(x**2, axis=(1, 2))) * np.exp(x[:, 0, 1])
+    result = numerical_partial_diff_points(f, x, axis=(0, 1), method=method)
+    assert np.allclose(result, expected, rtol=atol, atol=atol)
+
+
+def test_numerical_diff_points_unknown_method() -> None:
+    with pytest.raises(ValueError, match="Unknown method"):
+        numerical_diff_points(
+            np.sin,
+            np.zeros(2),
+            method="forward",  # type: ignore
+        )
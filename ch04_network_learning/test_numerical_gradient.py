@@ -6,6 +6,7 @@ import pytest
 from ch04_network_learning.c_numerical_gradient import (
     GradientWith1LayerNN,
     numerical_gradient,
+    numerical_gradient_batched,
     numerical_gradient_descend,
 )
 
@@ -55,6 +56,90 @@ def test_numerical_gradient(
     assert np.allclose(result, expected_gradient, atol=ATOL)
 
 
+def _cubic(x: np.typing.NDArray[np.floating]) -> float:
+    return float(np.sum(x**3) + x.reshape(-1)[0] * x.reshape(-1)[-1])
+
+
+def _expected_cubic(
+    x: np.typing.NDArray[np.floating],
+) -> np.typing.NDArray[np.floating]:
+    expected: np.typing.NDArray[np.floating] = 3 * x**2
+    flat = expected.reshape(-1)
+    flat[0] += x.reshape(-1)[-1]
+    flat[-1] += x.reshape(-1)[0]
+    return expected
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 100])
+def test_numerical_gradient_batched_vectorized(block_size: int) -> None:
+    x = np.random.default_rng(0).normal(size=(3, 5))
+    x0 = x.copy()
+
+    def f_stacked(
+        points: np.typing.NDArray[np.floating],
+    ) -> np.typing.NDArray[np.floating]:
+        flat = points.reshape(points.shape[0], -1)
+        values: np.typing.NDArray[np.floating] = (
+            np.sum(flat**3, axis=1) + flat[:, 0] * flat[:, -1]
+        )
+        return values
+
+    result = numerical_gradient_batched(
+        f_stacked, x, vectorized=True, block_size=block_size
+    )
+    assert result.shape == x.shape
+    assert np.allclose(result, _expected_cubic(x0), atol=ATOL)
+    assert np.array_equal(x, x0)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_numerical_gradient_batched_processes(num_workers: int) -> None:
+    x = np.random.default_rng(1).normal(size=(4, 3))
+    x0 = x.copy()
+    result = numerical_gradient_batched(
+        _cubic, x, block_size=5, num_workers=num_workers
+    )
+    assert np.allclose(result, _expected_cubic(x0), atol=ATOL)
+    assert np.array_equal(x, x0)
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_numerical_gradient_batched_non_contiguous(vectorized: bool) -> None:
+    x = np.random.default_rng(3).normal(size=(3, 4)).T
+    assert not x.flags.c_contiguous
+    x0 = x.copy()
+
+    def f_stacked(
+        points: np.typing.NDArray[np.floating],
+    ) -> np.typing.NDArray[np.floating]:
+        return np.array([_cubic(point) for point in points])
+
+    result = numerical_gradient_batched(
+        f_stacked if vectorized else _cubic,
+        x,
+        vectorized=vectorized,
+        block_size=5,
+    )
+    assert result.shape == x.shape
+    assert np.allclose(result, _expected_cubic(x0), atol=ATOL)
+    assert np.array_equal(x, x0)
+
+
+def test_numerical_gradient_batched_by_reference() -> None:
+    # the function reads the perturbed array by reference, like a network
+    params = {"W": np.random.default_rng(2).normal(size=(2, 3))}
+
+    def loss(_: np.typing.NDArray[np.floating]) -> float:
+        return _cubic(params["W"])
+
+    expected = _expected_cubic(params["W"])
+    for num_workers in (0, 2):
+        result = numerical_gradient_batched(
+            loss, params["W"], block_size=2, num_workers=num_workers
+        )
+        assert np.allclose(result, expected, atol=ATOL)
+
+
 @pytest.mark.parametrize(
     "func, init_x, lr, step_num, expected_minimum",
     [
@@ -107,6 +107,10 @@ class Affine(Layer):
         d(affine)/dx = dout * W.T
         d(affine)/dW = x.T * dout
         d(affine)/db = sum(dout, axis=0)
+
+        Tips: for a large batch, dx can be computed by
+        `common.parallel.parallel_over_batch` and dW, db by
+        `common.parallel.parallel_sum_over_batch` over the batch slices.
         """
         raise NotImplementedError("The backward method is not implemented yet.")
 
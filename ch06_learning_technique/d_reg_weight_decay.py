@@ -13,8 +13,32 @@ import numpy as np
 from numpy.typing import NDArray
 from tqdm import tqdm
 
+from common.async_evaluation import AsyncEvaluator, EvaluationResult
 from common.base import Layer, Optimizer, Trainer
-from common.default_type_array import np_float
+from common.data_loader import LoaderStats, PrefetchBatchLoader
+from common.dataset import BatchSampler, Dataset
+from common.default_type_array import (
+    dtype_policy,
+    get_default_type,
+    np_float,
+)
+from common.evaluation import (
+    ClassificationMetrics,
+    evaluate_in_batches,
+    evaluate_metrics,
+    single_label_accuracy,
+)
+from common.grad_accumulation import GradientAccumulator
+from common.mixed_precision import MixedPrecisionOptimizer
+from common.process_batch_loader import ProcessBatchLoader
+from common.profiler import (
+    TracedIterable,
+    counter,
+    instrument,
+    instrument_layer,
+    is_enabled,
+    span,
+)
 
 WEIGHT_START_WITH = "W"
 
@@ -30,6 +54,11 @@ class Sequential(Layer):
     def __init__(self, layers: tuple[Layer, ...]) -> None:
         self._layers = layers
 
+    @property
+    def layers(self) -> tuple[Layer, ...]:
+        """Return the layers in order."""
+        return self._layers
+
     def named_params(self) -> dict[str, NDArray[np.floating]]:
         """Return the parameters of the network.
 
@@ -77,18 +106,26 @@ class LayerTrainer(Trainer):
             [NDArray[np.floating], NDArray[np.floating]], float
         ],
         optimizer: Optimizer,
-        x_train: NDArray[np.floating],
-        t_train: NDArray[np.floating],
-        x_test: NDArray[np.floating],
-        t_test: NDArray[np.floating],
+        x_train: NDArray[np.floating | np.integer] | Dataset,
+        t_train: NDArray[np.floating | np.integer] | None,
+        x_test: NDArray[np.floating | np.integer] | Dataset,
+        t_test: NDArray[np.floating | np.integer] | None,
         epochs: int,
         mini_batch_size: int,
         weight_decay_lambda: float | None = None,
+        accumulation_steps: int = 1,
         evaluate_train_data: bool = True,
         evaluate_test_data: bool = True,
         evaluated_sample_per_epoch: int | None = None,
+        evaluation_batch_size: int | None = None,
+        async_evaluation: bool = False,
         verbose: bool = False,
         name: str = "",
+        prefetch_batches: int = 0,
+        batch_transform: Callable[..., NDArray[np.floating]] | None = None,
+        input_scale: float = 1.0,
+        batch_sampler: BatchSampler | None = None,
+        augmentation_workers: int = 0,
     ) -> None:
         """Initialize the trainer.
 
@@ -99,35 +136,80 @@ class LayerTrainer(Trainer):
                 The loss function to be used for training.
             optimizer : Optimizer
                 The optimizer to be used for training.
-            x_train : NDArray[np.floating]
-                Training data.
-            t_train : NDArray[np.floating]
-                Training labels.
-            x_test : NDArray[np.floating]
-                Test data.
-            t_test : NDArray[np.floating]
-                Test labels.
+            x_train : NDArray[np.floating | np.integer] | Dataset
+                Training data, or a dataset of both the training data and
+                labels, like the memory maps of a dataset larger than the
+                memory. It can be an integer array (like the uint8 images),
+                which is converted to the float type of the network
+                mini-batch by mini-batch.
+            t_train : NDArray[np.floating | np.integer] | None
+                Training labels, None if x_train is a dataset.
+            x_test : NDArray[np.floating | np.integer] | Dataset
+                Test data, or a dataset of both the test data and labels.
+            t_test : NDArray[np.floating | np.integer] | None
+                Test labels, None if x_test is a dataset.
             epochs : int
                 Number of epochs.
             mini_batch_size : int
                 Mini-batch size.
             weight_decay_lambda : float | None
                 The lambda for the weight decay, using L2 regularization.
+            accumulation_steps : int
+                Number of the mini-batches whose gradients are accumulated for
+                one update of the parameters, i.e. the effective batch size is
+                accumulation_steps * mini_batch_size, while the memory of the
+                forward and backward pass depends on the mini_batch_size only.
             evaluate_train_data : bool
                 If True, evaluate the training data.
             evaluate_test_data : bool
                 If True, evaluate the test data.
             evaluated_sample_per_epoch : int | None
                 Number of samples to evaluate per epoch.
+            evaluation_batch_size : int | None
+                Batch size for the evaluation, which can be larger than the
+                mini-batch size because no gradient is kept. If None, use the
+                mini-batch size.
+            async_evaluation : bool
+                If True, evaluate the snapshot of the parameters every epoch in
+                a background process, while the training goes on. The history
+                is filled when the results arrive, and completed at the end of
+                `train`. The evaluation_fn has to be picklable.
             verbose : bool
                 If True, print the training progress.
             name : str
                 Name of the trainer, for process bar and logging.
+            prefetch_batches : int
+                Number of the mini-batches built ahead by a background
+                thread, 0 means building them in the training thread.
+            batch_transform : Callable[..., NDArray] | None
+                An optional transform (like the augmentation) for the x of
+                every training mini-batch.
+            input_scale : float
+                The factor multiplied with the integer x_train and x_test
+                after the conversion, like 1 / 255 for the uint8 images.
+            batch_sampler : BatchSampler | None
+                The sampler of the training mini-batches, like a block
+                shuffling one for reading a memory map mostly sequentially.
+                Its batch size has to be mini_batch_size.
+            augmentation_workers : int
+                Number of the worker processes building the training
+                mini-batches into shared memory, i.e. a fresh augmentation
+                (the batch_transform) of every mini-batch without a
+                materialized augmented dataset. The batch_transform is then
+                called with (x, rng) and has to be picklable, like the
+                `BatchAugmenter`. 0 uses the thread loader.
         """
         self._network = network
         self._loss = loss
         self._evaluation_fn = evaluation_fn
         self._optimizer = optimizer
+        if isinstance(x_train, Dataset):
+            t_train = x_train.t
+            x_train = x_train.x
+        if isinstance(x_test, Dataset):
+            t_test = x_test.t
+            x_test = x_test.x
+        assert t_train is not None and t_test is not None
         self._x_train = x_train
         self._t_train = t_train
         self._x_test = x_test
@@ -140,10 +222,51 @@ class LayerTrainer(Trainer):
         self._evaluate_train_data = evaluate_train_data
         self._evaluate_test_data = evaluate_test_data
         self._evaluated_sample_per_epoch = evaluated_sample_per_epoch
+        self._evaluation_batch_size = evaluation_batch_size or mini_batch_size
+        self._async_evaluation = async_evaluation
+        self._async_evaluator: AsyncEvaluator | None = None
         self._verbose = verbose
         self._name = name
+        self._input_scale = input_scale
+        self.last_metrics: ClassificationMetrics | None = None
+        """The metrics of the last evaluation by `single_label_accuracy`."""
+
+        # the integer x is kept in memory, only the mini-batches are floats
+        x_dtype = None
+        if np.issubdtype(x_train.dtype, np.integer):
+            with dtype_policy(network.dtype_policy):
+                x_dtype = get_default_type()
+        self._train_loader: PrefetchBatchLoader | ProcessBatchLoader
+        if augmentation_workers > 0:
+            self._train_loader = ProcessBatchLoader(
+                x_train,
+                t_train,
+                batch_size=mini_batch_size,
+                num_workers=augmentation_workers,
+                prefetch=max(prefetch_batches, 1),
+                transform=batch_transform,
+                x_dtype=x_dtype,
+                x_scale=input_scale if x_dtype is not None else 1.0,
+                sampler=batch_sampler,
+            )
+        else:
+            self._train_loader = PrefetchBatchLoader(
+                x_train,
+                t_train,
+                batch_size=mini_batch_size,
+                prefetch=prefetch_batches,
+                transform=batch_transform,
+                x_dtype=x_dtype,
+                x_scale=input_scale if x_dtype is not None else 1.0,
+                sampler=batch_sampler,
+            )
 
         self._net_params = self._network.named_params()
+        self._grad_accumulator: GradientAccumulator | None = None
+        if accumulation_steps > 1:
+            self._grad_accumulator = GradientAccumulator(
+                self._net_params, accumulation_steps
+            )
         self._reset_history()
 
     def _reset_history(self) -> None:
@@ -159,11 +282,33 @@ class LayerTrainer(Trainer):
         # tqdm progress bar for epochs
         desc = self._name if self._name else "Training Progress"
         epoch_bar = tqdm(range(self._epochs), desc=desc)
-        for epoch in epoch_bar:
-            self._train_one_epoch()
-
-            # output the necessary logging if necessary
-            self._evaluate_if_necessary(epoch)
+        datasets = self._evaluated_datasets()
+        if self._async_evaluation and datasets:
+            self._async_evaluator = AsyncEvaluator(
+                self._network,
+                self._evaluation_fn,
+                [(x, t) for _, x, t in datasets],
+                batch_size=self._evaluation_batch_size,
+                x_scale=self._input_scale,
+            )
+        # the layers and the phases are traced only if profiling
+        undo_instrument = self._instrument() if is_enabled() else None
+        try:
+            # run within the float types of the network
+            with dtype_policy(self._network.dtype_policy):
+                for epoch in epoch_bar:
+                    with span("epoch", epoch=epoch):
+                        self._train_one_epoch()
+
+                        # output the necessary logging if necessary
+                        self._evaluate_if_necessary(epoch)
+        finally:
+            if undo_instrument is not None:
+                undo_instrument()
+            self._train_loader.close()
+            if self._async_evaluator is not None:
+                evaluator, self._async_evaluator = self._async_evaluator, None
+                self._record_async_results(evaluator.close())
         self._network.train(False)
 
     def get_final_accuracy(self) -> tuple[float, float]:
@@ -189,75 +334,158 @@ class LayerTrainer(Trainer):
         """Get the history of the training and test accuracy."""
         return self.train_acc_history, self.test_acc_history
 
-    def _evaluate_if_necessary(self, epoch: int) -> None:
-        if not self._evaluate_train_data and not self._evaluate_test_data:
-            return
+    @property
+    def loader_stats(self) -> LoaderStats:
+        """Return the statistics of the mini-batch loader, like the stall."""
+        return self._train_loader.stats
 
-        # set the network to the evaluation mode
-        self._network.train(False)
-        # output the training accuracy if necessary
+    def _instrument(self) -> Callable[[], None]:
+        """Trace the phases and the layer calls, return the undo.
+
+        The spans are "data" (waiting for a mini-batch), "forward" and
+        "backward" of the network with the nested layer calls, "loss",
+        "loss.backward" and "optimizer".
+        """
+        loader = self._train_loader
+        self._train_loader = TracedIterable(loader, "data")  # type: ignore
+        restores = [
+            instrument_layer(self._network, "forward", "backward"),
+            instrument_layer(self._loss, "loss", "loss.backward"),
+            instrument(self._optimizer, {"one_step": "optimizer"}),
+        ]
+
+        def restore() -> None:
+            self._train_loader = loader
+            for undo in restores:
+                undo()
+
+        return restore
+
+    def _evaluated_datasets(
+        self,
+    ) -> list[
+        tuple[
+            str,
+            NDArray[np.floating | np.integer],
+            NDArray[np.floating | np.integer],
+        ]
+    ]:
+        """Return the (process, x, t) evaluated every epoch."""
+        num = self._evaluated_sample_per_epoch
+        datasets = []
         if self._evaluate_train_data:
-            x_train_sample, t_train_sample = self._x_train, self._t_train
-            if self._evaluated_sample_per_epoch is not None:
-                num = self._evaluated_sample_per_epoch
-                x_train_sample = self._x_train[:num]
-                t_train_sample = self._t_train[:num]
-
-            train_acc = self._evaluate(
-                x=x_train_sample,
-                t=t_train_sample,
-                process=f"Epoch {epoch + 1} Training",
+            datasets.append(
+                ("Training", self._x_train[:num], self._t_train[:num])
             )
-            self.train_acc_history.append(train_acc)
-
-        # output the test accuracy if necessary
         if self._evaluate_test_data:
-            x_test_sample, t_test_sample = self._x_test, self._t_test
-            if self._evaluated_sample_per_epoch is not None:
-                num = self._evaluated_sample_per_epoch
-                x_test_sample = self._x_test[:num]
-                t_test_sample = self._t_test[:num]
-            test_acc = self._evaluate(
-                x=x_test_sample,
-                t=t_test_sample,
-                process=f"Epoch {epoch + 1} Test",
-            )
-            self.test_acc_history.append(test_acc)
+            datasets.append(("Test", self._x_test[:num], self._t_test[:num]))
+        return datasets
+
+    def _evaluate_if_necessary(self, epoch: int) -> None:
+        datasets = self._evaluated_datasets()
+        if not datasets:
+            return
+
+        if self._async_evaluator is not None:
+            self._async_evaluator.submit(epoch, self._net_params)
+            self._record_async_results(self._async_evaluator.results())
+            return
 
+        # set the network to the evaluation mode
+        self._network.train(False)
+        accuracies = [
+            self._evaluate(x=x, t=t, process=f"Epoch {epoch + 1} {process}")
+            for process, x, t in datasets
+        ]
+        self._record_accuracies(accuracies)
         # set the network to the training mode
         self._network.train(True)
 
+    def _record_async_results(self, results: list[EvaluationResult]) -> None:
+        for epoch, accuracies in results:
+            if self._verbose:
+                for (process, _, _), acc in zip(
+                    self._evaluated_datasets(), accuracies
+                ):
+                    print(f"Epoch {epoch + 1} {process}: Acc {acc:.4f}")
+            self._record_accuracies(accuracies)
+
+    def _record_accuracies(self, accuracies: list[float]) -> None:
+        """Append the accuracies in the order of `_evaluated_datasets`."""
+        remaining = iter(accuracies)
+        if self._evaluate_train_data:
+            self.train_acc_history.append(next(remaining))
+            counter("train_acc", self.train_acc_history[-1])
+        if self._evaluate_test_data:
+            self.test_acc_history.append(next(remaining))
+            counter("test_acc", self.test_acc_history[-1])
+
     def _evaluate(
-        self, x: NDArray[np.floating], t: NDArray[np.floating], process: str
+        self,
+        x: NDArray[np.floating | np.integer],
+        t: NDArray[np.floating | np.integer],
+        process: str,
     ) -> float:
-        num_batch = x.shape[0] // self._mini_batch_size
-        acc_sum = 0.0
-        loss_sum = 0.0
-        start_idx = 0
-        for _ in range(num_batch):
-            end_idx = start_idx + self._mini_batch_size
-            idx_range = range(start_idx, end_idx)
-            y = self._network.forward(x[idx_range])
-            acc_sum += self._evaluation_fn(y, t[idx_range])
-            if self._verbose:
-                loss_sum += self._loss.forward_to_loss(y, t[idx_range])
-            start_idx = end_idx
+        """Evaluate the network on all samples of (x, t), batch by batch.
 
-        acc = acc_sum / num_batch
+        The single-label accuracy is accumulated into `last_metrics`, like
+        the confusion matrix, the other evaluation_fn is weighted by the
+        sizes of the batches.
+        """
+        loss_layer = self._loss if self._verbose else None
+        with (
+            dtype_policy(self._network.dtype_policy),
+            span("eval", process=process),
+        ):
+            if self._evaluation_fn is single_label_accuracy:
+                self.last_metrics = evaluate_metrics(
+                    self._network,
+                    x,
+                    t,
+                    batch_size=self._evaluation_batch_size,
+                    loss=loss_layer,
+                    x_scale=self._input_scale,
+                )
+                acc, loss = self.last_metrics.accuracy, self.last_metrics.loss
+            else:
+                acc, loss = evaluate_in_batches(
+                    self._network,
+                    self._evaluation_fn,
+                    x,
+                    t,
+                    batch_size=self._evaluation_batch_size,
+                    loss=loss_layer,
+                    x_scale=self._input_scale,
+                )
         if self._verbose:
-            print(f"{process}: Acc {acc:.4f}; Loss {loss_sum / num_batch:.4f}")
+            print(f"{process}: Acc {acc:.4f}; Loss {loss:.4f}")
         return acc
 
+    def _loss_scale(self) -> float:
+        """Return the dout of the loss for the backward pass.
+
+        It's the loss scale of the mixed precision, 1 for the other optimizers.
+        """
+        if isinstance(self._optimizer, MixedPrecisionOptimizer):
+            return self._optimizer.loss_scale
+        return 1.0
+
     def _train_one_epoch(self) -> None:
         """Train the network for one epoch.
 
         Steps every iteration:
-            - Get the mini-batch
+            - Get the mini-batch, iterate `self._train_loader` for the
+              shuffled (x_batch, t_batch) of the epoch
+            - Call `start_micro_batch` of `self._grad_accumulator` if it's not
+              None, i.e. accumulating the gradients
             - Forward
             - Calculate the loss (with weight decay if necessary)
-            - Backward
-            - Get the gradient of the parameters (use weight decay if necessary)
-            - Update the parameters once
+            - Backward, from dout = `self._loss_scale()`
+            - Get the gradient of the parameters (use weight decay if necessary,
+              with the lambda times the loss scale)
+            - Update the parameters once. With the accumulator, `add` the
+              gradients instead, and update by its `mean_grads` when it's
+              `ready`, and at the end of the epoch if `num_pending` > 0
         """
         raise NotImplementedError
 
@@ -1,6 +1,51 @@
+"""Hyperparameter optimization by random search.
+
+Every trial trains a network with sampled hyperparameters, and the trials are
+independent, so they can run in a pool of processes:
+
+    main:    sample the trials -> publish the data in shared memory once
+    workers: attach the data, limit the BLAS threads -> train a trial
+    main:    the results stream back as the trials finish
+
+Every trial is sampled up front with its own seed, and the global NumPy
+random state is seeded by it before the trial, so a trial has the same result
+whichever process runs it, and in whichever order.
+
+Most trials are clearly bad after a few epochs, so `successive_halving`
+trains many trials for a small number of epochs, and promotes the best
+fraction to more epochs, and `hyperband` runs it with several trade-offs
+between the number of the trials and the epochs.
+
+Usage:
+    results = random_search(
+        train_trial, 100, x_train, t_train, x_val, t_val,
+        weight_decay_log_bounds=(-8, -4), learning_rate_log_bounds=(-6, -2),
+        epochs=50, mini_batch_size=100, seed=0, num_workers=4,
+    )
+"""
+
+import math
+import multiprocessing
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+
 import numpy as np
 from numpy.typing import NDArray
 
+from common.dataset import ArrayDataset, Dataset, fingerprint_arrays
+from common.result_cache import (
+    History,
+    ResultCache,
+    code_version,
+    stable_hash,
+)
+from common.shared_dataset import SharedArrays, SharedDataset
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # optional dependency
+    threadpool_limits = None
+
 
 def hyper_parameter_optimization(
     optimization_trial: int,
@@ -20,6 +65,9 @@ def hyper_parameter_optimization(
     ch06_learning_technique/d_reg_weight_decay.py, to find the best weight decay
     and learning rate for the model.
 
+    Tips: write the training of one trial as a `TrialFn`, then
+    `random_search` runs the trials, sequentially or in parallel.
+
     Parameters:
         optimization_trial (int): Number of optimization trials
         x_train (NDArray[np.floating]): Training data.
@@ -43,3 +91,569 @@ def hyper_parameter_optimization(
             tuple[list[float], list[float]]: Train/validation accuracy history.
     """
     raise NotImplementedError
+
+
+@dataclass(frozen=True)
+class Trial:
+    """The sampled hyperparameters of a trial."""
+
+    index: int
+    learning_rate: float
+    weight_decay: float
+    seed: int
+
+    @property
+    def key(self) -> str:
+        """Return the key of the result dictionary."""
+        return (
+            f"lr:{self.learning_rate:.6g}, weight decay:{self.weight_decay:.6g}"
+        )
+
+
+TrialFn = Callable[[Trial, Dataset, Dataset, int, int], History]
+"""Train a trial: fn(trial, train, test, epochs, mini_batch_size) -> history.
+
+It runs in a worker process, so it has to be picklable, like a function of a
+module.
+"""
+
+
+def sample_trials(
+    optimization_trial: int,
+    weight_decay_log_bounds: tuple[int, int],
+    learning_rate_log_bounds: tuple[int, int],
+    seed: int | None = None,
+) -> list[Trial]:
+    """Sample the hyperparameters log-uniformly, and a seed for every trial.
+
+    See `hyper_parameter_optimization` for the parameters.
+    """
+    rng = np.random.default_rng(seed)
+    weight_decays = 10 ** rng.uniform(
+        *weight_decay_log_bounds, size=optimization_trial
+    )
+    learning_rates = 10 ** rng.uniform(
+        *learning_rate_log_bounds, size=optimization_trial
+    )
+    seeds = rng.integers(0, 2**31 - 1, size=optimization_trial)
+    return [
+        Trial(i, float(lr), float(wd), int(trial_seed))
+        for i, (lr, wd, trial_seed) in enumerate(
+            zip(learning_rates, weight_decays, seeds)
+        )
+    ]
+
+
+def run_trials(
+    trial_fn: TrialFn,
+    trials: list[Trial],
+    x_train: NDArray[Any],
+    t_train: NDArray[Any],
+    x_test: NDArray[Any],
+    t_test: NDArray[Any],
+    epochs: int,
+    mini_batch_size: int,
+    num_workers: int = 0,
+    blas_threads: int | None = 1,
+    context: Any | None = None,
+    cache: ResultCache | None = None,
+    code: tuple[Any, ...] = (),
+) -> Iterator[tuple[Trial, History]]:
+    """Run the trials, and yield their results as they finish.
+
+    Parameters:
+        trial_fn : TrialFn
+            The training of a trial.
+        trials : list[Trial]
+            The trials, like from `sample_trials`.
+        x_train, t_train, x_test, t_test : NDArray
+            The data, published once into shared memory for the workers, which
+            get read-only `SharedDataset`s.
+        epochs : int
+            Number of epochs.
+        mini_batch_size : int
+            Batch size.
+        num_workers : int
+            The number of the worker processes, 0 runs the trials in order in
+            the current process.
+        blas_threads : int | None
+            The number of the BLAS threads of a worker, so the workers don't
+            oversubscribe the cores. None doesn't limit them. It is ignored
+            if the `threadpoolctl` is not installed.
+        context : multiprocessing context | None
+            The context for creating the workers.
+        cache : ResultCache | None
+            The cache of the histories, keyed by the trial, the epochs, the
+            batch size, the data and the source of trial_fn and code. The
+            cached trials are yielded first.
+        code : tuple[Any, ...]
+            The functions, classes or modules which trial_fn depends on, like
+            the layers and the trainer. A change of their source (or of the
+            module of trial_fn) invalidates the cache, see `code_version`.
+
+    Yields:
+        tuple[Trial, History]: The trial and its accuracy history, in the
+            order of finishing.
+    """
+    with _TrialRunner(
+        (x_train, t_train, x_test, t_test),
+        num_workers,
+        blas_threads,
+        context,
+    ) as runner:
+        yield from runner.run(
+            trial_fn, trials, epochs, mini_batch_size, cache, code
+        )
+
+
+class _TrialRunner:
+    """The data and the workers of a search, shared by all its rungs.
+
+    The data is published into shared memory and the pool is started on the
+    first trial to run, so a search whose trials are all cached starts no
+    worker.
+    """
+
+    def __init__(
+        self,
+        data: tuple[NDArray[Any], NDArray[Any], NDArray[Any], NDArray[Any]],
+        num_workers: int,
+        blas_threads: int | None,
+        context: Any | None,
+    ) -> None:
+        self._data = data
+        self._num_workers = num_workers
+        self._blas_threads = blas_threads
+        self._context = context
+        self._datasets: tuple[Dataset, Dataset] | None = None
+        self._shared: SharedArrays | None = None
+        self._pool: Any | None = None
+        # the hashes of the cache keys, computed once per search
+        self._fingerprint: str | None = None
+        self._code_versions: dict[tuple[Any, ...], str] = {}
+
+    def run(
+        self,
+        trial_fn: TrialFn,
+        trials: list[Trial],
+        epochs: int,
+        mini_batch_size: int,
+        cache: ResultCache | None = None,
+        code: tuple[Any, ...] = (),
+    ) -> Iterator[tuple[Trial, History]]:
+        """Run the trials, see `run_trials`."""
+        if cache is None:
+            yield from self._run(trial_fn, trials, epochs, mini_batch_size)
+            return
+
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint_arrays(*self._data)
+        versioned = (trial_fn, *code)
+        if versioned not in self._code_versions:
+            self._code_versions[versioned] = code_version(*versioned)
+        common_key = stable_hash(
+            trial_fn,
+            self._code_versions[versioned],
+            epochs,
+            mini_batch_size,
+            self._fingerprint,
+        )
+        keys = {trial.index: stable_hash(common_key, trial) for trial in trials}
+        missing = []
+        for trial in trials:
+            cached = cache.get(keys[trial.index])
+            if cached is None:
+                missing.append(trial)
+            else:
+                yield trial, cached.history
+        for trial, history in self._run(
+            trial_fn, missing, epochs, mini_batch_size
+        ):
+            cache.put(keys[trial.index], {}, history, meta={"trial": trial.key})
+            yield trial, history
+
+    def close(self) -> None:
+        """Stop the workers and release the shared memory."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+    def __enter__(self) -> "_TrialRunner":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def _run(
+        self,
+        trial_fn: TrialFn,
+        trials: list[Trial],
+        epochs: int,
+        mini_batch_size: int,
+    ) -> Iterator[tuple[Trial, History]]:
+        if not trials:
+            return
+        x_train, t_train, x_test, t_test = self._data
+        if self._num_workers == 0:
+            if self._datasets is None:
+                self._datasets = (
+                    ArrayDataset(x_train, t_train),
+                    ArrayDataset(x_test, t_test),
+                )
+            train, test = self._datasets
+            for trial in trials:
+                yield (
+                    trial,
+                    _run_trial(
+                        trial_fn, trial, train, test, epochs, mini_batch_size
+                    ),
+                )
+            return
+
+        if self._pool is None:
+            ctx = (
+                self._context
+                if self._context is not None
+                else multiprocessing.get_context()
+            )
+            self._shared = SharedArrays(
+                x_train=x_train, t_train=t_train, x_test=x_test, t_test=t_test
+            )
+            self._pool = ctx.Pool(
+                self._num_workers,
+                initializer=_init_trial_worker,
+                initargs=(self._shared, self._blas_threads),
+            )
+        tasks = [(trial_fn, trial, epochs, mini_batch_size) for trial in trials]
+        yield from self._pool.imap_unordered(_run_trial_in_worker, tasks)
+
+
+def random_search(
+    trial_fn: TrialFn,
+    optimization_trial: int,
+    x_train: NDArray[Any],
+    t_train: NDArray[Any],
+    x_test: NDArray[Any],
+    t_test: NDArray[Any],
+    weight_decay_log_bounds: tuple[int, int],
+    learning_rate_log_bounds: tuple[int, int],
+    epochs: int,
+    mini_batch_size: int,
+    seed: int | None = None,
+    num_workers: int = 0,
+    blas_threads: int | None = 1,
+    verbose: bool = False,
+    context: Any | None = None,
+    cache: ResultCache | None = None,
+    code: tuple[Any, ...] = (),
+) -> dict[str, History]:
+    """Optimize hyperparameters using random search, in parallel.
+
+    The result is the same as running the trials sequentially with the seed,
+    and has the format of `hyper_parameter_optimization`, in the order of the
+    trials. See `sample_trials` and `run_trials` for the parameters.
+    """
+    trials = sample_trials(
+        optimization_trial,
+        weight_decay_log_bounds,
+        learning_rate_log_bounds,
+        seed,
+    )
+    histories: dict[int, History] = {}
+    for trial, history in run_trials(
+        trial_fn,
+        trials,
+        x_train,
+        t_train,
+        x_test,
+        t_test,
+        epochs,
+        mini_batch_size,
+        num_workers,
+        blas_threads,
+        context,
+        cache,
+        code,
+    ):
+        histories[trial.index] = history
+        if verbose:
+            test_acc = history[1][-1] if history[1] else float("nan")
+            print(
+                f"trial {len(histories)}/{len(trials)} | {trial.key} | "
+                f"test acc: {test_acc:.4f}"
+            )
+    return {trial.key: histories[trial.index] for trial in trials}
+
+
+@dataclass
+class SearchBudget:
+    """The epochs of a search, compared with the full random search."""
+
+    epochs_used: int = 0
+    """The epochs trained by all trials of the search."""
+    epochs_retrained: int = 0
+    """The part of epochs_used which trains a promoted trial again.
+
+    A `TrialFn` returns the history only, so a promoted trial is trained from
+    the start, repeating the epochs of its lower rung.
+    """
+    epochs_full: int = 0
+    """The epochs of training the same trials with all epochs."""
+
+    @property
+    def epochs_saved(self) -> int:
+        return self.epochs_full - self.epochs_used
+
+
+def rung_epochs(min_epochs: int, max_epochs: int, eta: int) -> list[int]:
+    """Return the epochs of the rungs: min_epochs * eta^i, up to max_epochs."""
+    assert 1 <= min_epochs <= max_epochs and eta >= 2
+    epochs = []
+    budget = min_epochs
+    while budget < max_epochs:
+        epochs.append(budget)
+        budget *= eta
+    epochs.append(max_epochs)
+    return epochs
+
+
+def successive_halving(
+    trial_fn: TrialFn,
+    optimization_trial: int,
+    x_train: NDArray[Any],
+    t_train: NDArray[Any],
+    x_test: NDArray[Any],
+    t_test: NDArray[Any],
+    weight_decay_log_bounds: tuple[int, int],
+    learning_rate_log_bounds: tuple[int, int],
+    min_epochs: int,
+    max_epochs: int,
+    mini_batch_size: int,
+    eta: int = 3,
+    seed: int | None = None,
+    num_workers: int = 0,
+    blas_threads: int | None = 1,
+    verbose: bool = False,
+    context: Any | None = None,
+    cache: ResultCache | None = None,
+    code: tuple[Any, ...] = (),
+) -> tuple[dict[str, History], SearchBudget]:
+    """Optimize hyperparameters by successive halving of the random trials.
+
+    All trials are trained for min_epochs, the best 1 / eta of them (by the
+    last test accuracy) are trained again for eta times more epochs, and so
+    on, until the survivors are trained for max_epochs. A promoted trial is
+    trained from the start with its seed, so its history begins like the one
+    of the lower rung, and the repeated epochs are counted in the
+    `SearchBudget.epochs_used` and `SearchBudget.epochs_retrained`.
+
+    The data is published and the workers are started once for all rungs.
+
+    Parameters:
+        min_epochs : int
+            The epochs of the first rung.
+        max_epochs : int
+            The epochs of the last rung, like the epochs of `random_search`.
+        eta : int
+            The factor of the epochs between the rungs, and the reduction of
+            the trials.
+        The other parameters are the ones of `random_search`.
+
+    Returns:
+        tuple[dict[str, History], SearchBudget]: The longest history of every
+            trial, in the format of `hyper_parameter_optimization`, and the
+            epochs used and saved compared with `random_search`.
+    """
+    trials = sample_trials(
+        optimization_trial,
+        weight_decay_log_bounds,
+        learning_rate_log_bounds,
+        seed,
+    )
+    with _TrialRunner(
+        (x_train, t_train, x_test, t_test),
+        num_workers,
+        blas_threads,
+        context,
+    ) as runner:
+        histories, budget = _successive_halving(
+            runner,
+            trial_fn,
+            trials,
+            rung_epochs(min_epochs, max_epochs, eta),
+            mini_batch_size,
+            eta,
+            cache,
+            code,
+            verbose,
+        )
+    if verbose:
+        print(f"epochs saved: {budget.epochs_saved}/{budget.epochs_full}")
+    return {trial.key: histories[trial.index] for trial in trials}, budget
+
+
+def hyperband(
+    trial_fn: TrialFn,
+    x_train: NDArray[Any],
+    t_train: NDArray[Any],
+    x_test: NDArray[Any],
+    t_test: NDArray[Any],
+    weight_decay_log_bounds: tuple[int, int],
+    learning_rate_log_bounds: tuple[int, int],
+    min_epochs: int,
+    max_epochs: int,
+    mini_batch_size: int,
+    eta: int = 3,
+    seed: int | None = None,
+    num_workers: int = 0,
+    blas_threads: int | None = 1,
+    verbose: bool = False,
+    context: Any | None = None,
+    cache: ResultCache | None = None,
+    code: tuple[Any, ...] = (),
+) -> tuple[dict[str, History], SearchBudget]:
+    """Optimize hyperparameters by Hyperband.
+
+    Successive halving with few epochs for the first rung may drop the
+    trials which learn slowly but well. Hyperband runs brackets from the most
+    aggressive one (many trials, starting with min_epochs) to a random search
+    (few trials, all with max_epochs), with about the same epochs each. The
+    number of the trials follows from the epochs and eta. The brackets share
+    the data and the workers.
+
+    See `successive_halving` for the parameters and the result.
+    """
+    s_max = len(rung_epochs(min_epochs, max_epochs, eta)) - 1
+    bracket_seeds = np.random.default_rng(seed).integers(
+        0, 2**31 - 1, size=s_max + 1
+    )
+    results: dict[str, History] = {}
+    budget = SearchBudget()
+    with _TrialRunner(
+        (x_train, t_train, x_test, t_test),
+        num_workers,
+        blas_threads,
+        context,
+    ) as runner:
+        for s in range(s_max, -1, -1):
+            num_trials = math.ceil((s_max + 1) / (s + 1) * eta**s)
+            first_epochs = max(min_epochs, max_epochs // eta**s)
+            trials = sample_trials(
+                num_trials,
+                weight_decay_log_bounds,
+                learning_rate_log_bounds,
+                int(bracket_seeds[s]),
+            )
+            if verbose:
+                print(
+                    f"bracket {s_max - s + 1}/{s_max + 1}: {num_trials} "
+                    f"trials from {first_epochs} epochs"
+                )
+            histories, bracket_budget = _successive_halving(
+                runner,
+                trial_fn,
+                trials,
+                rung_epochs(first_epochs, max_epochs, eta),
+                mini_batch_size,
+                eta,
+                cache,
+                code,
+                verbose,
+            )
+            budget.epochs_used += bracket_budget.epochs_used
+            budget.epochs_retrained += bracket_budget.epochs_retrained
+            budget.epochs_full += bracket_budget.epochs_full
+            for trial in trials:
+                history = histories[trial.index]
+                # a key of another bracket is kept if it's trained longer
+                if len(history[1]) >= len(results.get(trial.key, ([], []))[1]):
+                    results[trial.key] = history
+    if verbose:
+        print(f"epochs saved: {budget.epochs_saved}/{budget.epochs_full}")
+    return results, budget
+
+
+def _successive_halving(
+    runner: _TrialRunner,
+    trial_fn: TrialFn,
+    trials: list[Trial],
+    epochs_of_rungs: list[int],
+    mini_batch_size: int,
+    eta: int,
+    cache: ResultCache | None,
+    code: tuple[Any, ...],
+    verbose: bool,
+) -> tuple[dict[int, History], SearchBudget]:
+    histories: dict[int, History] = {}
+    budget = SearchBudget(epochs_full=len(trials) * epochs_of_rungs[-1])
+    alive = trials
+    for rung, epochs in enumerate(epochs_of_rungs):
+        for trial, history in runner.run(
+            trial_fn, alive, epochs, mini_batch_size, cache, code
+        ):
+            histories[trial.index] = history
+        budget.epochs_used += len(alive) * epochs
+        if rung > 0:
+            budget.epochs_retrained += len(alive) * epochs_of_rungs[rung - 1]
+        if verbose:
+            print(f"rung {rung}: {len(alive)} trials x {epochs} epochs")
+        if rung + 1 == len(epochs_of_rungs):
+            break
+        # the best by the last test accuracy, the earlier trial for a tie
+        alive = sorted(
+            alive,
+            key=lambda trial: (
+                -_last_accuracy(histories[trial.index]),
+                trial.index,
+            ),
+        )[: max(1, len(alive) // eta)]
+    return histories, budget
+
+
+def _last_accuracy(history: History) -> float:
+    return history[1][-1] if history[1] else -math.inf
+
+
+def _run_trial(
+    trial_fn: TrialFn,
+    trial: Trial,
+    train: Dataset,
+    test: Dataset,
+    epochs: int,
+    mini_batch_size: int,
+) -> History:
+    # the initializers of the layers use the global random state
+    np.random.seed(trial.seed)
+    return trial_fn(trial, train, test, epochs, mini_batch_size)
+
+
+# the datasets of a worker process, set by the initializer
+_worker_data: tuple[Dataset, Dataset] | None = None
+_worker_blas_limiter: Any | None = None
+
+
+def _init_trial_worker(shared: SharedArrays, blas_threads: int | None) -> None:
+    global _worker_data, _worker_blas_limiter
+    _worker_data = (
+        SharedDataset(shared, "x_train", "t_train"),
+        SharedDataset(shared, "x_test", "t_test"),
+    )
+    if blas_threads is not None and threadpool_limits is not None:
+        _worker_blas_limiter = threadpool_limits(
+            limits=blas_threads, user_api="blas"
+        )
+
+
+def _run_trial_in_worker(
+    task: tuple[TrialFn, Trial, int, int],
+) -> tuple[Trial, History]:
+    assert _worker_data is not None
+    trial_fn, trial, epochs, mini_batch_size = task
+    train, test = _worker_data
+    return trial, _run_trial(
+        trial_fn, trial, train, test, epochs, mini_batch_size
+    )
@@ -14,7 +14,8 @@ from common.default_type_array import np_array, np_float
 
 
 def f(x: NDArray[np.floating], y: NDArray[np.floating]) -> NDArray[np.floating]:
-    return x**2 / np_float(20.0) + y**2
+    z: NDArray[np.floating] = x**2 / np_float(20.0) + y**2
+    return z
 
 
 def df(
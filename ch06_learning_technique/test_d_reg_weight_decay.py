@@ -0,0 +1,311 @@
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from ch06_learning_technique.d_reg_weight_decay import LayerTrainer
+from common.base import Optimizer
+from common.dataset import ArrayDataset, BatchSampler
+from common.evaluation import single_label_accuracy
+from common.mixed_precision import DynamicLossScaler, MixedPrecisionOptimizer
+from common.profiler import profile
+from common.testing import (
+    Identity,
+    MeanSquareLoss,
+    PlainSGD,
+    Scale,
+    TanhLinear,
+)
+
+
+def test_evaluate_covers_all_samples() -> None:
+    # 7 samples predicted as class 0, the first 3 are right
+    t = np.array([0, 0, 0, 1, 1, 1, 1])
+    x = np.zeros((7, 2), dtype=np.float32)
+    x[:, 0] = 1.0
+    network = Identity()
+    trainer = LayerTrainer(
+        network=network,
+        loss=Identity(),
+        evaluation_fn=single_label_accuracy,
+        optimizer=PlainSGD(lr=0.0),
+        x_train=x,
+        t_train=t,
+        x_test=x,
+        t_test=t,
+        epochs=1,
+        mini_batch_size=2,
+        evaluation_batch_size=3,
+    )
+
+    acc = trainer._evaluate(x, t, process="test")
+
+    assert network.batch_sizes == [3, 3, 1]
+    assert np.isclose(acc, 3 / 7)
+    assert trainer.last_metrics is not None
+    np.testing.assert_array_equal(
+        trainer.last_metrics.confusion, [[3, 0], [4, 0]]
+    )
+
+
+class _FlipTrainer(LayerTrainer):
+    """A trainer whose epoch flips the preferred class of the network."""
+
+    def _train_one_epoch(self) -> None:
+        self._net_params["W1"][...] = self._net_params["W1"][:, ::-1].copy()
+
+
+def test_async_evaluation_fills_same_history() -> None:
+    x = np.ones((9, 2), dtype=np.float32)
+    x[:, 0] = 2.0
+    t = np.array([0, 0, 0, 0, 1, 1, 1, 1, 1])
+    histories = []
+    for async_evaluation in [False, True]:
+        network = Scale(np.ones((1, 2), dtype=np.float32), "W1")
+        network.named_params()["W1"][0, 1] = 3.0
+        trainer = _FlipTrainer(
+            network=network,
+            loss=Identity(),
+            evaluation_fn=single_label_accuracy,
+            optimizer=PlainSGD(lr=0.0),
+            x_train=x,
+            t_train=t,
+            x_test=x[:5],
+            t_test=t[:5],
+            epochs=3,
+            mini_batch_size=4,
+            async_evaluation=async_evaluation,
+        )
+        trainer.train()
+        histories.append(trainer.get_history_accuracy())
+
+    assert histories[0] == histories[1]
+    assert histories[0][0] == pytest.approx([4 / 9, 5 / 9, 4 / 9])
+
+
+def test_uint8_inputs_converted_per_batch() -> None:
+    x = np.array([[255, 0], [0, 255], [255, 51]], dtype=np.uint8)
+    # the labels are the indices too, the last one is wrong
+    t = np.array([0, 1, 2])
+    trainer = LayerTrainer(
+        network=Identity(),
+        loss=Identity(),
+        evaluation_fn=single_label_accuracy,
+        optimizer=PlainSGD(lr=0.0),
+        x_train=x,
+        t_train=t,
+        x_test=x,
+        t_test=t,
+        epochs=1,
+        mini_batch_size=2,
+        input_scale=1 / 255,
+    )
+
+    for x_batch, t_batch in trainer._train_loader:
+        assert x_batch.dtype == np.float32
+        np.testing.assert_allclose(x_batch, x[t_batch] / 255)
+    assert np.isclose(trainer._evaluate(x, t, process="test"), 2 / 3)
+
+
+def test_trainer_accepts_dataset_and_sampler() -> None:
+    x = np.eye(4, dtype=np.float32)
+    dataset = ArrayDataset(x, np.arange(4))
+    trainer = LayerTrainer(
+        network=Identity(),
+        loss=Identity(),
+        evaluation_fn=single_label_accuracy,
+        optimizer=PlainSGD(lr=0.0),
+        x_train=dataset,
+        t_train=None,
+        x_test=dataset,
+        t_test=None,
+        epochs=1,
+        mini_batch_size=2,
+        batch_sampler=BatchSampler(4, 2, block_size=2, seed=0),
+    )
+
+    batches = [t_batch.tolist() for _, t_batch in trainer._train_loader]
+    assert sorted(batches) == [[0, 1], [2, 3]]
+    assert trainer._evaluate(dataset.x, dataset.t, process="test") == 1.0
+
+
+def _negate(
+    x_batch: NDArray[np.floating], rng: np.random.Generator
+) -> NDArray[np.floating]:
+    return -x_batch
+
+
+def test_trainer_with_augmentation_workers() -> None:
+    x = np.arange(10, dtype=np.float32).reshape(5, 2)
+    t = np.arange(5)
+    trainer = LayerTrainer(
+        network=Identity(),
+        loss=Identity(),
+        evaluation_fn=single_label_accuracy,
+        optimizer=PlainSGD(lr=0.0),
+        x_train=x,
+        t_train=t,
+        x_test=x,
+        t_test=t,
+        epochs=1,
+        mini_batch_size=2,
+        batch_transform=_negate,
+        augmentation_workers=2,
+    )
+
+    try:
+        for x_batch, t_batch in trainer._train_loader:
+            np.testing.assert_array_equal(x_batch, -x[t_batch])
+    finally:
+        trainer._train_loader.close()
+
+
+def test_instrument_traces_the_phases() -> None:
+    t = np.array([0, 1, 0, 1])
+    x = np.eye(2, dtype=np.float32)[t]
+    network = Identity()
+    trainer = LayerTrainer(
+        network=network,
+        loss=Identity(),
+        evaluation_fn=single_label_accuracy,
+        optimizer=PlainSGD(lr=0.0),
+        x_train=x,
+        t_train=t,
+        x_test=x,
+        t_test=t,
+        epochs=1,
+        mini_batch_size=2,
+    )
+    loader = trainer._train_loader
+
+    with profile() as prof:
+        undo = trainer._instrument()
+        for x_batch, _ in trainer._train_loader:
+            network.forward(x_batch)
+        trainer._evaluate(x, t, process="test")
+        undo()
+    trainer._train_loader.close()
+
+    names = {event.name for event in prof.spans}
+    assert {"data", "forward", "eval"} <= names
+    assert trainer._train_loader is loader
+    assert "forward" not in vars(network)
+
+
+class _EpochTrainer(LayerTrainer):
+    """A trainer whose epoch follows the steps of `_train_one_epoch`.
+
+    The weight decay is left out, it's tested by the exercise.
+    """
+
+    def _train_one_epoch(self) -> None:
+        accumulator = self._grad_accumulator
+        for x_batch, t_batch in self._train_loader:
+            if accumulator is not None:
+                accumulator.start_micro_batch()
+            y = self._network.forward(x_batch)
+            self._loss.forward_to_loss(y, t_batch)
+            dout = self._loss.backward(
+                np.full((1,), self._loss_scale(), dtype=y.dtype)
+            )
+            self._network.backward(dout)
+            grads = self._network.param_grads()
+            if accumulator is None:
+                self._optimizer.one_step(self._net_params, grads)
+                continue
+            accumulator.add(grads, x_batch.shape[0])
+            if accumulator.ready:
+                self._optimizer.one_step(
+                    self._net_params, accumulator.mean_grads()
+                )
+        if accumulator is not None and accumulator.num_pending > 0:
+            self._optimizer.one_step(self._net_params, accumulator.mean_grads())
+
+
+def _regression_data(
+    num_samples: int,
+) -> tuple[NDArray[np.floating], NDArray[np.floating]]:
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((num_samples, 3)).astype(np.float32)
+    t = rng.standard_normal((num_samples, 2)).astype(np.float32)
+    return x, t
+
+
+def _initial_weights() -> tuple[NDArray[np.floating], NDArray[np.floating]]:
+    rng = np.random.default_rng(1)
+    w = rng.standard_normal((3, 2)).astype(np.float32)
+    b = rng.standard_normal(2).astype(np.float32)
+    return w, b
+
+
+def _train_regression(
+    mini_batch_size: int,
+    prefetch_batches: int = 0,
+    accumulation_steps: int = 1,
+    optimizer: Optimizer | None = None,
+) -> tuple[dict[str, NDArray[np.floating]], LayerTrainer]:
+    x, t = _regression_data(10)
+    w, b = _initial_weights()
+    network = TanhLinear(w, b)
+    trainer = _EpochTrainer(
+        network=network,
+        loss=MeanSquareLoss(),
+        evaluation_fn=single_label_accuracy,
+        optimizer=optimizer or PlainSGD(lr=0.1),
+        x_train=x,
+        t_train=t,
+        x_test=x,
+        t_test=t,
+        epochs=2,
+        mini_batch_size=mini_batch_size,
+        accumulation_steps=accumulation_steps,
+        evaluate_train_data=False,
+        evaluate_test_data=False,
+        prefetch_batches=prefetch_batches,
+        batch_sampler=BatchSampler(10, mini_batch_size, shuffle=False),
+    )
+    trainer.train()
+    return network.named_params(), trainer
+
+
+@pytest.mark.parametrize("prefetch_batches", [0, 2])
+def test_train_through_the_prefetch_loader(prefetch_batches: int) -> None:
+    params, trainer = _train_regression(4, prefetch_batches=prefetch_batches)
+    assert trainer.loader_stats.batches == 2 * 3
+
+    # the same updates, mini-batch by mini-batch in order
+    x, t = _regression_data(10)
+    w, b = _initial_weights()
+    network, loss = TanhLinear(w, b), MeanSquareLoss()
+    for _ in range(2):
+        for start in range(0, 10, 4):
+            y = network.forward(x[start : start + 4])
+            loss.forward_to_loss(y, t[start : start + 4])
+            network.backward(loss.backward(np.ones((1,), dtype=y.dtype)))
+            PlainSGD(lr=0.1).one_step(
+                network.named_params(), network.param_grads()
+            )
+    for key, value in network.named_params().items():
+        np.testing.assert_allclose(params[key], value, rtol=1e-6)
+
+
+def test_train_with_accumulated_gradients() -> None:
+    # 5 micro-batches of 2 per epoch, updated by 4, 4 and the last 2 samples
+    params, _ = _train_regression(2, accumulation_steps=2)
+    expected, _ = _train_regression(4)
+    for key, value in expected.items():
+        np.testing.assert_allclose(params[key], value, rtol=1e-5)
+
+
+def test_train_with_the_loss_scale() -> None:
+    # the master weights are created from the initial weights
+    optimizer = MixedPrecisionOptimizer(
+        PlainSGD(lr=0.1),
+        {"w": _initial_weights()[0], "b": _initial_weights()[1]},
+        DynamicLossScaler(init_scale=1024.0),
+    )
+    params, _ = _train_regression(4, optimizer=optimizer)
+    # the scaled gradients are unscaled by the optimizer
+    expected, _ = _train_regression(4)
+    for key, value in expected.items():
+        np.testing.assert_allclose(params[key], value, rtol=1e-5)
+    assert optimizer.loss_scaler.scale == 1024.0
@@ -1,10 +1,27 @@
+from pathlib import Path
+from typing import Any
+
 import matplotlib.pyplot as plt
 import numpy as np
+import pytest
 from numpy.typing import NDArray
 
+from ch06_learning_technique import e_hyper_parameter
 from ch06_learning_technique.e_hyper_parameter import (
+    History,
+    SearchBudget,
+    Trial,
     hyper_parameter_optimization,
+    hyperband,
+    random_search,
+    run_trials,
+    rung_epochs,
+    sample_trials,
+    successive_halving,
 )
+from common.dataset import Dataset
+from common.result_cache import ResultCache
+from common.shared_dataset import SharedArrays
 from dataset.mnist import load_mnist
 
 
@@ -54,6 +71,278 @@ def test_hyper_parameter_optimization() -> None:
         _plot_result(results)
 
 
+def _make_data(
+    num: int, seed: int
+) -> tuple[NDArray[np.floating], NDArray[np.integer]]:
+    rng = np.random.default_rng(seed)
+    t = rng.integers(0, 3, size=num)
+    x = rng.standard_normal((num, 4)) + np.eye(3, 4)[t] * 2
+    return x, t
+
+
+def _softmax_regression_trial(
+    trial: Trial, train: Dataset, test: Dataset, epochs: int, batch_size: int
+) -> History:
+    """Train a softmax regression by SGD, with the global random state."""
+    w = np.random.randn(train.x.shape[1], 3) * 0.01
+    train_acc, test_acc = [], []
+    for _ in range(epochs):
+        order = np.random.permutation(len(train))
+        for start in range(0, len(train), batch_size):
+            idx = order[start : start + batch_size]
+            x, t = train.x[idx], train.t[idx]
+            z = x @ w
+            y = np.exp(z - z.max(axis=1, keepdims=True))
+            y /= y.sum(axis=1, keepdims=True)
+            y[np.arange(len(idx)), t] -= 1
+            grad = x.T @ y / len(idx) + trial.weight_decay * w
+            w -= trial.learning_rate * grad
+        train_acc.append(float(np.mean((train.x @ w).argmax(1) == train.t)))
+        test_acc.append(float(np.mean((test.x @ w).argmax(1) == test.t)))
+    return train_acc, test_acc
+
+
+def test_sample_trials() -> None:
+    trials = sample_trials(50, (-8, -4), (-3, 0), seed=0)
+    assert [trial.index for trial in trials] == list(range(50))
+    assert all(1e-8 <= trial.weight_decay <= 1e-4 for trial in trials)
+    assert all(1e-3 <= trial.learning_rate <= 1.0 for trial in trials)
+    assert trials == sample_trials(50, (-8, -4), (-3, 0), seed=0)
+    assert len({trial.seed for trial in trials}) == 50
+
+
+def test_random_search_parallel_same_as_sequential() -> None:
+    x_train, t_train = _make_data(120, 0)
+    x_test, t_test = _make_data(40, 1)
+    sequential, parallel = [
+        random_search(
+            _softmax_regression_trial,
+            optimization_trial=6,
+            x_train=x_train,
+            t_train=t_train,
+            x_test=x_test,
+            t_test=t_test,
+            weight_decay_log_bounds=(-6, -2),
+            learning_rate_log_bounds=(-2, 0),
+            epochs=3,
+            mini_batch_size=20,
+            seed=7,
+            num_workers=num_workers,
+        )
+        for num_workers in (0, 2)
+    ]
+    assert len(sequential) == 6
+    assert list(parallel) == list(sequential)
+    assert parallel == sequential
+    for train_acc, test_acc in sequential.values():
+        assert len(train_acc) == len(test_acc) == 3
+
+
+def test_random_search_with_cache(tmp_path: Path) -> None:
+    x_train, t_train = _make_data(120, 0)
+    x_test, t_test = _make_data(40, 1)
+    cache = ResultCache(str(tmp_path))
+
+    def search(
+        epochs: int = 2, code: tuple[Any, ...] = ()
+    ) -> dict[str, History]:
+        return random_search(
+            _softmax_regression_trial,
+            optimization_trial=4,
+            x_train=x_train,
+            t_train=t_train,
+            x_test=x_test,
+            t_test=t_test,
+            weight_decay_log_bounds=(-6, -2),
+            learning_rate_log_bounds=(-2, 0),
+            epochs=epochs,
+            mini_batch_size=20,
+            seed=5,
+            cache=cache,
+            code=code,
+        )
+
+    first = search()
+    assert (cache.hits, cache.misses) == (0, 4)
+    second = search()
+    assert (cache.hits, cache.misses) == (4, 4)
+    assert second == first
+    # another number of the epochs isn't cached
+    search(epochs=3)
+    assert cache.misses == 8
+    # the source of the code the trials depend on is a part of the key
+    search(code=(ResultCache,))
+    assert cache.misses == 12
+
+
+def test_successive_halving_fingerprints_the_data_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    calls = []
+
+    def fingerprint_arrays(*arrays: NDArray[np.floating]) -> str:
+        calls.append(len(arrays))
+        return "data"
+
+    monkeypatch.setattr(
+        e_hyper_parameter, "fingerprint_arrays", fingerprint_arrays
+    )
+    x_train, t_train = _make_data(120, 0)
+    x_test, t_test = _make_data(40, 1)
+    successive_halving(
+        _softmax_regression_trial,
+        optimization_trial=9,
+        x_train=x_train,
+        t_train=t_train,
+        x_test=x_test,
+        t_test=t_test,
+        weight_decay_log_bounds=(-6, -2),
+        learning_rate_log_bounds=(-3, 0),
+        min_epochs=1,
+        max_epochs=9,
+        mini_batch_size=20,
+        cache=ResultCache(str(tmp_path)),
+    )
+    assert calls == [4]
+
+
+def test_run_trials_streams_every_trial() -> None:
+    x_train, t_train = _make_data(60, 0)
+    trials = sample_trials(5, (-6, -2), (-2, 0), seed=1)
+    finished = [
+        trial.index
+        for trial, history in run_trials(
+            _softmax_regression_trial,
+            trials,
+            x_train,
+            t_train,
+            x_train,
+            t_train,
+            epochs=1,
+            mini_batch_size=30,
+            num_workers=2,
+        )
+    ]
+    assert sorted(finished) == list(range(5))
+
+
+def test_rung_epochs() -> None:
+    assert rung_epochs(1, 9, 3) == [1, 3, 9]
+    assert rung_epochs(1, 10, 3) == [1, 3, 9, 10]
+    assert rung_epochs(2, 2, 3) == [2]
+
+
+def _search_data() -> tuple[
+    NDArray[np.floating],
+    NDArray[np.integer],
+    NDArray[np.floating],
+    NDArray[np.integer],
+]:
+    return (*_make_data(120, 0), *_make_data(40, 1))
+
+
+def _successive_halving(
+    num_workers: int = 0,
+) -> tuple[dict[str, History], SearchBudget]:
+    x_train, t_train, x_test, t_test = _search_data()
+    return successive_halving(
+        _softmax_regression_trial,
+        optimization_trial=9,
+        x_train=x_train,
+        t_train=t_train,
+        x_test=x_test,
+        t_test=t_test,
+        weight_decay_log_bounds=(-6, -2),
+        learning_rate_log_bounds=(-3, 0),
+        min_epochs=1,
+        max_epochs=9,
+        mini_batch_size=20,
+        eta=3,
+        seed=3,
+        num_workers=num_workers,
+    )
+
+
+def test_successive_halving() -> None:
+    results, budget = _successive_halving()
+    # 9 trials x 1 epoch, 3 x 3, 1 x 9
+    assert budget.epochs_used == 9 + 9 + 9
+    # the promoted trials repeat the epochs of the lower rung
+    assert budget.epochs_retrained == 3 * 1 + 1 * 3
+    assert budget.epochs_full == 9 * 9
+    assert budget.epochs_saved == 81 - 27
+    assert len(results) == 9
+    lengths = sorted(len(history[1]) for history in results.values())
+    assert lengths == [1] * 6 + [3] * 2 + [9]
+
+    # the trials have the same keys as the random search of the seed, and the
+    # full history of the survivor
+    x_train, t_train, x_test, t_test = _search_data()
+    full = random_search(
+        _softmax_regression_trial,
+        optimization_trial=9,
+        x_train=x_train,
+        t_train=t_train,
+        x_test=x_test,
+        t_test=t_test,
+        weight_decay_log_bounds=(-6, -2),
+        learning_rate_log_bounds=(-3, 0),
+        epochs=9,
+        mini_batch_size=20,
+        seed=3,
+    )
+    assert list(results) == list(full)
+    best = next(key for key, value in results.items() if len(value[1]) == 9)
+    assert results[best] == full[best]
+    # the promoted trials were the best of the first rung
+    first_rung = [value[1][0] for value in results.values()]
+    promoted = [value[1][0] for value in results.values() if len(value[1]) > 1]
+    assert min(promoted) >= sorted(first_rung)[-3]
+
+
+class _CountedSharedArrays(SharedArrays):
+    created = 0
+
+    def __init__(self, read_only: bool = True, **arrays: NDArray[Any]) -> None:
+        _CountedSharedArrays.created += 1
+        super().__init__(read_only, **arrays)
+
+
+def test_successive_halving_publishes_the_data_once(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(e_hyper_parameter, "SharedArrays", _CountedSharedArrays)
+    sequential = _successive_halving()
+    parallel = _successive_halving(num_workers=2)
+    assert parallel == sequential
+    # one copy of the data and one pool for all three rungs
+    assert _CountedSharedArrays.created == 1
+
+
+def test_hyperband() -> None:
+    x_train, t_train, x_test, t_test = _search_data()
+    results, budget = hyperband(
+        _softmax_regression_trial,
+        x_train=x_train,
+        t_train=t_train,
+        x_test=x_test,
+        t_test=t_test,
+        weight_decay_log_bounds=(-6, -2),
+        learning_rate_log_bounds=(-3, 0),
+        min_epochs=1,
+        max_epochs=9,
+        mini_batch_size=20,
+        eta=3,
+        seed=0,
+    )
+    # brackets of 9, 5 and 3 trials
+    assert len(results) == 9 + 5 + 3
+    assert budget.epochs_used == (9 + 9 + 9) + (5 * 3 + 9) + 3 * 9
+    assert budget.epochs_full == 17 * 9
+    assert budget.epochs_saved > 0
+    assert max(len(history[1]) for history in results.values()) == 9
+
+
 def _plot_result(results: dict[str, tuple[list[float], list[float]]]) -> None:
     print("=========== Hyper-Parameter Optimization Result ===========")
     graph_draw_num = 20
@@ -0,0 +1,90 @@
+"""Benchmark the intra-op threads and the BLAS threads of a convolution.
+
+Run it by:
+    python -m ch07_cnn.benchmark_intra_op_threads
+
+It prints a matrix of the duration of one convolution forward and backward,
+over the number of intra-op threads (rows) and BLAS threads (columns). The
+convolution uses a simple im2col of `sliding_window_view`, so the benchmark
+doesn't depend on the implementation of the exercise.
+"""
+
+import os
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from numpy.typing import NDArray
+
+from common.default_type_array import np_randn
+from common.parallel import (
+    intra_op_threads,
+    parallel_over_batch,
+    parallel_sum_over_batch,
+    threadpool_limits,
+)
+
+BATCH_SIZE = 128
+IN_CHANNEL = 16
+OUT_CHANNEL = 32
+IMG_SIZE = 28
+FILTER_SIZE = 3
+REPEAT = 3
+
+
+def _im2col(x: NDArray[np.floating]) -> NDArray[np.floating]:
+    x = np.pad(x, ((0, 0), (0, 0), (1, 1), (1, 1)))
+    # (N, C, H_out, W_out, FH, FW) -> (N * H_out * W_out, C * FH * FW)
+    windows = sliding_window_view(x, (FILTER_SIZE, FILTER_SIZE), axis=(2, 3))
+    n, c, h, w = windows.shape[:4]
+    col = windows.transpose(0, 2, 3, 1, 4, 5).reshape(n * h * w, -1)
+    return col
+
+
+def _conv_forward_backward(
+    x: NDArray[np.floating],
+    w_col: NDArray[np.floating],
+    dout: NDArray[np.floating],
+) -> None:
+    # forward: im2col @ w_col for every slice of the batch
+    parallel_over_batch(lambda xs: _im2col(xs) @ w_col, x)
+    # backward: dW = sum(im2col.T @ d_result), d_col = d_result @ w_col.T
+    parallel_sum_over_batch(
+        lambda xs, ds: _im2col(xs).T @ ds.reshape(-1, OUT_CHANNEL), x, dout
+    )
+    parallel_over_batch(lambda ds: ds @ w_col.T, dout)
+
+
+def benchmark(
+    thread_options: list[int], blas_options: list[int]
+) -> NDArray[np.floating]:
+    """Return the mean duration (s) for every (threads, BLAS threads)."""
+    x = np_randn((BATCH_SIZE, IN_CHANNEL, IMG_SIZE, IMG_SIZE))
+    w_col = np_randn((IN_CHANNEL * FILTER_SIZE * FILTER_SIZE, OUT_CHANNEL))
+    # d_result is (N * H_out * W_out, FN), grouped by sample for slicing
+    dout = np_randn((BATCH_SIZE, IMG_SIZE * IMG_SIZE, OUT_CHANNEL))
+
+    durations = np.zeros((len(thread_options), len(blas_options)))
+    for row, num_threads in enumerate(thread_options):
+        for col, blas_threads in enumerate(blas_options):
+            with intra_op_threads(num_threads, blas_threads):
+                _conv_forward_backward(x, w_col, dout)  # warm up
+                start = time.perf_counter()
+                for _ in range(REPEAT):
+                    _conv_forward_backward(x, w_col, dout)
+                durations[row, col] = (time.perf_counter() - start) / REPEAT
+    return durations
+
+
+if __name__ == "__main__":
+    cpu_count = os.cpu_count() or 1
+    options = sorted({1, 2, 4, cpu_count} & set(range(1, cpu_count + 1)))
+    if threadpool_limits is None:
+        print("threadpoolctl is not installed, the BLAS threads are not set.")
+    durations = benchmark(options, options)
+    header = "threads \\ blas | " + " | ".join(f"{b:>8}" for b in options)
+    print(header)
+    print("-" * len(header))
+    for num_threads, row in zip(options, durations):
+        cells = " | ".join(f"{value * 1e3:6.1f}ms" for value in row)
+        print(f"{num_threads:>14} | {cells}")
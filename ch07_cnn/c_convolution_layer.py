@@ -93,7 +93,8 @@ def col2im(
         filter_w (int): Filter width.
         stride (int): Stride.
         pad (int): Padding.
-        use_threading (bool): Whether to use threading for parallel processing.
+        use_threading (bool): Whether to use threading for parallel processing,
+            the number of threads is set by `common.parallel.set_num_threads`.
 
     Returns:
         NDArray[np.floating]: 4D array, with shape: (N, C, H, W).
@@ -156,6 +157,9 @@ class Conv2d(Layer):
                 (N * H_out * W_out, C * FH * FW) @ (C * FH * FW, FN) + (1, Fn)
                 -> (N * H_out * W_out, Fn) -> (N, F_n, H_out, W_out)
 
+        Tips: the steps 1) and 3) are independent over the samples, so a large
+        batch can be split over threads by `common.parallel.parallel_over_batch`.
+
         Parameters:
             x: NDArray[np.floating]
                 Input data. The shape is assumed to be a 4D (N, C, H, W) array,
@@ -199,6 +203,10 @@ class Conv2d(Layer):
                 b. d_im2col ---col2im---> dx
                     -> (N, C, H, W)
 
+        Tips: for a large batch, the dx of 4) can be computed by
+        `common.parallel.parallel_over_batch`, and the sums of 2) and 3) by
+        `common.parallel.parallel_sum_over_batch` over the batch slices.
+
         Parameters:
             dout: NDArray[np.floating]
                 Gradient of the loss function with respect to the output of
@@ -44,6 +44,8 @@ class MaxPool2d(Layer):
         """Forward pass of the layer.
 
         Tips: can use the im2col to have a col and then apply the max operation.
+        For a large batch, `common.parallel.parallel_over_batch` can split it
+        over threads.
 
         Parameters:
             x: NDArray[np.floating]
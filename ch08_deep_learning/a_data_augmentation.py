@@ -1,3 +1,15 @@
+"""Data augmentation of the images.
+
+The per-image functions (`random_rotation`, `random_shift`, `random_flip`)
+call scipy for one image at a time. The batched engine (`augment_batch`,
+`BatchAugmenter`) transforms a whole batch (N, C, H, W) at once:
+    - every sample gets an affine matrix of its rotation, shift and flip
+    - the sampling grids of all samples are built by broadcasting
+    - one bilinear gather reads the 4 neighbours of every output pixel
+Without rotation, integer shifts and flips are pure index arithmetic, a
+single gather without interpolation.
+"""
+
 import numpy as np
 from numpy.typing import NDArray
 from scipy.ndimage import rotate, shift
@@ -50,6 +62,273 @@ def augment_image(image: NDArray[np.floating]) -> NDArray[np.floating]:
     return image
 
 
+def random_affine_matrices(
+    num: int,
+    height: int,
+    width: int,
+    max_angle: float = 15.0,
+    max_shift: float = 2.0,
+    flip: bool = False,
+    integer_shift: bool = False,
+    rng: np.random.Generator | None = None,
+) -> NDArray[np.float64]:
+    """Return random affine matrices mapping output to input coordinates.
+
+    For an output pixel (y, x), the sampled input pixel is
+        (y_in, x_in) = matrix[:, :2] @ (y, x) + matrix[:, 2]
+    i.e. the inverse of a rotation around the center, a shift and a
+    horizontal flip.
+
+    Parameters:
+        num : int
+            The number of the matrices, one per sample.
+        height : int
+            The height of the images.
+        width : int
+            The width of the images.
+        max_angle : float
+            The maximum rotation in degrees, uniform in [-max, max].
+        max_shift : float
+            The maximum shift in pixels, uniform in [-max, max].
+        flip : bool
+            If True, flip horizontally with a 50% probability.
+        integer_shift : bool
+            If True, round the shifts to integers.
+        rng : np.random.Generator | None
+            The random generator, a new one if None.
+
+    Returns:
+        NDArray[np.float64]: The matrices, shape (num, 2, 3).
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    angle = np.deg2rad(rng.uniform(-max_angle, max_angle, num))
+    shifts = rng.uniform(-max_shift, max_shift, (num, 2))
+    if integer_shift:
+        shifts = np.rint(shifts)
+    flip_sign = np.ones(num)
+    if flip:
+        flip_sign[rng.random(num) < 0.5] = -1.0
+
+    cos, sin = np.cos(angle), np.sin(angle)
+    matrices = np.empty((num, 2, 3))
+    # the inverse rotation times the flip of the x axis
+    matrices[:, 0, 0] = cos
+    matrices[:, 0, 1] = sin * flip_sign
+    matrices[:, 1, 0] = -sin
+    matrices[:, 1, 1] = cos * flip_sign
+    center = np.array([(height - 1) / 2, (width - 1) / 2])
+    # rotate and flip around the center, then undo the shift
+    matrices[:, :, 2] = center - shifts - matrices[:, :, :2] @ center
+    return matrices
+
+
+def affine_grid(
+    matrices: NDArray[np.floating], height: int, width: int
+) -> tuple[NDArray[np.floating], NDArray[np.floating]]:
+    """Return the input coordinates (y, x) of every output pixel.
+
+    Parameters:
+        matrices : NDArray[np.floating]
+            The affine matrices, shape (N, 2, 3).
+        height : int
+            The height of the images.
+        width : int
+            The width of the images.
+
+    Returns:
+        tuple[NDArray, NDArray]: The y and x coordinates, shape (N, H, W).
+    """
+    ys = np.arange(height, dtype=matrices.dtype)[:, None]
+    xs = np.arange(width, dtype=matrices.dtype)[None, :]
+    m = matrices[:, :, :, None, None]
+    grid_y = m[:, 0, 0] * ys + m[:, 0, 1] * xs + m[:, 0, 2]
+    grid_x = m[:, 1, 0] * ys + m[:, 1, 1] * xs + m[:, 1, 2]
+    return grid_y, grid_x
+
+
+def _gather(
+    padded: NDArray[np.floating], y: NDArray[np.intp], x: NDArray[np.intp]
+) -> NDArray[np.floating]:
+    """Read padded[n, :, y + 1, x + 1] for every sample and output pixel.
+
+    The padded images have a border of one zero pixel, the coordinates are
+    clipped into the border, so the pixels outside the image are zeros.
+    """
+    n, c, padded_h, padded_w = padded.shape
+    y = np.clip(y, -1, padded_h - 2) + 1
+    x = np.clip(x, -1, padded_w - 2) + 1
+    index = (y * padded_w + x).reshape(n, 1, -1)
+    flat = padded.reshape(n, c, -1)
+    return np.take_along_axis(flat, index, axis=2)
+
+
+def _pad(images: NDArray[np.floating]) -> NDArray[np.floating]:
+    return np.pad(images, ((0, 0), (0, 0), (1, 1), (1, 1)))
+
+
+def bilinear_sample(
+    images: NDArray[np.floating],
+    grid_y: NDArray[np.floating],
+    grid_x: NDArray[np.floating],
+) -> NDArray[np.floating]:
+    """Sample the images at the coordinates by the bilinear interpolation.
+
+    Parameters:
+        images : NDArray[np.floating]
+            The images, shape (N, C, H, W).
+        grid_y : NDArray[np.floating]
+            The y coordinates of every output pixel, shape (N, H_out, W_out).
+        grid_x : NDArray[np.floating]
+            The x coordinates of every output pixel, shape (N, H_out, W_out).
+
+    Returns:
+        NDArray[np.floating]: The sampled images, shape (N, C, H_out, W_out),
+        zeros outside the images.
+    """
+    n, c = images.shape[:2]
+    out_shape = (n, c, *grid_y.shape[1:])
+    padded = _pad(images)
+    y0 = np.floor(grid_y)
+    x0 = np.floor(grid_x)
+    wy = (grid_y - y0).astype(images.dtype).reshape(n, 1, -1)
+    wx = (grid_x - x0).astype(images.dtype).reshape(n, 1, -1)
+    y0 = y0.astype(np.intp)
+    x0 = x0.astype(np.intp)
+
+    top = _gather(padded, y0, x0) * (1 - wx)
+    top += _gather(padded, y0, x0 + 1) * wx
+    bottom = _gather(padded, y0 + 1, x0) * (1 - wx)
+    bottom += _gather(padded, y0 + 1, x0 + 1) * wx
+    top *= 1 - wy
+    bottom *= wy
+    top += bottom
+    out: NDArray[np.floating] = top.reshape(out_shape)
+    return out
+
+
+def shift_flip_batch(
+    images: NDArray[np.floating],
+    shifts: NDArray[np.integer],
+    flips: NDArray[np.bool_] | None = None,
+) -> NDArray[np.floating]:
+    """Shift (by integers) and flip the images by index arithmetic only.
+
+    Parameters:
+        images : NDArray[np.floating]
+            The images, shape (N, C, H, W).
+        shifts : NDArray[np.integer]
+            The (dy, dx) of every sample, shape (N, 2).
+        flips : NDArray[np.bool_] | None
+            If the sample is flipped horizontally, shape (N,).
+
+    Returns:
+        NDArray[np.floating]: The images, zeros where shifted in.
+    """
+    n, _, height, width = images.shape
+    shifts = np.asarray(shifts, dtype=np.intp)
+    src_y = np.arange(height)[None, :, None] - shifts[:, 0, None, None]
+    src_x = np.arange(width)[None, None, :] - shifts[:, 1, None, None]
+    if flips is not None:
+        # flip the image, then shift it
+        src_x = np.where(flips[:, None, None], width - 1 - src_x, src_x)
+    src_y, src_x = np.broadcast_arrays(src_y, src_x)
+    return _gather(_pad(images), src_y, src_x).reshape(images.shape)
+
+
+def augment_batch(
+    images: NDArray[np.floating],
+    max_angle: float = 15.0,
+    max_shift: float = 2.0,
+    flip: bool = False,
+    integer_shift: bool = False,
+    rng: np.random.Generator | None = None,
+) -> NDArray[np.floating]:
+    """Randomly rotate, shift and flip a batch of images at once.
+
+    Parameters:
+        images : NDArray[np.floating]
+            The images, shape (N, C, H, W).
+        max_angle : float
+            The maximum rotation in degrees.
+        max_shift : float
+            The maximum shift in pixels.
+        flip : bool
+            If True, flip horizontally with a 50% probability.
+        integer_shift : bool
+            If True, shift by integers. Without rotation, it's a single
+            gather without interpolation.
+        rng : np.random.Generator | None
+            The random generator, a new one if None.
+
+    Returns:
+        NDArray[np.floating]: The augmented images, a new array.
+    """
+    assert images.ndim == 4
+    rng = rng if rng is not None else np.random.default_rng()
+    n, _, height, width = images.shape
+    if max_angle == 0 and integer_shift:
+        limit = int(max_shift)
+        shifts = rng.integers(-limit, limit, (n, 2), endpoint=True)
+        flips: NDArray[np.bool_] | None = None
+        if flip:
+            flips = rng.random((n,)) < 0.5
+        return shift_flip_batch(images, shifts, flips)
+
+    matrices = random_affine_matrices(
+        n, height, width, max_angle, max_shift, flip, integer_shift, rng
+    )
+    grid_y, grid_x = affine_grid(matrices, height, width)
+    return bilinear_sample(images, grid_y, grid_x)
+
+
+class BatchAugmenter:
+    """A batch transform of random augmentations, with its own generator.
+
+    It can be the batch_transform of the `LayerTrainer`, or the transform of
+    the `PrefetchBatchLoader`. It's picklable, so the `ProcessBatchLoader`
+    workers can run it, with the generator of every mini-batch.
+    """
+
+    def __init__(
+        self,
+        max_angle: float = 15.0,
+        max_shift: float = 2.0,
+        flip: bool = False,
+        integer_shift: bool = False,
+        seed: int | None = None,
+    ) -> None:
+        """Initialize the augmenter, see `augment_batch` for parameters."""
+        self._max_angle = max_angle
+        self._max_shift = max_shift
+        self._flip = flip
+        self._integer_shift = integer_shift
+        self._rng = np.random.default_rng(seed)
+
+    def config(self) -> dict[str, float | bool]:
+        """Return the parameters of the augmentation, like for a cache key."""
+        return {
+            "max_angle": self._max_angle,
+            "max_shift": self._max_shift,
+            "flip": self._flip,
+            "integer_shift": self._integer_shift,
+        }
+
+    def __call__(
+        self,
+        images: NDArray[np.floating],
+        rng: np.random.Generator | None = None,
+    ) -> NDArray[np.floating]:
+        """Augment the images, by the given generator or the own one."""
+        return augment_batch(
+            images,
+            self._max_angle,
+            self._max_shift,
+            self._flip,
+            self._integer_shift,
+            rng if rng is not None else self._rng,
+        )
+
+
 def augment_mnist_data(
     x_train: NDArray[np.floating],
     t_train: NDArray[np.floating],
@@ -59,6 +338,10 @@ def augment_mnist_data(
     """
     Perform data augmentation on the MNIST dataset.
 
+    It materializes the enlarged dataset. For fresh variants every epoch
+    within a fixed memory, give a `BatchAugmenter` as the batch_transform
+    of the `LayerTrainer` with augmentation_workers > 0 instead.
+
     Args:
         x_train (NDArray[np.floating]): Training images, shape (N, C, H, W).
         t_train (NDArray[np.floating]): Training labels, shape (N,).
@@ -89,5 +372,6 @@ def augment_mnist_data(
         return x_train[sampled_indices], t_train[sampled_indices]
 
     # Case 2: Increase dataset size (augmentation_factor > 1.0)
-    # idea: use a np.random.choice to generate the indices
+    # idea: use a np.random.choice to generate the indices, and augment the
+    # chosen images by `augment_batch`, instead of `augment_image` one by one
     raise NotImplementedError
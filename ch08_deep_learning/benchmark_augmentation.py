@@ -0,0 +1,78 @@
+"""Benchmark the batched augmentation against the per-image one.
+
+Run it by:
+    python -m ch08_deep_learning.benchmark_augmentation
+
+It prints the images per second of augmenting MNIST-sized images (1, 28, 28)
+by the per-image scipy path (`augment_image`), and by the batched engine
+(`augment_batch`) with rotation and bilinear interpolation, and with integer
+shifts and flips only. Note the per-image path interpolates by cubic splines,
+scipy's default, the batched one is bilinear.
+"""
+
+import time
+from typing import Callable
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ch08_deep_learning.a_data_augmentation import augment_batch, augment_image
+
+NUM_IMAGES = 2000
+BATCH_SIZE = 500
+REPEAT = 3
+
+
+def _per_image(images: NDArray[np.floating]) -> None:
+    for image in images:
+        augment_image(image)
+
+
+def _batched(
+    max_angle: float, max_shift: float, flip: bool, integer_shift: bool = False
+) -> Callable[[NDArray[np.floating]], None]:
+    rng = np.random.default_rng(0)
+
+    def run(images: NDArray[np.floating]) -> None:
+        for start in range(0, images.shape[0], BATCH_SIZE):
+            augment_batch(
+                images[start : start + BATCH_SIZE],
+                max_angle,
+                max_shift,
+                flip,
+                integer_shift,
+                rng,
+            )
+
+    return run
+
+
+def benchmark(
+    fn: Callable[[NDArray[np.floating]], None], images: NDArray[np.floating]
+) -> float:
+    """Return the images per second of the augmentation."""
+    fn(images[:BATCH_SIZE])  # warm up
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(images)
+    return float(REPEAT * images.shape[0] / (time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    images = rng.random((NUM_IMAGES, 1, 28, 28)).astype(np.float32)
+    cases = {
+        "per-image (scipy)": _per_image,
+        "batched affine": _batched(max_angle=15, max_shift=2, flip=True),
+        "batched integer shift": _batched(
+            max_angle=0, max_shift=2, flip=True, integer_shift=True
+        ),
+    }
+    baseline = None
+    for name, fn in cases.items():
+        throughput = benchmark(fn, images)
+        baseline = baseline or throughput
+        print(
+            f"{name:>22}: {throughput:10.0f} images/s "
+            f"({throughput / baseline:5.1f}x)"
+        )
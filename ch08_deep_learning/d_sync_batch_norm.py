@@ -0,0 +1,180 @@
+import numpy as np
+from numpy.typing import NDArray
+
+from ch06_learning_technique.c_batch_normalization import BatchNorm2d
+from common.communicator import REDUCE_TYPE, Communicator, LocalCommunicator
+
+_REDUCE_AXIS = (0, 2, 3)
+
+
+class SyncBatchNorm2d(BatchNorm2d):
+    """Batch normalization over channel, synchronized across workers.
+
+    With data parallel training, every worker only has a shard of the
+    mini-batch. A normal BatchNorm2d computes the statistics over the shard,
+    which is noisy for a small per-worker batch. This layer reduces the
+    statistics over all workers by a communicator, so the result is the same
+    as the BatchNorm2d over the full mini-batch.
+
+    Forward, one reduction of (2 * C + 1) elements:
+        sum = all_reduce(sum(x, axis=(0, 2, 3)))
+        sum_sq = all_reduce(sum(x^2, axis=(0, 2, 3)))
+        N = all_reduce(batch_size * H * W)
+        mean = sum / N
+        var = sum_sq / N - mean^2
+
+    Backward, one reduction of 2 * C elements:
+        sum_dout = all_reduce(sum(dout, axis=(0, 2, 3)))
+        sum_dout_x_hat = all_reduce(sum(dout * x_hat, axis=(0, 2, 3)))
+        dx = gamma / std * (dout - (sum_dout + x_hat * sum_dout_x_hat) / N)
+
+    The gradients of gamma and beta are the local contributions of this
+    worker, which should be reduced together with the other parameters'
+    gradients by the data parallel trainer.
+    """
+
+    def __init__(
+        self,
+        gamma: tuple[str, NDArray[np.floating]],
+        beta: tuple[str, NDArray[np.floating]],
+        running_mean: tuple[str, NDArray[np.floating]],
+        running_var: tuple[str, NDArray[np.floating]],
+        eps: float = 1e-5,
+        momentum: float = 0.1,
+        affine: bool = True,
+        track_running_stats: bool = True,
+        communicator: Communicator | None = None,
+    ) -> None:
+        """Initialize the layer.
+
+        Parameters:
+            communicator : Communicator | None
+                The communicator of the worker. If None, use the local
+                communicator, which is the same as the BatchNorm2d.
+            others: see the BatchNorm2d.
+        """
+        super().__init__(
+            gamma=gamma,
+            beta=beta,
+            running_mean=running_mean,
+            running_var=running_var,
+            eps=eps,
+            momentum=momentum,
+            affine=affine,
+            track_running_stats=track_running_stats,
+        )
+        self._communicator = (
+            communicator if communicator is not None else LocalCommunicator()
+        )
+        self._training = False
+        self._x_hat: NDArray[np.floating] | None = None
+        self._std: NDArray[np.floating] | None = None
+        self._global_num: int | None = None
+        self._dgamma: NDArray[np.floating] | None = None
+        self._dbeta: NDArray[np.floating] | None = None
+
+    def train(self, flag: bool) -> None:
+        """See the base class."""
+        self._training = flag
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        """Forward pass of the layer."""
+        assert x.ndim == 4, "The input should be a (N, C, H, W) array."
+        if self._training or not self._track_running_stats:
+            mean, var = self._global_mean_var(x)
+            if self._training and self._track_running_stats:
+                self._update_running_stats(mean, var)
+        else:
+            mean = self._params[self._running_mean_name]
+            var = self._params[self._running_var_name]
+
+        std = np.sqrt(var + self._eps).astype(x.dtype, copy=False)
+        x_hat: NDArray[np.floating] = (
+            x - mean.astype(x.dtype, copy=False)
+        ) / std
+        if self._training:
+            # the cache for the backward, not necessary for the inference
+            self._std, self._x_hat = std, x_hat
+        if not self._affine:
+            return x_hat
+        gamma = self._params[self._gamma_name]
+        beta = self._params[self._beta_name]
+        out: NDArray[np.floating] = gamma * x_hat + beta
+        return out
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        """Backward pass of the layer, see the class docstring."""
+        assert self._x_hat is not None and self._std is not None
+        assert self._global_num is not None, "Backward needs a training pass."
+        num_channel = dout.shape[1]
+        local_sums = np.empty((2, num_channel), dtype=REDUCE_TYPE)
+        np.sum(dout, axis=_REDUCE_AXIS, dtype=REDUCE_TYPE, out=local_sums[0])
+        np.sum(
+            dout * self._x_hat,
+            axis=_REDUCE_AXIS,
+            dtype=REDUCE_TYPE,
+            out=local_sums[1],
+        )
+        global_sums = self._communicator.all_reduce(local_sums)
+
+        shape = (1, num_channel, 1, 1)
+        dtype = dout.dtype
+        self._dbeta = local_sums[0].reshape(shape).astype(dtype)
+        self._dgamma = local_sums[1].reshape(shape).astype(dtype)
+        sum_dout = (global_sums[0] / self._global_num).reshape(shape)
+        sum_dout_x_hat = (global_sums[1] / self._global_num).reshape(shape)
+
+        scale = 1 / self._std
+        if self._affine:
+            scale = self._params[self._gamma_name] / self._std
+        dx: NDArray[np.floating] = scale * (
+            dout
+            - sum_dout.astype(dtype)
+            - self._x_hat * sum_dout_x_hat.astype(dtype)
+        )
+        return dx
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        """Return the local gradients of the parameters."""
+        if not self._affine:
+            return {}
+        assert self._dgamma is not None and self._dbeta is not None
+        return {self._gamma_name: self._dgamma, self._beta_name: self._dbeta}
+
+    def _global_mean_var(
+        self, x: NDArray[np.floating]
+    ) -> tuple[NDArray[np.floating], NDArray[np.floating]]:
+        num_channel = x.shape[1]
+        local_stats = np.empty(2 * num_channel + 1, dtype=REDUCE_TYPE)
+        np.sum(
+            x,
+            axis=_REDUCE_AXIS,
+            dtype=REDUCE_TYPE,
+            out=local_stats[:num_channel],
+        )
+        np.sum(
+            np.square(x, dtype=REDUCE_TYPE),
+            axis=_REDUCE_AXIS,
+            out=local_stats[num_channel:-1],
+        )
+        local_stats[-1] = x.shape[0] * x.shape[2] * x.shape[3]
+        global_stats = self._communicator.all_reduce(local_stats)
+
+        self._global_num = int(global_stats[-1])
+        shape = (1, num_channel, 1, 1)
+        mean = global_stats[:num_channel] / self._global_num
+        var = global_stats[num_channel:-1] / self._global_num - mean**2
+        # the cancellation can make a tiny negative variance
+        var = np.maximum(var, 0)
+        return mean.reshape(shape), var.reshape(shape)
+
+    def _update_running_stats(
+        self, mean: NDArray[np.floating], var: NDArray[np.floating]
+    ) -> None:
+        running_mean = self._params[self._running_mean_name]
+        running_var = self._params[self._running_var_name]
+        # inplace update, because the arrays are shared with the named_params
+        running_mean *= self._momentum
+        running_mean += (1 - self._momentum) * mean.astype(running_mean.dtype)
+        running_var *= self._momentum
+        running_var += (1 - self._momentum) * var.astype(running_var.dtype)
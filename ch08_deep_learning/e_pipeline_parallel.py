@@ -0,0 +1,638 @@
+"""Pipeline parallel execution of a Sequential network across processes.
+
+NumPy runs the layers of one network one after another, so a deep network
+like the ResNet-50 can't keep all the cores busy in one process. The pipeline
+splits the layers of a `Sequential` into stages with balanced measured cost,
+runs every stage in its own process, and streams the micro-batches between
+the neighbour stages through shared memory ring buffers.
+
+Diagram (4 stages, 4 micro-batches, GPipe schedule):
+    stage 0: F0 F1 F2 F3 .. .. .. .. .. .. B3 B2 B1 B0
+    stage 1: .. F0 F1 F2 F3 .. .. .. .. B3 B2 B1 B0 ..
+    stage 2: .. .. F0 F1 F2 F3 .. .. B3 B2 B1 B0 .. ..
+    stage 3: .. .. .. F0 F1 F2 F3 B3 B2 B1 B0 .. .. ..
+The idle slots ("..") are the pipeline bubble, whose ideal fraction is
+    (num_stages - 1) / (num_micro_batches + num_stages - 1).
+
+The layers cache only the last forward pass for the backward pass, so a stage
+keeps the attributes of its layers (the caches, like the inputs and the
+dropout masks) of every in-flight micro-batch, and restores them before the
+backward pass of the micro-batch. The arrays of the attributes, except the
+parameters, are copied, so a layer may write its cache in place; a cache in a
+container (a list or a dict) has to be replaced by the forward pass instead. Every forward pass runs once, so the dropout
+masks are the ones of the forward pass and the batch norm running statistics
+are updated once per micro-batch. The 1F1B schedule keeps at most num_stages
+micro-batches in flight, the GPipe schedule all of them.
+"""
+
+import multiprocessing
+import time
+import traceback
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+from typing import Any, Sequence
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ch06_learning_technique.d_reg_weight_decay import Sequential
+from common.base import Layer, Optimizer
+from common.shared_ring_buffer import SharedRingBuffer
+
+SCHEDULES = ("gpipe", "1f1b")
+FORWARD = "F"
+BACKWARD = "B"
+
+
+@dataclass(frozen=True, kw_only=True)
+class LayerProfile:
+    """The measured profile of a layer with one micro-batch."""
+
+    cost_s: float
+    """The duration of the forward and backward pass, in seconds."""
+
+    output_nbytes: int
+    """The number of bytes of the output (and its gradient)."""
+
+
+@dataclass(frozen=True, kw_only=True)
+class PipelineStats:
+    """The statistics of the last pipeline step."""
+
+    step_duration_s: float
+    """The wall-clock duration of the step."""
+
+    stage_busy_s: tuple[float, ...]
+    """The computing duration of every stage, without waiting for data."""
+
+    bubble_fraction: float
+    """The measured fraction of the idle time over all stages.
+
+    bubble_fraction = 1 - sum(stage_busy_s) / (num_stages * step_duration_s)
+    """
+
+    ideal_bubble_fraction: float
+    """The bubble fraction of the schedule with perfectly balanced stages."""
+
+
+def profile_layers(
+    layers: Sequence[Layer], x: NDArray[np.floating]
+) -> list[LayerProfile]:
+    """Measure the cost and the output size of every layer.
+
+    The layers run the forward and the backward pass once in the training
+    mode. The parameters (like the running statistics of the batch norm) are
+    restored after the measurement.
+
+    Parameters:
+        layers : Sequence[Layer]
+            The layers in order.
+        x : NDArray[np.floating]
+            A sample input, usually a micro-batch.
+
+    Returns:
+        list[LayerProfile]: The profile of every layer.
+    """
+    snapshot = [
+        {key: value.copy() for key, value in layer.named_params().items()}
+        for layer in layers
+    ]
+    forward_s: list[float] = []
+    outputs: list[NDArray[np.floating]] = []
+    for layer in layers:
+        layer.train(True)
+        start = time.perf_counter()
+        x = layer.forward(x)
+        forward_s.append(time.perf_counter() - start)
+        outputs.append(x)
+
+    backward_s = [0.0] * len(layers)
+    dout = np.ones_like(x)
+    for idx in reversed(range(len(layers))):
+        start = time.perf_counter()
+        dout = layers[idx].backward(dout)
+        backward_s[idx] = time.perf_counter() - start
+
+    for layer, params in zip(layers, snapshot):
+        layer.train(False)
+        for key, value in layer.named_params().items():
+            np.copyto(value, params[key])
+
+    return [
+        LayerProfile(cost_s=f + b, output_nbytes=out.nbytes)
+        for f, b, out in zip(forward_s, backward_s, outputs)
+    ]
+
+
+def partition_layers(
+    costs: Sequence[float], num_stages: int
+) -> list[tuple[int, int]]:
+    """Split the layers into contiguous stages minimizing the maximum cost.
+
+    It is a dynamic programming over (stage, last layer), where
+        best[k][i] = min_j max(best[k - 1][j], sum(costs[j:i]))
+
+    Parameters:
+        costs : Sequence[float]
+            The cost of every layer in order.
+        num_stages : int
+            The number of stages, every stage has one layer at least.
+
+    Returns:
+        list[tuple[int, int]]: The [start, end) layer index of every stage.
+    """
+    num_layers = len(costs)
+    if not 1 <= num_stages <= num_layers:
+        raise ValueError(
+            f"Can't split {num_layers} layers into {num_stages} stages."
+        )
+    prefix = np.concatenate([[0.0], np.cumsum(costs)])
+    best = np.full((num_stages + 1, num_layers + 1), np.inf)
+    split = np.zeros((num_stages + 1, num_layers + 1), dtype=np.int64)
+    best[0, 0] = 0.0
+    for k in range(1, num_stages + 1):
+        for i in range(k, num_layers + 1):
+            for j in range(k - 1, i):
+                cost = max(best[k - 1, j], prefix[i] - prefix[j])
+                if cost < best[k, i]:
+                    best[k, i] = cost
+                    split[k, i] = j
+
+    partitions = []
+    end = num_layers
+    for k in range(num_stages, 0, -1):
+        start = int(split[k, end])
+        partitions.append((start, end))
+        end = start
+    return partitions[::-1]
+
+
+def pipeline_schedule(
+    schedule: str, stage: int, num_stages: int, num_micro_batches: int
+) -> list[str]:
+    """Return the order of the forward ("F") and backward ("B") passes.
+
+    - "gpipe": all the forward passes, then all the backward passes.
+    - "1f1b": (num_stages - stage - 1) warm-up forward passes, then one
+        forward and one backward pass alternately, then the remaining backward
+        passes. It keeps less micro-batches in flight than the GPipe.
+    """
+    if schedule == "gpipe":
+        return [FORWARD] * num_micro_batches + [BACKWARD] * num_micro_batches
+    if schedule == "1f1b":
+        warmup = min(num_stages - stage - 1, num_micro_batches)
+        steady = num_micro_batches - warmup
+        return (
+            [FORWARD] * warmup
+            + [FORWARD, BACKWARD] * steady
+            + [BACKWARD] * warmup
+        )
+    raise ValueError(f"Unknown schedule {schedule}, options: {SCHEDULES}.")
+
+
+def ideal_bubble_fraction(num_stages: int, num_micro_batches: int) -> float:
+    """Return the bubble fraction with perfectly balanced stages."""
+    return (num_stages - 1) / (num_micro_batches + num_stages - 1)
+
+
+class PipelineParallel:
+    """Train or evaluate a Sequential network with a process per stage.
+
+    Usage:
+        with PipelineParallel(
+            network=network,
+            loss=SoftmaxWithLossConfig().create(),
+            optimizer=Adam(lr=0.001),
+            sample_x=x_train[:mini_batch_size],
+            num_stages=4,
+            num_micro_batches=8,
+        ) as pipeline:
+            for x_batch, t_batch in mini_batches:
+                loss = pipeline.train_step(x_batch, t_batch)
+            pipeline.sync_params()
+
+    Every stage has its own copy of the layers and of the optimizer, and
+    updates its parameters once per step with the gradients accumulated over
+    the micro-batches. Call `sync_params` to copy the trained parameters back
+    to the layers of the given network.
+    """
+
+    def __init__(
+        self,
+        network: Sequential,
+        loss: Layer,
+        optimizer: Optimizer,
+        sample_x: NDArray[np.floating],
+        num_stages: int,
+        num_micro_batches: int,
+        schedule: str = "1f1b",
+        context: Any | None = None,
+    ) -> None:
+        """Initialize the pipeline and start the stage processes.
+
+        Parameters:
+            network : Sequential
+                The network to be split into stages.
+            loss : Layer
+                The loss layer, which runs in the last stage.
+            optimizer : Optimizer
+                The optimizer, every stage uses a copy of it.
+            sample_x : NDArray[np.floating]
+                A sample mini-batch for measuring the layers. The mini-batch
+                in the steps can't be larger than it.
+            num_stages : int
+                The number of stages (processes).
+            num_micro_batches : int
+                The number of micro-batches of one mini-batch.
+            schedule : str
+                The pipeline schedule, "gpipe" or "1f1b".
+            context : multiprocessing context | None
+                The context for creating the processes.
+        """
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown schedule {schedule}: {SCHEDULES}.")
+        self._network = network
+        self._num_stages = num_stages
+        self._num_micro_batches = num_micro_batches
+        self._schedule = schedule
+        self.last_stats: PipelineStats | None = None
+
+        layers = network.layers
+        micro_size = -(-sample_x.shape[0] // num_micro_batches)
+        profiles = profile_layers(layers, sample_x[:micro_size])
+        self._partitions = partition_layers(
+            [profile.cost_s for profile in profiles], num_stages
+        )
+
+        ctx = context if context is not None else multiprocessing.get_context()
+        # boundary[s] is the input of stage s, boundary[num_stages] the output
+        boundary_nbytes = [sample_x[:micro_size].nbytes] + [
+            profiles[end - 1].output_nbytes for _, end in self._partitions
+        ]
+        self._forward_rings = [
+            SharedRingBuffer(num_micro_batches, nbytes, context=ctx)
+            for nbytes in boundary_nbytes
+        ]
+        self._backward_rings = [
+            SharedRingBuffer(num_micro_batches, nbytes, context=ctx)
+            for nbytes in boundary_nbytes[1:-1]
+        ]
+
+        self._conns: list[Connection] = []
+        self._processes: list[Any] = []
+        for stage, (start, end) in enumerate(self._partitions):
+            parent_conn, child_conn = ctx.Pipe()
+            is_last = stage == num_stages - 1
+            process = ctx.Process(
+                target=_run_stage,
+                args=(
+                    _Stage(
+                        stage=stage,
+                        layers=tuple(layers[start:end]),
+                        loss=loss if is_last else None,
+                        optimizer=optimizer,
+                        forward_in=self._forward_rings[stage],
+                        forward_out=self._forward_rings[stage + 1],
+                        backward_in=(
+                            None if is_last else self._backward_rings[stage]
+                        ),
+                        backward_out=(
+                            None
+                            if stage == 0
+                            else self._backward_rings[stage - 1]
+                        ),
+                    ),
+                    child_conn,
+                ),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+    @property
+    def partitions(self) -> list[tuple[int, int]]:
+        """Return the [start, end) layer index of every stage."""
+        return self._partitions
+
+    def train_step(
+        self, x: NDArray[np.floating], t: NDArray[np.floating | np.integer]
+    ) -> float:
+        """Train the network with one mini-batch.
+
+        Returns:
+            float: The loss of the mini-batch, i.e. the sample-weighted mean
+                of the micro-batch losses.
+        """
+        self._assert_enough_samples(x)
+        x_micro = np.array_split(x, self._num_micro_batches)
+        t_micro = np.array_split(t, self._num_micro_batches)
+        weights = [micro.shape[0] / x.shape[0] for micro in x_micro]
+
+        start = time.perf_counter()
+        for stage, conn in enumerate(self._conns):
+            is_last = stage == self._num_stages - 1
+            conn.send(
+                (
+                    "train",
+                    {
+                        "ops": pipeline_schedule(
+                            self._schedule,
+                            stage,
+                            self._num_stages,
+                            self._num_micro_batches,
+                        ),
+                        "backward_order": self._last_stage_backward_order(),
+                        "targets": t_micro if is_last else None,
+                        "weights": weights if is_last else None,
+                    },
+                )
+            )
+        for idx, micro in enumerate(x_micro):
+            self._forward_rings[0].put(micro, tag=idx)
+        replies = self._gather_replies()
+        self._record_stats(start, replies)
+        return float(replies[-1]["loss"])
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        """Forward pass through the stages in the evaluation mode."""
+        self._assert_enough_samples(x)
+        x_micro = np.array_split(x, self._num_micro_batches)
+        start = time.perf_counter()
+        for conn in self._conns:
+            conn.send(("forward", len(x_micro)))
+        for idx, micro in enumerate(x_micro):
+            self._forward_rings[0].put(micro, tag=idx)
+        replies = self._gather_replies()
+        self._record_stats(start, replies)
+
+        outputs = dict(
+            self._forward_rings[-1].get() for _ in range(len(x_micro))
+        )
+        return np.concatenate([outputs[idx] for idx in range(len(x_micro))])
+
+    def sync_params(self) -> None:
+        """Copy the parameters of the stages into the network's layers."""
+        for conn in self._conns:
+            conn.send(("params", None))
+        params: dict[str, NDArray[np.floating]] = {}
+        for reply in self._gather_replies():
+            params.update(reply)
+        for layer in self._network.layers:
+            for key, value in layer.named_params().items():
+                np.copyto(value, params[key])
+
+    def close(self) -> None:
+        """Stop the stage processes and release the shared memory."""
+        for conn, process in zip(self._conns, self._processes):
+            try:
+                conn.send(("stop", None))
+            except (BrokenPipeError, OSError):
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        self._conns = []
+        self._processes = []
+        for ring in self._forward_rings + self._backward_rings:
+            ring.close()
+
+    def __enter__(self) -> "PipelineParallel":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def _assert_enough_samples(self, x: NDArray[np.floating]) -> None:
+        if x.shape[0] < self._num_micro_batches:
+            raise ValueError(
+                f"The mini-batch has {x.shape[0]} samples, less than the "
+                f"{self._num_micro_batches} micro-batches."
+            )
+
+    def _last_stage_backward_order(self) -> list[int]:
+        order = list(range(self._num_micro_batches))
+        return order[::-1] if self._schedule == "gpipe" else order
+
+    def _gather_replies(self) -> list[Any]:
+        replies: dict[int, Any] = {}
+        pending = {conn: idx for idx, conn in enumerate(self._conns)}
+        while pending:
+            for conn in wait(list(pending)):
+                assert isinstance(conn, Connection)
+                try:
+                    status, reply = conn.recv()
+                except EOFError:
+                    stage = pending[conn]
+                    process = self._processes[stage]
+                    self.close()
+                    raise RuntimeError(
+                        f"Pipeline stage {stage} exited unexpectedly with "
+                        f"the code {process.exitcode}."
+                    ) from None
+                if status == "error":
+                    self.close()
+                    raise RuntimeError(
+                        f"Pipeline stage {pending[conn]} failed:\n{reply}"
+                    )
+                replies[pending.pop(conn)] = reply
+        return [replies[idx] for idx in range(len(self._conns))]
+
+    def _record_stats(self, start: float, replies: list[Any]) -> None:
+        duration = time.perf_counter() - start
+        if not isinstance(replies[0], dict) or "busy_s" not in replies[0]:
+            return
+        busy = tuple(float(reply["busy_s"]) for reply in replies)
+        self.last_stats = PipelineStats(
+            step_duration_s=duration,
+            stage_busy_s=busy,
+            bubble_fraction=max(
+                0.0, 1 - sum(busy) / (self._num_stages * duration)
+            ),
+            ideal_bubble_fraction=ideal_bubble_fraction(
+                self._num_stages, self._num_micro_batches
+            ),
+        )
+
+
+class _Stage:
+    """The layers and the ring buffers of one stage, run in its process."""
+
+    def __init__(
+        self,
+        stage: int,
+        layers: tuple[Layer, ...],
+        loss: Layer | None,
+        optimizer: Optimizer,
+        forward_in: SharedRingBuffer,
+        forward_out: SharedRingBuffer,
+        backward_in: SharedRingBuffer | None,
+        backward_out: SharedRingBuffer | None,
+    ) -> None:
+        self._stage = stage
+        self._layers = layers
+        self._loss = loss
+        self._optimizer = optimizer
+        self._forward_in = forward_in
+        self._forward_out = forward_out
+        self._backward_in = backward_in
+        self._backward_out = backward_out
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return {
+            key: value
+            for layer in self._layers
+            for key, value in layer.named_params().items()
+        }
+
+    def train(
+        self,
+        ops: list[str],
+        backward_order: list[int],
+        targets: list[NDArray[np.floating | np.integer]] | None,
+        weights: list[float] | None,
+    ) -> dict[str, float]:
+        for layer in self._layers:
+            layer.train(True)
+        # the dtype and the layer states of every in-flight micro-batch
+        caches: dict[int, tuple[np.dtype, list[tuple[Layer, Any]]]] = {}
+        grads: dict[str, NDArray[np.floating]] = {}
+        loss = 0.0
+        busy = 0.0
+        last_backward = iter(backward_order)
+
+        for op in ops:
+            if op == FORWARD:
+                idx, x = self._forward_in.get()
+                start = time.perf_counter()
+                y = self._forward(x)
+                if self._loss is not None:
+                    assert targets is not None and weights is not None
+                    loss += weights[idx] * self._loss.forward_to_loss(
+                        y, targets[idx]
+                    )
+                caches[idx] = (x.dtype, self._save_states())
+                busy += time.perf_counter() - start
+                if self._loss is None:
+                    self._forward_out.put(y, tag=idx)
+                continue
+
+            if self._loss is not None:
+                assert weights is not None
+                idx = next(last_backward)
+                start = time.perf_counter()
+                dtype, states = caches.pop(idx)
+                self._restore_states(states)
+                dout = self._loss.backward(
+                    np.full((1,), weights[idx], dtype=dtype)
+                )
+            else:
+                assert self._backward_in is not None
+                idx, dout = self._backward_in.get()
+                start = time.perf_counter()
+                self._restore_states(caches.pop(idx)[1])
+            dx = self._backward(dout, grads)
+            busy += time.perf_counter() - start
+            if self._backward_out is not None:
+                self._backward_out.put(dx, tag=idx)
+
+        start = time.perf_counter()
+        self._optimizer.one_step(self.named_params(), grads)
+        busy += time.perf_counter() - start
+        return {"busy_s": busy, "loss": loss}
+
+    def forward(self, num_micro_batches: int) -> dict[str, float]:
+        for layer in self._layers:
+            layer.train(False)
+        busy = 0.0
+        for _ in range(num_micro_batches):
+            idx, x = self._forward_in.get()
+            start = time.perf_counter()
+            y = self._forward(x)
+            busy += time.perf_counter() - start
+            self._forward_out.put(y, tag=idx)
+        return {"busy_s": busy}
+
+    def _stateful_layers(self) -> list[Layer]:
+        """Return the layers, their sub-layers and the loss layer."""
+        layers: list[Layer] = []
+        pending = list(self._layers)
+        if self._loss is not None:
+            pending.append(self._loss)
+        while pending:
+            layer = pending.pop()
+            if any(layer is other for other in layers):
+                continue
+            layers.append(layer)
+            for value in vars(layer).values():
+                if isinstance(value, Layer):
+                    pending.append(value)
+                elif isinstance(value, (tuple, list)):
+                    pending.extend(
+                        item for item in value if isinstance(item, Layer)
+                    )
+        return layers
+
+    def _save_states(self) -> list[tuple[Layer, dict[str, Any]]]:
+        states = []
+        for layer in self._stateful_layers():
+            params = {id(param) for param in layer.named_params().values()}
+            # the parameters are shared by the micro-batches, the cache arrays
+            # are copied, as a layer may write its cache in place in the next
+            # forward pass
+            state = {
+                key: value.copy()
+                if isinstance(value, np.ndarray) and id(value) not in params
+                else value
+                for key, value in vars(layer).items()
+            }
+            states.append((layer, state))
+        return states
+
+    @staticmethod
+    def _restore_states(states: list[tuple[Layer, dict[str, Any]]]) -> None:
+        for layer, state in states:
+            vars(layer).clear()
+            vars(layer).update(state)
+
+    def _forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        for layer in self._layers:
+            x = layer.forward(x)
+        return x
+
+    def _backward(
+        self,
+        dout: NDArray[np.floating],
+        grads: dict[str, NDArray[np.floating]],
+    ) -> NDArray[np.floating]:
+        for layer in reversed(self._layers):
+            dout = layer.backward(dout)
+            for key, grad in layer.param_grads().items():
+                if key in grads:
+                    grads[key] += grad
+                else:
+                    grads[key] = grad.copy()
+        return dout
+
+
+def _run_stage(stage: _Stage, conn: Connection) -> None:
+    while True:
+        command, payload = conn.recv()
+        if command == "stop":
+            break
+        try:
+            if command == "train":
+                reply: Any = stage.train(**payload)
+            elif command == "forward":
+                reply = stage.forward(payload)
+            elif command == "params":
+                reply = stage.named_params()
+            else:
+                raise ValueError(f"Unknown command {command}.")
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+            break
+        conn.send(("ok", reply))
+    conn.close()
@@ -1,3 +1,15 @@
+import numpy as np
+import pytest
+from scipy.ndimage import map_coordinates
+
+from ch08_deep_learning.a_data_augmentation import (
+    BatchAugmenter,
+    affine_grid,
+    augment_batch,
+    bilinear_sample,
+    random_affine_matrices,
+    shift_flip_batch,
+)
 from ch08_deep_learning.a_deep_2d_net import deep_2d_net_config
 from ch08_deep_learning.test_a_deep_2d_net import train_and_test_deep_conv_net
 
@@ -9,3 +21,63 @@ def test_deep_conv_net_with_data_augmentation() -> None:
         augmente_data=True,
         augmentation_factor=1.1,
     )
+
+
+def _images(n: int = 5) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.random((n, 2, 7, 6)).astype(np.float32)
+
+
+def test_identity_transform() -> None:
+    images = _images()
+    result = augment_batch(images, max_angle=0, max_shift=0)
+    np.testing.assert_allclose(result, images, atol=1e-6)
+
+
+def test_bilinear_sample_matches_map_coordinates() -> None:
+    images = _images()
+    rng = np.random.default_rng(1)
+    matrices = random_affine_matrices(5, 7, 6, 30, 1.5, flip=True, rng=rng)
+    grid_y, grid_x = affine_grid(matrices, 7, 6)
+
+    result = bilinear_sample(images, grid_y, grid_x)
+
+    for n in range(5):
+        for c in range(2):
+            # the zeros outside the image are interpolated too
+            expected = map_coordinates(
+                images[n, c],
+                [grid_y[n], grid_x[n]],
+                order=1,
+                mode="grid-constant",
+            )
+            np.testing.assert_allclose(result[n, c], expected, atol=1e-5)
+
+
+def test_shift_flip_batch_by_index() -> None:
+    images = _images(3)
+    shifts = np.array([[1, -2], [0, 0], [-3, 1]])
+    flips = np.array([False, True, True])
+
+    result = shift_flip_batch(images, shifts, flips)
+
+    for n, ((dy, dx), flipped) in enumerate(zip(shifts, flips)):
+        source = images[n, :, :, ::-1] if flipped else images[n]
+        expected = np.zeros_like(source)
+        h, w = source.shape[1:]
+        dst_y = slice(max(dy, 0), h + min(dy, 0))
+        dst_x = slice(max(dx, 0), w + min(dx, 0))
+        src_y = slice(max(-dy, 0), h - max(dy, 0))
+        src_x = slice(max(-dx, 0), w - max(dx, 0))
+        expected[:, dst_y, dst_x] = source[:, src_y, src_x]
+        np.testing.assert_array_equal(result[n], expected)
+
+
+@pytest.mark.parametrize("max_angle", [0.0, 10.0])
+def test_augmenter_is_reproducible(max_angle: float) -> None:
+    images = _images()
+    first = BatchAugmenter(max_angle, 2, True, integer_shift=True, seed=3)
+    second = BatchAugmenter(max_angle, 2, True, integer_shift=True, seed=3)
+    result = first(images)
+    assert result.shape == images.shape and result.dtype == images.dtype
+    np.testing.assert_array_equal(result, second(images))
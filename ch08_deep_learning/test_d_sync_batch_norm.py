@@ -0,0 +1,180 @@
+import multiprocessing
+from multiprocessing.connection import Connection
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common.communicator import (
+    Communicator,
+    LocalCommunicator,
+    SharedMemoryGroup,
+)
+from common.default_type_array import np_ones, np_randn, np_zeros
+from common.layer_config import SyncBatchNorm2dConfig
+from common.result_cache import stable_hash
+
+ATOL = 1e-4
+
+
+def _bn_params(num_channel: int) -> dict[str, NDArray[np.floating]]:
+    shape = (1, num_channel, 1, 1)
+    return {
+        "bn1_gamma": np_randn(shape),
+        "bn1_beta": np_randn(shape),
+        "bn1_running_mean": np_zeros(shape),
+        "bn1_running_var": np_ones(shape),
+    }
+
+
+def _copy_params(
+    params: dict[str, NDArray[np.floating]],
+) -> dict[str, NDArray[np.floating]]:
+    return {key: value.copy() for key, value in params.items()}
+
+
+def _forward_backward(
+    params: dict[str, NDArray[np.floating]],
+    x: NDArray[np.floating],
+    dout: NDArray[np.floating],
+    communicator: Communicator | None = None,
+) -> dict[str, NDArray[np.floating]]:
+    layer = SyncBatchNorm2dConfig(
+        num_feature=x.shape[1], param_suffix="1", communicator=communicator
+    ).create(params)
+    layer.train(True)
+    out = layer.forward(x)
+    dx = layer.backward(dout)
+    grads = {f"{key}_grad": grad for key, grad in layer.param_grads().items()}
+    return {"out": out, "dx": dx, **grads, **params}
+
+
+def _worker(
+    communicator: Communicator,
+    params: dict[str, NDArray[np.floating]],
+    x: NDArray[np.floating],
+    dout: NDArray[np.floating],
+    conn: Connection,
+) -> None:
+    conn.send(_forward_backward(params, x, dout, communicator))
+    conn.close()
+
+
+def _run_sharded(
+    params: dict[str, NDArray[np.floating]],
+    x: NDArray[np.floating],
+    dout: NDArray[np.floating],
+    world_size: int,
+) -> list[dict[str, NDArray[np.floating]]]:
+    ctx = multiprocessing.get_context()
+    group = SharedMemoryGroup(
+        world_size=world_size, capacity=2 * x.shape[1] + 1, context=ctx
+    )
+    x_shards = np.array_split(x, world_size)
+    dout_shards = np.array_split(dout, world_size)
+    try:
+        conns, processes = [], []
+        for rank in range(world_size):
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            process = ctx.Process(
+                target=_worker,
+                args=(
+                    group.communicator(rank),
+                    _copy_params(params),
+                    x_shards[rank],
+                    dout_shards[rank],
+                    child_conn,
+                ),
+            )
+            process.start()
+            conns.append(parent_conn)
+            processes.append(process)
+        results = [conn.recv() for conn in conns]
+        for process in processes:
+            process.join()
+    finally:
+        group.close()
+    return results
+
+
+@pytest.mark.parametrize(
+    "shape, world_size",
+    [
+        ((4, 3, 5, 5), 2),  # even shards
+        ((5, 4, 3, 3), 3),  # uneven shards, the last worker has 1 sample
+    ],
+)
+def test_sync_batch_norm_matches_full_batch(
+    shape: tuple[int, int, int, int], world_size: int
+) -> None:
+    params = _bn_params(shape[1])
+    x = np_randn(shape) * 3 + 1
+    dout = np_randn(shape)
+
+    expected = _forward_backward(_copy_params(params), x, dout)
+    results = _run_sharded(params, x, dout, world_size)
+
+    out = np.concatenate([result["out"] for result in results])
+    dx = np.concatenate([result["dx"] for result in results])
+    np.testing.assert_allclose(out, expected["out"], atol=ATOL)
+    np.testing.assert_allclose(dx, expected["dx"], atol=ATOL)
+    # the parameter gradients are the local parts, their sum is the full one
+    for key in ("bn1_gamma", "bn1_beta"):
+        grad = sum(result[key + "_grad"] for result in results)
+        np.testing.assert_allclose(grad, expected[key + "_grad"], atol=ATOL)
+    # every worker has the same running statistics
+    for key in ("bn1_running_mean", "bn1_running_var"):
+        for result in results:
+            np.testing.assert_allclose(result[key], expected[key], atol=ATOL)
+
+
+def _reference_batch_norm(
+    params: dict[str, NDArray[np.floating]],
+    x: NDArray[np.floating],
+    dout: NDArray[np.floating],
+    eps: float = 1e-5,
+) -> dict[str, NDArray[np.float64]]:
+    """The batch norm of the training in float64, by the formulas."""
+    x64, dout64 = x.astype(np.float64), dout.astype(np.float64)
+    gamma = params["bn1_gamma"].astype(np.float64)
+    axes = (0, 2, 3)
+    num = x.size // x.shape[1]
+    mean = x64.mean(axis=axes, keepdims=True)
+    std = np.sqrt(x64.var(axis=axes, keepdims=True) + eps)
+    x_hat = (x64 - mean) / std
+    dx_hat = dout64 * gamma
+    dx = (
+        num * dx_hat
+        - dx_hat.sum(axis=axes, keepdims=True)
+        - x_hat * (dx_hat * x_hat).sum(axis=axes, keepdims=True)
+    ) / (num * std)
+    return {
+        "out": gamma * x_hat + params["bn1_beta"],
+        "dx": dx,
+        "bn1_gamma_grad": (dout64 * x_hat).sum(axis=axes, keepdims=True),
+        "bn1_beta_grad": dout64.sum(axis=axes, keepdims=True),
+    }
+
+
+def test_sync_batch_norm_without_communicator_equals_batch_norm() -> None:
+    shape = (4, 3, 6, 6)
+    params = _bn_params(shape[1])
+    x = np_randn(shape)
+    dout = np_randn(shape)
+
+    expected = _reference_batch_norm(params, x, dout)
+    result = _forward_backward(_copy_params(params), x, dout)
+    for key, value in expected.items():
+        np.testing.assert_allclose(
+            result[key], value.reshape(result[key].shape), atol=ATOL
+        )
+
+
+def test_communicator_is_not_part_of_the_config() -> None:
+    config = SyncBatchNorm2dConfig(num_feature=3, param_suffix="1")
+    with_communicator = SyncBatchNorm2dConfig(
+        num_feature=3, param_suffix="1", communicator=LocalCommunicator()
+    )
+    assert config == with_communicator
+    assert hash(config) == hash(with_communicator)
+    assert stable_hash(config) == stable_hash(with_communicator)
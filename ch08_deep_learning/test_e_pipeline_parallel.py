@@ -0,0 +1,259 @@
+import os
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from ch06_learning_technique.d_reg_weight_decay import Sequential
+from ch08_deep_learning.e_pipeline_parallel import (
+    PipelineParallel,
+    ideal_bubble_fraction,
+    partition_layers,
+    pipeline_schedule,
+)
+from common.base import Layer
+from common.default_type_array import np_randn
+from common.testing import MeanSquareLoss, PlainSGD, TanhLinear
+
+ATOL = 1e-5
+
+
+def _create_network(
+    weights: list[NDArray[np.floating]],
+) -> Sequential:
+    return Sequential(
+        tuple(
+            TanhLinear(w.copy(), w_name=f"w{idx}")
+            for idx, w in enumerate(weights)
+        )
+    )
+
+
+def _reference_train_step(
+    network: Sequential,
+    loss: Layer,
+    x: NDArray[np.floating],
+    t: NDArray[np.floating],
+    lr: float,
+) -> float:
+    y = x
+    for layer in network.layers:
+        y = layer.forward(y)
+    loss_value = loss.forward_to_loss(y, t)
+    dout = loss.backward(np.ones((1,), dtype=y.dtype))
+    for layer in reversed(network.layers):
+        dout = layer.backward(dout)
+        for key, grad in layer.param_grads().items():
+            layer.named_params()[key] -= lr * grad
+    return loss_value
+
+
+@pytest.mark.parametrize(
+    "costs, num_stages, expected",
+    [
+        ([1.0, 1.0, 1.0, 1.0], 2, [(0, 2), (2, 4)]),
+        ([4.0, 1.0, 1.0, 1.0, 1.0], 2, [(0, 1), (1, 5)]),
+        ([1.0, 2.0, 3.0, 4.0, 5.0], 3, [(0, 3), (3, 4), (4, 5)]),
+        ([1.0, 1.0, 1.0], 3, [(0, 1), (1, 2), (2, 3)]),
+    ],
+)
+def test_partition_layers(
+    costs: list[float], num_stages: int, expected: list[tuple[int, int]]
+) -> None:
+    assert partition_layers(costs, num_stages) == expected
+
+
+@pytest.mark.parametrize("schedule", ["gpipe", "1f1b"])
+@pytest.mark.parametrize("num_stages, num_micro_batches", [(3, 2), (2, 5)])
+def test_pipeline_schedule(
+    schedule: str, num_stages: int, num_micro_batches: int
+) -> None:
+    for stage in range(num_stages):
+        ops = pipeline_schedule(schedule, stage, num_stages, num_micro_batches)
+        assert ops.count("F") == ops.count("B") == num_micro_batches
+        # a backward pass never happens before its forward pass
+        for idx in range(len(ops)):
+            assert ops[: idx + 1].count("F") >= ops[: idx + 1].count("B")
+
+
+@pytest.mark.parametrize("schedule", ["gpipe", "1f1b"])
+def test_pipeline_matches_sequential_training(schedule: str) -> None:
+    np.random.seed(0)
+    sizes = [6, 8, 8, 7, 5]
+    weights = [
+        np_randn((sizes[idx], sizes[idx + 1])) * 0.5
+        for idx in range(len(sizes) - 1)
+    ]
+    x = np_randn((12, sizes[0]))
+    t = np_randn((12, sizes[-1]))
+    lr = 0.1
+
+    reference = _create_network(weights)
+    network = _create_network(weights)
+    with PipelineParallel(
+        network=network,
+        loss=MeanSquareLoss(),
+        optimizer=PlainSGD(lr=lr),
+        sample_x=x,
+        num_stages=3,
+        num_micro_batches=4,
+        schedule=schedule,
+    ) as pipeline:
+        assert len(pipeline.partitions) == 3
+        for _ in range(3):
+            expected_loss = _reference_train_step(
+                reference, MeanSquareLoss(), x, t, lr
+            )
+            loss = pipeline.train_step(x, t)
+            assert loss == pytest.approx(expected_loss, abs=ATOL)
+
+        assert pipeline.last_stats is not None
+        assert 0.0 <= pipeline.last_stats.bubble_fraction <= 1.0
+        assert pipeline.last_stats.ideal_bubble_fraction == pytest.approx(
+            ideal_bubble_fraction(3, 4)
+        )
+
+        pipeline.sync_params()
+        for layer, expected_layer in zip(network.layers, reference.layers):
+            for key, value in layer.named_params().items():
+                np.testing.assert_allclose(
+                    value, expected_layer.named_params()[key], atol=ATOL
+                )
+
+        y = pipeline.forward(x)
+        expected_y = x
+        for layer in reference.layers:
+            expected_y = layer.forward(expected_y)
+        np.testing.assert_allclose(y, expected_y, atol=ATOL)
+
+
+class _ForwardCounter(Layer):
+    """An identity layer counting its forward passes in a parameter."""
+
+    def __init__(self) -> None:
+        self._count = np.zeros(1)
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return {"count": self._count}
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        self._count += 1
+        return x
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        return dout
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+
+class _InPlaceCache(TanhLinear):
+    """A TanhLinear that caches its input in a buffer written in place."""
+
+    def __init__(self, w: NDArray[np.floating], w_name: str) -> None:
+        super().__init__(w, w_name=w_name)
+        self._buffer: NDArray[np.floating] | None = None
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        if self._buffer is None or self._buffer.shape != x.shape:
+            self._buffer = np.empty_like(x)
+        np.copyto(self._buffer, x)
+        return super().forward(self._buffer)
+
+
+@pytest.mark.parametrize("schedule", ["gpipe", "1f1b"])
+def test_pipeline_with_caches_written_in_place(schedule: str) -> None:
+    np.random.seed(0)
+    weights = [np_randn((4, 5)) * 0.5, np_randn((5, 3)) * 0.5]
+    x = np_randn((8, 4))
+    t = np_randn((8, 3))
+    lr = 0.1
+
+    reference = _create_network(weights)
+    network = Sequential(
+        tuple(
+            _InPlaceCache(w.copy(), w_name=f"w{idx}")
+            for idx, w in enumerate(weights)
+        )
+    )
+    with PipelineParallel(
+        network=network,
+        loss=MeanSquareLoss(),
+        optimizer=PlainSGD(lr=lr),
+        sample_x=x,
+        num_stages=2,
+        num_micro_batches=4,
+        schedule=schedule,
+    ) as pipeline:
+        _reference_train_step(reference, MeanSquareLoss(), x, t, lr)
+        pipeline.train_step(x, t)
+        pipeline.sync_params()
+    for layer, expected_layer in zip(network.layers, reference.layers):
+        for key, value in layer.named_params().items():
+            np.testing.assert_allclose(
+                value, expected_layer.named_params()[key], atol=ATOL
+            )
+
+
+@pytest.mark.parametrize("schedule", ["gpipe", "1f1b"])
+def test_pipeline_runs_every_forward_once(schedule: str) -> None:
+    np.random.seed(0)
+    x = np_randn((8, 4))
+    t = np_randn((8, 4))
+    counter = _ForwardCounter()
+    network = Sequential(
+        (
+            TanhLinear(np_randn((4, 4)), w_name="w0"),
+            counter,
+            TanhLinear(np_randn((4, 4)), w_name="w1"),
+        )
+    )
+    with PipelineParallel(
+        network=network,
+        loss=MeanSquareLoss(),
+        optimizer=PlainSGD(lr=0.1),
+        sample_x=x,
+        num_stages=3,
+        num_micro_batches=4,
+        schedule=schedule,
+    ) as pipeline:
+        pipeline.train_step(x, t)
+        pipeline.sync_params()
+    # no recomputation before the backward passes
+    assert counter.named_params()["count"][0] == 4
+
+
+class _ExitInStage(Layer):
+    """A layer whose forward pass kills the stage process."""
+
+    def __init__(self) -> None:
+        self._pid = os.getpid()
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        # the measurement of the layers runs in this process
+        if os.getpid() != self._pid:
+            os._exit(3)
+        return x
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        return dout
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+
+def test_pipeline_reports_a_dead_stage() -> None:
+    x = np_randn((4, 2))
+    with PipelineParallel(
+        network=Sequential((_ExitInStage(),)),
+        loss=MeanSquareLoss(),
+        optimizer=PlainSGD(lr=0.1),
+        sample_x=x,
+        num_stages=1,
+        num_micro_batches=2,
+    ) as pipeline:
+        with pytest.raises(RuntimeError, match="stage 0 exited .* code 3"):
+            pipeline.train_step(x, x)
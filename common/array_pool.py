@@ -0,0 +1,253 @@
+"""A pool of aligned buffers for the arrays of the neural networks.
+
+Every training step creates the same arrays again (the gradients, the
+outputs, the im2col buffers), so the memory can be recycled instead of asking
+the system allocator every time. The `ArrayPool` keeps the buffers in size
+classes, hands out 64-byte aligned arrays, and reuses a buffer when no array
+(or view) refers to it anymore. NumPy has no hook for freeing an array, so a
+buffer is known to be free by its reference count.
+
+Checking the reference counts costs a pass over the buffers in use, so it's
+lazy and generational, like the garbage collector of Python:
+    - generation 0 has the buffers of the current step, and generation 1 the
+      ones which outlived one step, like the caches of the layers. They are
+      checked when a size class has no free buffer (only the buffers of the
+      class), and at every `end_step`.
+    - generation 2 has the buffers which outlived two steps, like the
+      parameters and the optimizer state. They are checked every
+      `OLD_COLLECT_STEPS` steps only.
+
+Usage:
+    pool = ArrayPool()
+    with array_pool(pool):  # the np_* helpers allocate from the pool
+        for x_batch, t_batch in loader:
+            train_step(x_batch, t_batch)
+            pool.end_step()
+    print(pool.stats())
+"""
+
+import sys
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+import numpy as np
+from numpy.typing import DTypeLike, NDArray
+
+ALIGNMENT = 64
+"""The alignment of the data of every array in bytes, a cache line."""
+
+MIN_CLASS_NBYTES = 64
+"""The smallest size class."""
+
+OLD_COLLECT_STEPS = 16
+"""The number of the steps between the checks of the long-lived buffers."""
+
+# every power-of-two range is split into 4 size classes, so a buffer wastes
+# less than 25% of its memory
+_CLASSES_PER_DOUBLING = 4
+
+
+@dataclass(frozen=True, kw_only=True)
+class PoolStats:
+    """The statistics of an array pool."""
+
+    live_bytes: int
+    """The bytes of the buffers used by the live arrays."""
+
+    peak_live_bytes: int
+    """The maximum of the live bytes, measured at every allocation."""
+
+    reserved_bytes: int
+    """The bytes of all buffers held by the pool, live or free."""
+
+    allocations: int
+    """The number of the arrays allocated by the pool."""
+
+    new_buffers: int
+    """The number of the allocations that couldn't reuse a buffer."""
+
+    step_allocations: tuple[int, ...]
+    """The number of the allocations of every finished step."""
+
+
+def size_class(nbytes: int) -> int:
+    """Return the buffer size for an array of nbytes."""
+    if nbytes <= MIN_CLASS_NBYTES:
+        return MIN_CLASS_NBYTES
+    step = (1 << ((nbytes - 1).bit_length() - 1)) // _CLASSES_PER_DOUBLING
+    return -(-nbytes // step) * step
+
+
+class ArrayPool:
+    """A thread-safe size-class pool of 64-byte aligned buffers."""
+
+    def __init__(self, max_free_bytes: int | None = None) -> None:
+        """Initialize the pool.
+
+        Parameters:
+            max_free_bytes : int | None
+                The maximum bytes of the free buffers kept for reuse, the
+                other free buffers are given back to the system. None means
+                no limit.
+        """
+        self._max_free_bytes = max_free_bytes
+        self._lock = threading.Lock()
+        # the buffers given out by generation and size class, and the free
+        # ones by size class
+        self._in_use: tuple[dict[int, list[NDArray[np.uint8]]], ...] = (
+            {},
+            {},
+            {},
+        )
+        self._free: dict[int, list[NDArray[np.uint8]]] = {}
+        self._free_bytes = 0
+        self._live_bytes = 0
+        self._peak_live_bytes = 0
+        self._allocations = 0
+        self._new_buffers = 0
+        self._step_start = 0
+        self._step_allocations: list[int] = []
+        self._steps = 0
+        self._free_refcount = self._calibrate_refcount()
+
+    def empty(
+        self, shape: int | tuple[int, ...], dtype: DTypeLike
+    ) -> NDArray[Any]:
+        """Return an uninitialized aligned array from the pool."""
+        dtype = np.dtype(dtype)
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        if nbytes == 0:
+            return np.empty(shape, dtype=dtype)
+
+        nbytes_class = size_class(nbytes)
+        with self._lock:
+            free = self._free.get(nbytes_class)
+            if not free:
+                for generation in self._in_use[:2]:
+                    self._collect(generation, nbytes_class)
+                free = self._free.get(nbytes_class)
+            if free:
+                raw = free.pop()
+                self._free_bytes -= nbytes_class
+            else:
+                raw = np.empty(nbytes_class + ALIGNMENT, dtype=np.uint8)
+                self._new_buffers += 1
+            self._in_use[0].setdefault(nbytes_class, []).append(raw)
+            self._allocations += 1
+            self._live_bytes += nbytes_class
+            self._peak_live_bytes = max(self._peak_live_bytes, self._live_bytes)
+
+        offset = -raw.ctypes.data % ALIGNMENT
+        return raw[offset : offset + nbytes].view(dtype).reshape(shape)
+
+    def end_step(self) -> None:
+        """Record the allocations of the step, and collect the free buffers.
+
+        The buffers of the step and of the last step are checked, the
+        long-lived ones every `OLD_COLLECT_STEPS` steps.
+        """
+        with self._lock:
+            self._step_allocations.append(self._allocations - self._step_start)
+            self._step_start = self._allocations
+            self._steps += 1
+            young, survivors, old = self._in_use
+            if self._steps % OLD_COLLECT_STEPS == 0:
+                self._collect_all(old)
+            # the survivors are promoted to the next generation
+            self._collect_all(survivors)
+            _extend(old, survivors)
+            self._collect_all(young)
+            _extend(survivors, young)
+
+    def stats(self) -> PoolStats:
+        """Return the current statistics."""
+        with self._lock:
+            for generation in self._in_use:
+                self._collect_all(generation)
+            return PoolStats(
+                live_bytes=self._live_bytes,
+                peak_live_bytes=self._peak_live_bytes,
+                reserved_bytes=self._live_bytes + self._free_bytes,
+                allocations=self._allocations,
+                new_buffers=self._new_buffers,
+                step_allocations=tuple(self._step_allocations),
+            )
+
+    def clear(self) -> None:
+        """Give the free buffers back to the system."""
+        with self._lock:
+            for generation in self._in_use:
+                self._collect_all(generation)
+            self._free.clear()
+            self._free_bytes = 0
+
+    def _collect_all(
+        self, generation: dict[int, list[NDArray[np.uint8]]]
+    ) -> None:
+        for nbytes_class in list(generation):
+            self._collect(generation, nbytes_class)
+
+    def _collect(
+        self, generation: dict[int, list[NDArray[np.uint8]]], nbytes_class: int
+    ) -> None:
+        """Move the buffers without any array referring to them to free."""
+        buffers = generation.pop(nbytes_class, [])
+        still_used = []
+        for idx in range(len(buffers)):
+            if self._refcount(buffers, idx) > self._free_refcount:
+                still_used.append(buffers[idx])
+                continue
+            self._live_bytes -= nbytes_class
+            if (
+                self._max_free_bytes is None
+                or self._free_bytes + nbytes_class <= self._max_free_bytes
+            ):
+                self._free.setdefault(nbytes_class, []).append(buffers[idx])
+                self._free_bytes += nbytes_class
+        if still_used:
+            generation[nbytes_class] = still_used
+
+    @staticmethod
+    def _refcount(buffers: list[NDArray[np.uint8]], idx: int) -> int:
+        raw = buffers[idx]
+        return sys.getrefcount(raw)
+
+    def _calibrate_refcount(self) -> int:
+        # the reference count of a buffer only held by the pool, measured in
+        # the same way as in `_collect`, for any Python implementation details
+        buffers = [np.empty(1, dtype=np.uint8)]
+        return self._refcount(buffers, 0)
+
+
+def _extend(
+    generation: dict[int, list[NDArray[np.uint8]]],
+    other: dict[int, list[NDArray[np.uint8]]],
+) -> None:
+    """Move the buffers of other into the generation."""
+    for nbytes_class, buffers in other.items():
+        generation.setdefault(nbytes_class, []).extend(buffers)
+    other.clear()
+
+
+_current_pool: ContextVar[ArrayPool | None] = ContextVar(
+    "array_pool", default=None
+)
+
+
+def get_array_pool() -> ArrayPool | None:
+    """Return the pool used by the np_* helpers, None for the system one."""
+    return _current_pool.get()
+
+
+@contextmanager
+def array_pool(pool: ArrayPool | None) -> Iterator[ArrayPool | None]:
+    """Let the np_* helpers allocate from the pool within the context."""
+    token = _current_pool.set(pool)
+    try:
+        yield pool
+    finally:
+        _current_pool.reset(token)
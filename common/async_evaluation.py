@@ -0,0 +1,229 @@
+"""Evaluate the snapshots of the parameters in a background process.
+
+Evaluating the whole training and test data every epoch blocks the training
+for a long time. The `AsyncEvaluator` keeps a replica of the network in a
+worker process. The training process copies the parameters into a flat
+snapshot in shared memory and continues training at once, the worker loads
+the snapshot into its replica and evaluates it on the data.
+
+Diagram:
+    trainer: epoch 1 | snapshot 1 | epoch 2 | snapshot 2 | epoch 3 | ...
+    worker :              evaluate snapshot 1  | evaluate snapshot 2 | ...
+"""
+
+import multiprocessing
+import traceback
+from multiprocessing.connection import Connection
+from typing import Any, Callable
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.base import Layer
+from common.default_type_array import dtype_policy
+from common.evaluation import evaluate_in_batches
+from common.shared_ring_buffer import SharedRingBuffer
+
+_STOP_TAG = -1
+# the seconds to wait before checking whether the worker is alive
+_POLL_S = 0.1
+
+EvaluationResult = tuple[int, list[float]]
+"""The step of the snapshot and the metric of every dataset."""
+
+
+class AsyncEvaluator:
+    """Evaluate the parameter snapshots of a network in a worker process.
+
+    The results arrive in the order of the submitted snapshots. At most
+    `max_pending` snapshots wait for the worker, `submit` blocks if more,
+    so the memory is bounded even if the evaluation is slower than training.
+
+    Usage:
+        evaluator = AsyncEvaluator(network, accuracy, [(x_test, t_test)], 100)
+        for epoch in range(epochs):
+            train_one_epoch()
+            evaluator.submit(epoch, network.named_params())
+            for epoch, (test_acc,) in evaluator.results():
+                ...
+        remaining = evaluator.close()
+    """
+
+    def __init__(
+        self,
+        network: Layer,
+        evaluation_fn: Callable[[NDArray[np.floating], NDArray[Any]], float],
+        datasets: list[tuple[NDArray[np.floating | np.integer], NDArray[Any]]],
+        batch_size: int,
+        max_pending: int = 2,
+        context: Any | None = None,
+        x_scale: float = 1.0,
+    ) -> None:
+        """Initialize the evaluator and start the worker process.
+
+        Parameters:
+            network : Layer
+                The network to be evaluated, the worker gets a replica of it.
+            evaluation_fn : Callable
+                The metric of a batch, like `single_label_accuracy`. It has
+                to be picklable, i.e. a module level function.
+            datasets : list[tuple[NDArray, NDArray]]
+                The (x, t) to be evaluated for every snapshot.
+            batch_size : int
+                The batch size of the evaluation.
+            max_pending : int
+                The maximum number of the snapshots waiting for the worker.
+            context : multiprocessing context | None
+                The context for creating the process.
+            x_scale : float
+                The factor for converting an integer x, like 1 / 255 for the
+                uint8 images, see `evaluate_in_batches`.
+        """
+        ctx = context if context is not None else multiprocessing.get_context()
+        params = network.named_params()
+        self._layout: list[tuple[str, tuple[int, ...], int, int]] = []
+        offset = 0
+        for name, param in params.items():
+            self._layout.append((name, param.shape, offset, param.size))
+            offset += param.size
+        dtype = np.result_type(*params.values()) if params else np.float32
+        self._snapshot = np.empty(offset, dtype=dtype)
+
+        self._ring = SharedRingBuffer(
+            max_pending, max(self._snapshot.nbytes, 1), context=ctx
+        )
+        conn, child_conn = ctx.Pipe()
+        self._conn: Connection = conn
+        self._process = ctx.Process(
+            target=_run_evaluator,
+            args=(
+                network,
+                evaluation_fn,
+                datasets,
+                batch_size,
+                x_scale,
+                self._layout,
+                self._ring,
+                child_conn,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+        child_conn.close()
+        self._closed = False
+
+    def submit(
+        self, step: int, params: dict[str, NDArray[np.floating]]
+    ) -> None:
+        """Copy the parameters into a snapshot and queue it for evaluation.
+
+        Parameters:
+            step : int
+                A non-negative identifier of the snapshot, like the epoch.
+            params : dict[str, NDArray[np.floating]]
+                The current parameters of the network.
+        """
+        assert step >= 0 and not self._closed
+        for name, shape, offset, size in self._layout:
+            np.copyto(
+                self._snapshot[offset : offset + size].reshape(shape),
+                params[name],
+            )
+        self._put(self._snapshot, step)
+
+    def results(self, block: bool = False) -> list[EvaluationResult]:
+        """Return the arrived results, and wait for one result if block."""
+        arrived: list[EvaluationResult] = []
+        while self._conn.poll(None if block and not arrived else 0):
+            status, payload = self._conn.recv()
+            if status == "error":
+                raise RuntimeError(f"The evaluation failed:\n{payload}")
+            if status == "done":
+                break
+            arrived.append(payload)
+        return arrived
+
+    def close(self) -> list[EvaluationResult]:
+        """Wait for the pending snapshots, stop the worker, release memory.
+
+        Returns:
+            list[EvaluationResult]: The results which haven't been returned.
+        """
+        if self._closed:
+            return []
+        self._closed = True
+        remaining: list[EvaluationResult] = []
+        try:
+            self._put(np.empty(0, dtype=self._snapshot.dtype), _STOP_TAG)
+            while True:
+                status, payload = self._conn.recv()
+                if status == "error":
+                    raise RuntimeError(f"The evaluation failed:\n{payload}")
+                if status == "done":
+                    break
+                remaining.append(payload)
+        finally:
+            self._process.join(timeout=_POLL_S)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._conn.close()
+            self._ring.close()
+        return remaining
+
+    def _put(self, array: NDArray[Any], tag: int) -> None:
+        while True:
+            try:
+                self._ring.put(array, tag=tag, timeout=_POLL_S)
+                return
+            except TimeoutError:
+                if not self._process.is_alive():
+                    # raise the error of the worker if it sent one
+                    self.results()
+                    raise RuntimeError("The evaluation worker stopped.")
+
+    def __enter__(self) -> "AsyncEvaluator":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+def _run_evaluator(
+    network: Layer,
+    evaluation_fn: Callable[[NDArray[np.floating], NDArray[Any]], float],
+    datasets: list[tuple[NDArray[np.floating | np.integer], NDArray[Any]]],
+    batch_size: int,
+    x_scale: float,
+    layout: list[tuple[str, tuple[int, ...], int, int]],
+    ring: SharedRingBuffer,
+    conn: Connection,
+) -> None:
+    try:
+        network.train(False)
+        params = network.named_params()
+        while True:
+            step, snapshot = ring.get()
+            if step == _STOP_TAG:
+                break
+            for name, shape, offset, size in layout:
+                param = snapshot[offset : offset + size].reshape(shape)
+                np.copyto(params[name], param)
+            with dtype_policy(network.dtype_policy):
+                metrics = [
+                    evaluate_in_batches(
+                        network,
+                        evaluation_fn,
+                        x,
+                        t,
+                        batch_size,
+                        x_scale=x_scale,
+                    )[0]
+                    for x, t in datasets
+                ]
+            conn.send(("ok", (step, metrics)))
+        conn.send(("done", None))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        ring.close()
+        conn.close()
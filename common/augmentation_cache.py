@@ -0,0 +1,239 @@
+"""Precomputed augmentation epochs on disk, for reproducible runs.
+
+The augmentation of every epoch is rendered once into .npy files, chunk by
+chunk, and replayed by mapping the files into memory. A later run with the
+same configuration reads the pages (usually from the page cache) instead of
+augmenting again, and gets exactly the same data.
+
+The store is keyed by the seed, the number of the epochs, the factor, the
+chunk size (every chunk has its own random stream), the transform (its class
+and parameters) and a fingerprint of the source data. A store with another key
+is deleted and rendered again.
+
+Layout of a store:
+    <cache_dir>/<name>/meta.json            the key, written last
+    <cache_dir>/<name>/epoch_<e>_x.npy      the augmented inputs of epoch e
+    <cache_dir>/<name>/epoch_<e>_t.npy      their labels
+
+Usage:
+    cache = AugmentationCache(
+        "cache", "mnist_aug", x_train, t_train, BatchAugmenter(), epochs=5
+    )
+    for epoch in range(5):
+        loader = PrefetchBatchLoader(cache.dataset(epoch), None, 100)
+        ...
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from typing import Any, Callable
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.dataset import ArrayDataset, fingerprint_arrays
+
+META_FILE = "meta.json"
+_STORE_FILE = re.compile(
+    rf"{re.escape(META_FILE)}(\.\d+\.tmp)?|epoch_\d+_[xt]\.npy"
+)
+
+EpochTransform = Callable[[NDArray[Any], np.random.Generator], NDArray[Any]]
+"""A transform of a chunk of inputs, with the generator of the chunk."""
+
+
+class AugmentationCache:
+    """A store of the augmented epochs, rendered once and memory-mapped."""
+
+    def __init__(
+        self,
+        cache_dir: str,
+        name: str,
+        x: NDArray[Any],
+        t: NDArray[Any],
+        transform: EpochTransform,
+        epochs: int,
+        factor: float = 1.0,
+        seed: int = 0,
+        transform_params: dict[str, Any] | None = None,
+        chunk_size: int = 1024,
+    ) -> None:
+        """Open the store, render it if it's missing or outdated.
+
+        Parameters:
+            cache_dir : str
+                The directory of the stores.
+            name : str
+                The name of the store in the cache_dir, a relative path.
+            x : NDArray
+                The source inputs, the first axis is the sample.
+            t : NDArray
+                The source labels.
+            transform : EpochTransform
+                The augmentation, called with a chunk of the inputs and the
+                generator of the chunk, like `BatchAugmenter`.
+            epochs : int
+                The number of the rendered epochs.
+            factor : float
+                The size of an epoch relative to the source. Every epoch has
+                every source sample floor(factor) times, and the fraction is
+                drawn randomly without replacement.
+            seed : int
+                The seed of the sampling and the augmentation.
+            transform_params : dict[str, Any] | None
+                The parameters of the transform for the key. If None, the
+                `config()` of the transform is used.
+            chunk_size : int
+                The number of the samples augmented at a time, which bounds
+                the memory of the rendering. It's a part of the key, since
+                every chunk has its own generator.
+
+        Raises:
+            ValueError: If the name isn't a relative path in the cache_dir,
+                or it's a directory with other files than a store.
+        """
+        assert epochs >= 1 and factor > 0 and chunk_size >= 1
+        normalized = os.path.normpath(name) if name else ""
+        if (
+            os.path.isabs(name)
+            or normalized in ("", os.curdir)
+            or normalized.split(os.sep)[0] == os.pardir
+        ):
+            raise ValueError(f"The store name {name!r} isn't in the cache.")
+        if transform_params is None:
+            if not hasattr(transform, "config"):
+                raise ValueError(
+                    "The transform has no config(), give transform_params."
+                )
+            transform_params = transform.config()
+        self._dir = os.path.join(cache_dir, name)
+        self._epochs = epochs
+        self._meta: dict[str, Any] = {
+            "seed": seed,
+            "epochs": epochs,
+            "factor": factor,
+            "chunk_size": chunk_size,
+            "transform": (
+                f"{type(transform).__module__}.{type(transform).__qualname__}"
+            ),
+            "transform_params": transform_params,
+            "data": fingerprint_arrays(x, t),
+        }
+        self._key = hashlib.sha256(
+            json.dumps(self._meta, sort_keys=True).encode()
+        ).hexdigest()
+        self._meta["key"] = self._key
+        self.rendered = False
+        if not self._is_valid():
+            self._render(x, t, transform, factor, seed, chunk_size)
+            self.rendered = True
+
+    @property
+    def key(self) -> str:
+        """Return the hash of the configuration."""
+        return self._key
+
+    @property
+    def epochs(self) -> int:
+        return self._epochs
+
+    def epoch(self, epoch: int) -> tuple[np.memmap, np.memmap]:
+        """Return the read-only memory maps (x, t) of the epoch."""
+        assert 0 <= epoch < self._epochs
+        x_file, t_file = self._epoch_files(epoch)
+        return (
+            np.load(x_file, mmap_mode="r"),
+            np.load(t_file, mmap_mode="r"),
+        )
+
+    def dataset(self, epoch: int) -> ArrayDataset:
+        """Return the epoch as a dataset, for the loaders and the trainer."""
+        return ArrayDataset(*self.epoch(epoch))
+
+    def _epoch_files(self, epoch: int) -> tuple[str, str]:
+        prefix = os.path.join(self._dir, f"epoch_{epoch}")
+        return f"{prefix}_x.npy", f"{prefix}_t.npy"
+
+    def _is_valid(self) -> bool:
+        try:
+            with open(os.path.join(self._dir, META_FILE)) as f:
+                return bool(json.load(f).get("key") == self.key)
+        except (OSError, ValueError):
+            return False
+
+    def _render(
+        self,
+        x: NDArray[Any],
+        t: NDArray[Any],
+        transform: EpochTransform,
+        factor: float,
+        seed: int,
+        chunk_size: int,
+    ) -> None:
+        # the outdated store is removed, the key is written at the end, so a
+        # partial store is never valid
+        if os.path.isdir(self._dir):
+            others = [
+                entry
+                for entry in os.listdir(self._dir)
+                if not _STORE_FILE.fullmatch(entry)
+            ]
+            if others:
+                raise ValueError(
+                    f"{self._dir} isn't an augmentation store, it has "
+                    f"{', '.join(sorted(others)[:3])}."
+                )
+            shutil.rmtree(self._dir)
+        os.makedirs(self._dir)
+        num = x.shape[0]
+        repeats, fraction = divmod(factor, 1.0)
+        for epoch in range(self._epochs):
+            rng = np.random.default_rng([seed, epoch])
+            extra = rng.choice(num, int(round(num * fraction)), replace=False)
+            order = np.concatenate(
+                [np.tile(np.arange(num), int(repeats)), extra]
+            )
+            assert order.size > 0, "An epoch has no sample."
+            rng.shuffle(order)
+            self._render_epoch(epoch, x, t, order, transform, seed, chunk_size)
+
+        tmp_file = os.path.join(self._dir, f"{META_FILE}.{os.getpid()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self._meta, f, sort_keys=True, indent=2)
+        os.replace(tmp_file, os.path.join(self._dir, META_FILE))
+
+    def _render_epoch(
+        self,
+        epoch: int,
+        x: NDArray[Any],
+        t: NDArray[Any],
+        order: NDArray[np.intp],
+        transform: EpochTransform,
+        seed: int,
+        chunk_size: int,
+    ) -> None:
+        x_file, t_file = self._epoch_files(epoch)
+        x_out = None
+        t_out = np.lib.format.open_memmap(
+            t_file, mode="w+", dtype=t.dtype, shape=(order.size, *t.shape[1:])
+        )
+        for chunk, start in enumerate(range(0, order.size, chunk_size)):
+            indices = order[start : start + chunk_size]
+            rng = np.random.default_rng([seed, epoch, chunk])
+            augmented = transform(x[indices], rng)
+            if x_out is None:
+                # the transform decides the type, like the float type
+                x_out = np.lib.format.open_memmap(
+                    x_file,
+                    mode="w+",
+                    dtype=augmented.dtype,
+                    shape=(order.size, *augmented.shape[1:]),
+                )
+            x_out[start : start + indices.size] = augmented
+            t_out[start : start + indices.size] = t[indices]
+        assert x_out is not None
+        x_out.flush()
+        t_out.flush()
@@ -1,13 +1,35 @@
 import abc
+import functools
 from dataclasses import dataclass
+from typing import Any, Callable
 
 import numpy as np
 from numpy.typing import NDArray
 
+from common.default_type_array import DTypePolicy, dtype_policy
+
+# the methods of the layers run within the dtype policy of the layer
+_POLICY_METHODS = ("forward", "forward_to_loss", "backward")
+
 
 class Layer(abc.ABC):
     """Base class for neural network layers."""
 
+    dtype_policy: DTypePolicy | None = None
+    """The dtype policy the layer is created with, None for the default.
+
+    The forward, forward_to_loss and backward of a layer with a policy run
+    within `dtype_policy(layer.dtype_policy)`, from any thread, so the buffers
+    created by the `np_*` helpers have the same type as the parameters.
+    """
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        for name in _POLICY_METHODS:
+            method = cls.__dict__.get(name)
+            if callable(method):
+                setattr(cls, name, _within_policy(method))
+
     @abc.abstractmethod
     def named_params(self) -> dict[str, NDArray[np.floating]]:
         """Return the parameters of the network.
@@ -21,7 +43,8 @@ class Layer(abc.ABC):
         """Set the training flag of the layer.
 
         During training, some layer may need to change their behavior, for
-        example, dropout layer.
+        example, dropout layer. Out of training, the layer is only used for the
+        inference, so it doesn't need to keep the cache for the backward.
 
         Parameters:
             flag : bool
@@ -99,6 +122,35 @@ class LayerConfig(abc.ABC):
                 the trained parameters.
         """
 
+    def create_with_policy(
+        self,
+        policy: DTypePolicy,
+        parameters: dict[str, NDArray[np.floating]] | None = None,
+    ) -> Layer:
+        """Create the layer with the float type of the policy.
+
+        The sub-layers are created within the policy too, and the returned
+        layer carries the policy in its `dtype_policy`, so its calls run
+        within the policy. See `create` for the parameters.
+        """
+        with dtype_policy(policy):
+            layer = self.create(parameters)
+        layer.dtype_policy = policy
+        return layer
+
+
+def _within_policy(method: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a method of the layer to run within the policy of the layer."""
+
+    @functools.wraps(method)
+    def wrapper(self: Layer, *args: Any, **kwargs: Any) -> Any:
+        if self.dtype_policy is None:
+            return method(self, *args, **kwargs)
+        with dtype_policy(self.dtype_policy):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
 
 class Optimizer(abc.ABC):
     """Base class for all optimizers."""
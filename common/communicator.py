@@ -0,0 +1,217 @@
+"""Communicators for exchanging arrays between data-parallel workers.
+
+A communicator lets every worker (a process holding a shard of the mini-batch)
+reduce a small array with the other workers of the same group. It is used by
+the layers that need global statistics, like the synchronized batch norm.
+
+Classes:
+    Communicator: Base class of the communicators.
+    LocalCommunicator: A communicator for a single worker (world size 1).
+    SharedMemoryGroup: Owner of the shared memory used by a local group.
+    SharedMemoryCommunicator: The communicator of one worker in the group.
+"""
+
+import abc
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.synchronize import Barrier
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+# all the reductions are accumulated with float64, whatever the input type is.
+REDUCE_TYPE = np.float64
+
+
+class Communicator(abc.ABC):
+    """Base class for the communicators."""
+
+    @property
+    @abc.abstractmethod
+    def rank(self) -> int:
+        """Return the index of the worker in the group, from 0."""
+
+    @property
+    @abc.abstractmethod
+    def world_size(self) -> int:
+        """Return the number of workers in the group."""
+
+    @abc.abstractmethod
+    def all_reduce(self, array: NDArray[np.floating]) -> NDArray[np.floating]:
+        """Sum the array over all the workers of the group.
+
+        Every worker of the group has to call this method with an array of the
+        same shape, otherwise the workers will wait for each other forever.
+
+        Parameters:
+            array : NDArray[np.floating]
+                The local array to be reduced. It is not modified.
+
+        Returns:
+            NDArray[np.floating]: A new array with the sum over all workers,
+                which has the same shape and type as the input array.
+        """
+
+
+class LocalCommunicator(Communicator):
+    """A communicator for a single process, the reduction is the identity.
+
+    It makes a layer that needs a communicator behave like a normal layer,
+    which is useful for the verification and the single process training.
+    """
+
+    @property
+    def rank(self) -> int:
+        return 0
+
+    @property
+    def world_size(self) -> int:
+        return 1
+
+    def all_reduce(self, array: NDArray[np.floating]) -> NDArray[np.floating]:
+        """See the base class."""
+        return array.copy()
+
+
+class SharedMemoryCommunicator(Communicator):
+    """The communicator of one worker in a `SharedMemoryGroup`.
+
+    The shared memory is a (world_size, capacity) float64 matrix. In one
+    reduction, every worker writes its array to its own row, waits for the
+    others, then sums all the rows. A second barrier prevents a fast worker
+    from overwriting its row before the slow workers finished reading.
+
+    It is picklable, so it can be given to `multiprocessing.Process` as an
+    argument, the shared memory is attached lazily in the worker process.
+    """
+
+    def __init__(
+        self,
+        rank: int,
+        world_size: int,
+        capacity: int,
+        shm_name: str,
+        barrier: Barrier,
+    ) -> None:
+        assert 0 <= rank < world_size
+        self._rank = rank
+        self._world_size = world_size
+        self._capacity = capacity
+        self._shm_name = shm_name
+        self._barrier = barrier
+        self._shm: SharedMemory | None = None
+        self._buffer: NDArray[np.floating] | None = None
+
+    @property
+    def rank(self) -> int:
+        return self._rank
+
+    @property
+    def world_size(self) -> int:
+        return self._world_size
+
+    def all_reduce(self, array: NDArray[np.floating]) -> NDArray[np.floating]:
+        """See the base class."""
+        if array.size > self._capacity:
+            raise ValueError(
+                f"The array has {array.size} elements, but the capacity of "
+                f"the communicator is {self._capacity}."
+            )
+        buffer = self._get_buffer()
+        size = array.size
+        buffer[self._rank, :size] = array.ravel()
+        self._barrier.wait()
+        result = np.sum(buffer[:, :size], axis=0, dtype=REDUCE_TYPE)
+        self._barrier.wait()
+        return result.reshape(array.shape).astype(array.dtype, copy=False)
+
+    def close(self) -> None:
+        """Detach the shared memory from this process."""
+        self._buffer = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def _get_buffer(self) -> NDArray[np.floating]:
+        if self._buffer is None:
+            self._shm = SharedMemory(name=self._shm_name)
+            self._buffer = np.ndarray(
+                (self._world_size, self._capacity),
+                dtype=REDUCE_TYPE,
+                buffer=self._shm.buf,
+            )
+        return self._buffer
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the attached memory belongs to the process, attach again after
+        # unpickling.
+        state = self.__dict__.copy()
+        state["_shm"] = None
+        state["_buffer"] = None
+        return state
+
+
+class SharedMemoryGroup:
+    """Owner of the shared memory for a group of local worker processes.
+
+    Usage:
+        group = SharedMemoryGroup(world_size=2, capacity=1024)
+        processes = [
+            Process(target=worker, args=(group.communicator(rank),))
+            for rank in range(group.world_size)
+        ]
+        ...
+        group.close()
+
+    The owner (usually the main process) has to keep the group alive until
+    all the workers finished, then close it to release the shared memory.
+    """
+
+    def __init__(
+        self,
+        world_size: int,
+        capacity: int,
+        context: Any | None = None,
+    ) -> None:
+        """Initialize the group.
+
+        Parameters:
+            world_size : int
+                The number of the workers in the group.
+            capacity : int
+                The maximum number of elements in one reduction. For the batch
+                norm, it is 2 * num_channel + 1.
+            context : multiprocessing context | None
+                The context used for creating the barrier, it should be the
+                same as the one creating the worker processes.
+        """
+        assert world_size >= 1 and capacity >= 1
+        ctx = context if context is not None else multiprocessing
+        self._world_size = world_size
+        self._capacity = capacity
+        self._barrier = ctx.Barrier(world_size)
+        nbytes = world_size * capacity * np.dtype(REDUCE_TYPE).itemsize
+        self._shm: SharedMemory | None = SharedMemory(create=True, size=nbytes)
+
+    @property
+    def world_size(self) -> int:
+        return self._world_size
+
+    def communicator(self, rank: int) -> SharedMemoryCommunicator:
+        """Return the communicator for the worker with the rank."""
+        assert self._shm is not None, "The group has been closed."
+        return SharedMemoryCommunicator(
+            rank=rank,
+            world_size=self._world_size,
+            capacity=self._capacity,
+            shm_name=self._shm.name,
+            barrier=self._barrier,
+        )
+
+    def close(self) -> None:
+        """Release the shared memory, call it after all workers finished."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
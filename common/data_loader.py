@@ -0,0 +1,312 @@
+"""Mini-batch loader with background prefetching.
+
+Building a mini-batch (the shuffled index, the fancy-index gathering of
+`x_train[batch_idx]`, the augmentation) stalls the computation if it runs in
+the training thread. The `PrefetchBatchLoader` builds the next mini-batches in
+a producer thread, into a ring of preallocated buffers, so the training step
+gets a ready mini-batch most of the time.
+
+Diagram (prefetch = 2, 3 slots):
+    producer: gather -> slot 0 | gather -> slot 1 | wait a free slot ...
+    consumer:           train on slot 0 | release 0, train on slot 1 | ...
+
+The dataset can stay uint8 (or memory-mapped) in memory, 4 times smaller than
+float32. With an x_dtype, the gathered uint8 rows are converted and scaled
+(like by 1 / 255) into the float buffer of the slot, i.e. only the mini-batches
+in flight are floats.
+"""
+
+import contextvars
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+
+import numpy as np
+from numpy.typing import DTypeLike, NDArray
+
+from common.dataset import ArrayDataset, BatchSampler, Dataset
+
+# the seconds to wait before checking whether the producer should stop
+_POLL_S = 0.1
+
+
+@dataclass(kw_only=True)
+class LoaderStats:
+    """The statistics of the loader, accumulated over all epochs."""
+
+    batches: int = 0
+    """The number of the mini-batches given to the consumer."""
+
+    stall_s: float = 0.0
+    """The total seconds the consumer waited for a mini-batch."""
+
+    produce_s: float = 0.0
+    """The total seconds the producer spent on building mini-batches."""
+
+    queue_depth_sum: int = 0
+    """The sum of the ready mini-batches seen at every request."""
+
+    max_queue_depth: int = 0
+    """The maximum of the ready mini-batches seen at a request."""
+
+    @property
+    def mean_queue_depth(self) -> float:
+        """Return the mean number of the ready mini-batches at a request."""
+        return self.queue_depth_sum / self.batches if self.batches else 0.0
+
+    @property
+    def mean_stall_s(self) -> float:
+        """Return the mean seconds of waiting for one mini-batch."""
+        return self.stall_s / self.batches if self.batches else 0.0
+
+
+def gather_batch(
+    x: NDArray[Any],
+    t: NDArray[Any],
+    indices: NDArray[np.intp],
+    x_out: NDArray[Any],
+    t_out: NDArray[Any],
+    x_staging: NDArray[Any] | None = None,
+    x_scale: float = 1.0,
+) -> None:
+    """Gather the samples into the preallocated buffers, without a new array.
+
+    If x_staging is given, the rows of x are gathered into it first, then
+    converted to the type of x_out and multiplied by x_scale.
+    """
+    if x_staging is None:
+        np.take(x, indices, axis=0, out=x_out)
+    else:
+        np.take(x, indices, axis=0, out=x_staging)
+        np.multiply(x_staging, x_scale, out=x_out, dtype=x_out.dtype)
+    np.take(t, indices, axis=0, out=t_out)
+
+
+class PrefetchBatchLoader:
+    """Iterate the shuffled mini-batches of (x, t) for one epoch.
+
+    The yielded arrays are views into the buffers of the loader, they are
+    valid until the next mini-batch is requested. Copy them if necessary.
+
+    The data can be a `Dataset` (like the memory maps of a dataset larger than
+    the memory) instead of the two arrays, and a `BatchSampler` (like a block
+    shuffling one) can give the indices of the mini-batches.
+
+    Usage:
+        loader = PrefetchBatchLoader(x_train, t_train, batch_size=100)
+        for epoch in range(epochs):
+            for x_batch, t_batch in loader:
+                ...
+        print(loader.stats.mean_stall_s)
+    """
+
+    def __init__(
+        self,
+        x: NDArray[Any] | Dataset,
+        t: NDArray[Any] | None,
+        batch_size: int,
+        prefetch: int = 2,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        transform: Callable[[NDArray[Any]], NDArray[Any]] | None = None,
+        seed: int | None = None,
+        x_dtype: DTypeLike | None = None,
+        x_scale: float = 1.0,
+        sampler: BatchSampler | None = None,
+    ) -> None:
+        """Initialize the loader.
+
+        Parameters:
+            x : NDArray | Dataset
+                The input data, the first axis is the sample, or a dataset of
+                both the input data and the labels.
+            t : NDArray | None
+                The labels, the first axis is the sample. None if x is a
+                dataset.
+            batch_size : int
+                The size of a mini-batch.
+            prefetch : int
+                The number of the mini-batches built ahead by the producer
+                thread. 0 means building every mini-batch in the consumer's
+                thread, without any thread.
+            shuffle : bool
+                If True, use a new random permutation every epoch.
+            drop_last : bool
+                If True, drop the last mini-batch smaller than the batch size.
+            transform : Callable[[NDArray], NDArray] | None
+                An optional transform (like the augmentation) for the x of a
+                mini-batch, run in the producer thread. It should return an
+                array with the same shape, and may modify its input in place.
+            seed : int | None
+                The random seed for the permutation.
+            x_dtype : DTypeLike | None
+                The type of the yielded x, like the float type of the network
+                for the uint8 x. None keeps the type of x, without conversion.
+            x_scale : float
+                The factor multiplied with the x converted to x_dtype, like
+                1 / 255 for normalizing the uint8 images. It's applied before
+                the transform.
+            sampler : BatchSampler | None
+                The sampler of the mini-batch indices, which replaces shuffle,
+                drop_last and seed. Its batch size has to be batch_size.
+        """
+        if isinstance(x, Dataset):
+            assert t is None, "The labels are in the dataset."
+            dataset = x
+        else:
+            assert t is not None
+            dataset = ArrayDataset(x, t)
+        if sampler is None:
+            sampler = BatchSampler(
+                len(dataset),
+                batch_size,
+                shuffle=shuffle,
+                drop_last=drop_last,
+                seed=seed,
+            )
+        assert sampler.batch_size == batch_size
+        assert sampler.num_samples == len(dataset)
+        assert prefetch >= 0
+        assert x_dtype is not None or x_scale == 1.0, "x_scale needs x_dtype."
+        x, t = dataset.x, dataset.t
+        self._x = x
+        self._t = t
+        self._sampler = sampler
+        self._prefetch = prefetch
+        self._transform = transform
+        self._x_scale = x_scale
+        self.stats = LoaderStats()
+
+        # one more slot for the mini-batch used by the consumer
+        num_slots = prefetch + 1
+        x_shape = (batch_size, *x.shape[1:])
+        self._x_slots = [
+            np.empty(x_shape, dtype=x.dtype if x_dtype is None else x_dtype)
+            for _ in range(num_slots)
+        ]
+        # the raw rows are gathered here before the conversion, only one
+        # mini-batch is built at a time
+        self._x_staging: NDArray[Any] | None = None
+        if x_dtype is not None:
+            self._x_staging = np.empty(x_shape, dtype=x.dtype)
+        self._t_slots = [
+            np.empty((batch_size, *t.shape[1:]), dtype=t.dtype)
+            for _ in range(num_slots)
+        ]
+
+    def __len__(self) -> int:
+        """Return the number of the mini-batches in one epoch."""
+        return len(self._sampler)
+
+    def close(self) -> None:
+        """Nothing to release, the producer thread ends with every epoch.
+
+        It's the same interface as the `ProcessBatchLoader`.
+        """
+
+    def __iter__(self) -> Iterator[tuple[NDArray[Any], NDArray[Any]]]:
+        if self._prefetch == 0:
+            return self._iterate_inline()
+        return self._iterate_prefetched()
+
+    def _batch_indices(self) -> list[NDArray[np.intp]]:
+        # drawn in the consumer's thread, the sampler isn't shared
+        return list(self._sampler)
+
+    def _fill(
+        self, slot: int, indices: NDArray[np.intp]
+    ) -> tuple[NDArray[Any], NDArray[Any]]:
+        start = time.perf_counter()
+        size = indices.shape[0]
+        x_batch = self._x_slots[slot][:size]
+        t_batch = self._t_slots[slot][:size]
+        staging = None
+        if self._x_staging is not None:
+            staging = self._x_staging[:size]
+        gather_batch(
+            self._x, self._t, indices, x_batch, t_batch, staging, self._x_scale
+        )
+        if self._transform is not None:
+            transformed = self._transform(x_batch)
+            if transformed is not x_batch:
+                np.copyto(x_batch, transformed)
+        self.stats.produce_s += time.perf_counter() - start
+        return x_batch, t_batch
+
+    def _iterate_inline(self) -> Iterator[tuple[NDArray[Any], NDArray[Any]]]:
+        for indices in self._batch_indices():
+            start = time.perf_counter()
+            batch = self._fill(0, indices)
+            self._record(time.perf_counter() - start, queue_depth=0)
+            yield batch
+
+    def _iterate_prefetched(
+        self,
+    ) -> Iterator[tuple[NDArray[Any], NDArray[Any]]]:
+        free_slots: queue.Queue[int] = queue.Queue()
+        for slot in range(len(self._x_slots)):
+            free_slots.put(slot)
+        ready: queue.Queue[Any] = queue.Queue()
+        stop = threading.Event()
+        # the transform runs in the consumer's context, like its dtype policy
+        producer = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(
+                self._produce,
+                self._batch_indices(),
+                free_slots,
+                ready,
+                stop,
+            ),
+            name="batch_prefetch",
+            daemon=True,
+        )
+        producer.start()
+
+        in_use: int | None = None
+        try:
+            for _ in range(len(self)):
+                if in_use is not None:
+                    free_slots.put(in_use)
+                depth = ready.qsize()
+                start = time.perf_counter()
+                item = ready.get()
+                self._record(time.perf_counter() - start, queue_depth=depth)
+                if isinstance(item, BaseException):
+                    raise item
+                in_use, x_batch, t_batch = item
+                yield x_batch, t_batch
+        finally:
+            stop.set()
+            producer.join()
+
+    def _produce(
+        self,
+        batch_indices: list[NDArray[np.intp]],
+        free_slots: queue.Queue[int],
+        ready: queue.Queue[Any],
+        stop: threading.Event,
+    ) -> None:
+        try:
+            for indices in batch_indices:
+                slot = None
+                while slot is None:
+                    if stop.is_set():
+                        return
+                    try:
+                        slot = free_slots.get(timeout=_POLL_S)
+                    except queue.Empty:
+                        pass
+                ready.put((slot, *self._fill(slot, indices)))
+        except BaseException as error:
+            ready.put(error)
+
+    def _record(self, stall_s: float, queue_depth: int) -> None:
+        self.stats.batches += 1
+        self.stats.stall_s += stall_s
+        self.stats.queue_depth_sum += queue_depth
+        self.stats.max_queue_depth = max(
+            self.stats.max_queue_depth, queue_depth
+        )
@@ -0,0 +1,151 @@
+"""The datasets and the samplers of the mini-batches, for out-of-core data.
+
+A `Dataset` holds the inputs x and the labels t as arrays indexed by the
+sample, which can be memory maps of files larger than the memory. Only the
+pages of the samples in a mini-batch are read, so the trainer works the same
+as with arrays in memory.
+
+Reading random samples of a memory map is random I/O. The `BatchSampler`
+can shuffle by blocks: the order of the blocks of consecutive samples is
+shuffled, and the samples within a block, so a mini-batch comes from one or
+two blocks, and the blocks are read mostly sequentially.
+
+Usage:
+    train = load_idx_dataset(images_path, labels_path, cache_dir)
+    sampler = BatchSampler(len(train), batch_size=100, block_size=10000)
+    trainer = LayerTrainer(..., x_train=train, t_train=None,
+                           batch_sampler=sampler, ...)
+"""
+
+import abc
+import hashlib
+from typing import Any, Iterator
+
+import numpy as np
+from numpy.typing import NDArray
+
+
+class Dataset(abc.ABC):
+    """The samples (x, t) of a dataset, the first axis is the sample."""
+
+    @property
+    @abc.abstractmethod
+    def x(self) -> NDArray[Any]:
+        """Return the inputs, an array or a memory map."""
+
+    @property
+    @abc.abstractmethod
+    def t(self) -> NDArray[Any]:
+        """Return the labels, an array or a memory map."""
+
+    def __len__(self) -> int:
+        """Return the number of the samples."""
+        return int(self.x.shape[0])
+
+
+class ArrayDataset(Dataset):
+    """A dataset of two arrays (or memory maps)."""
+
+    def __init__(self, x: NDArray[Any], t: NDArray[Any]) -> None:
+        assert x.shape[0] == t.shape[0], "x and t have different sizes."
+        self._x = x
+        self._t = t
+
+    @property
+    def x(self) -> NDArray[Any]:
+        return self._x
+
+    @property
+    def t(self) -> NDArray[Any]:
+        return self._t
+
+
+def fingerprint_arrays(*arrays: NDArray[Any], chunk_rows: int = 4096) -> str:
+    """Return a stable hash of the shapes, types and contents of the arrays.
+
+    The arrays (or memory maps) are read chunk by chunk, so the memory
+    doesn't grow with the data.
+    """
+    digest = hashlib.sha256()
+    for array in arrays:
+        digest.update(f"{array.shape}{array.dtype.str}".encode())
+        array = np.atleast_1d(array)
+        for start in range(0, array.shape[0], chunk_rows):
+            chunk = np.ascontiguousarray(array[start : start + chunk_rows])
+            digest.update(chunk.data)
+    return digest.hexdigest()
+
+
+class BatchSampler:
+    """Iterate the sample indices of the mini-batches of one epoch."""
+
+    def __init__(
+        self,
+        num_samples: int,
+        batch_size: int,
+        shuffle: bool = True,
+        block_size: int | None = None,
+        drop_last: bool = False,
+        seed: int | None = None,
+    ) -> None:
+        """Initialize the sampler.
+
+        Parameters:
+            num_samples : int
+                The number of the samples of the dataset.
+            batch_size : int
+                The size of a mini-batch.
+            shuffle : bool
+                If True, use a new random order every epoch.
+            block_size : int | None
+                The number of the consecutive samples shuffled as a block. The
+                indices of a mini-batch are sorted, so a memory map is read
+                forward. None shuffles all samples freely.
+            drop_last : bool
+                If True, drop the last mini-batch smaller than the batch size.
+            seed : int | None
+                The random seed for the order.
+        """
+        assert num_samples >= 0 and batch_size >= 1
+        assert block_size is None or block_size >= 1
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self._shuffle = shuffle
+        self._block_size = block_size
+        self._drop_last = drop_last
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        """Return the number of the mini-batches in one epoch."""
+        if self._drop_last:
+            return self.num_samples // self.batch_size
+        return -(-self.num_samples // self.batch_size)
+
+    def __iter__(self) -> Iterator[NDArray[np.intp]]:
+        order = self._order()
+        size = self.batch_size
+        for start in range(0, len(self) * size, size):
+            indices = order[start : start + size]
+            if self._block_size is not None:
+                indices.sort()
+            yield indices
+
+    def _order(self) -> NDArray[np.intp]:
+        num = self.num_samples
+        if not self._shuffle:
+            return np.arange(num)
+        if self._block_size is None:
+            return self._rng.permutation(num)
+
+        block_size = self._block_size
+        num_blocks = -(-num // block_size)
+        order = np.empty(num, dtype=np.intp)
+        filled = 0
+        for block in self._rng.permutation(num_blocks):
+            start = block * block_size
+            count = min(block_size, num - start)
+            order[filled : filled + count] = start + self._rng.permutation(
+                count
+            )
+            filled += count
+        return order
@@ -1,63 +1,152 @@
-from typing import TypeAlias
+"""The default float type of the neural networks, and the array helpers.
+
+The float type comes from a `DTypePolicy`. Every thread (and every asyncio
+task) has its own current policy, set by the `dtype_policy` context manager,
+so networks of different precisions can be created and run concurrently in
+one process. Without a current policy, the process default policy is used,
+which is set by the old `set_default_type` API.
+
+Usage:
+    with dtype_policy(DTypePolicy(np.float64)):
+        network = net_config.create()  # float64 parameters
+        y = network.forward(x)  # float64 buffers from the np_* helpers
+
+The np_empty, np_zeros, np_ones, np_zeros_like and np_sqrt allocate from the
+current `ArrayPool` (see `common/array_pool.py`) if one is set.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Iterator, TypeAlias
 
 import numpy as np
-from numpy.typing import NDArray
+from numpy.typing import DTypeLike, NDArray
+
+from common.array_pool import get_array_pool
 
 NN_FLOAT_TYPE: TypeAlias = np.float32
 
 
+@dataclass(frozen=True)
+class DTypePolicy:
+    """The float types of a network."""
+
+    float_type: Any = np.float32
+    """The type of the parameters, the activations and the buffers."""
+
+    @property
+    def reduce_type(self) -> np.dtype:
+        """The type for accumulating the sums, see `get_reduce_type`."""
+        return get_reduce_type(self.float_type)
+
+
+_default_policy = DTypePolicy(NN_FLOAT_TYPE)
+_current_policy: ContextVar[DTypePolicy | None] = ContextVar(
+    "dtype_policy", default=None
+)
+
+
+def get_policy() -> DTypePolicy:
+    """Return the policy of the current thread, or the process default."""
+    policy = _current_policy.get()
+    return _default_policy if policy is None else policy
+
+
+@contextmanager
+def dtype_policy(policy: DTypePolicy | None) -> Iterator[DTypePolicy]:
+    """Use the policy in the current thread within the context.
+
+    Parameters:
+        policy : DTypePolicy | None
+            The policy to be used, None keeps the current policy.
+    """
+    if policy is None:
+        yield get_policy()
+        return
+    token = _current_policy.set(policy)
+    try:
+        yield policy
+    finally:
+        _current_policy.reset(token)
+
+
 def get_default_type() -> TypeAlias:
     """Return the default float type for neural networks."""
-    return NN_FLOAT_TYPE
+    return get_policy().float_type
 
 
 def set_default_type(float_type: TypeAlias) -> None:
-    """Set the default float type for neural networks."""
-    global NN_FLOAT_TYPE
+    """Set the float type of the process default policy.
+
+    It doesn't change the policies entered by `dtype_policy`.
+    """
+    global NN_FLOAT_TYPE, _default_policy
     NN_FLOAT_TYPE = float_type
+    _default_policy = DTypePolicy(float_type)
+
+
+def get_reduce_type(dtype: DTypeLike) -> np.dtype:
+    """Return the type for accumulating a sum (like a gradient) of the type.
+
+    The float16 has only 11 significant bits, a long sum loses the small
+    terms, so the sums of float16 are accumulated in float32.
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.float16:
+        return np.dtype(np.float32)
+    return dtype
 
 
 def np_array(mat) -> NDArray[np.floating]:  # type: ignore
     """Convert a list to a numpy array."""
-    return np.array(mat, dtype=NN_FLOAT_TYPE)
+    return np.array(mat, dtype=get_default_type())
 
 
 def np_empty(shape: tuple[int, ...]) -> NDArray[np.floating]:
     """Return a empty array of given shape and type, without initialization."""
-    return np.empty(shape=shape, dtype=NN_FLOAT_TYPE)
+    pool = get_array_pool()
+    if pool is not None:
+        return pool.empty(shape, get_default_type())
+    return np.empty(shape=shape, dtype=get_default_type())
 
 
-def np_float(value: float) -> NN_FLOAT_TYPE:
-    """Return a floating-point number."""
-    return NN_FLOAT_TYPE(value)
+def np_float(value: float) -> np.floating:
+    """Return a floating-point number of the default type."""
+    float_type: type[np.floating] = get_default_type()
+    return float_type(value)
 
 
 def np_normal(
     loc: float, scale: float, size: tuple[int, ...]
 ) -> NDArray[np.floating]:
     """Draw random samples from a normal (Gaussian) distribution."""
-    return np.random.normal(loc, scale, size).astype(NN_FLOAT_TYPE)
+    return np.random.normal(loc, scale, size).astype(get_default_type())
 
 
 def np_ones(shape: tuple[int, ...]) -> NDArray[np.floating]:
     """Return a new array of given shape and type, filled with ones."""
-    return np.ones(shape, dtype=NN_FLOAT_TYPE)
+    if get_array_pool() is not None:
+        result = np_empty(shape)
+        result.fill(1)
+        return result
+    return np.ones(shape, dtype=get_default_type())
 
 
 def np_rand(shape: tuple[int, ...]) -> NDArray[np.floating]:
     """Return random floats in the half-open interval [0.0, 1.0)."""
-    return np.random.rand(*shape).astype(NN_FLOAT_TYPE)
+    return np.random.rand(*shape).astype(get_default_type())
 
 
 def np_randn(shape: tuple[int, ...]) -> NDArray[np.floating]:
     """Return a sample (or samples) from the "standard normal" distribution."""
-    return np.random.randn(*shape).astype(NN_FLOAT_TYPE)
+    return np.random.randn(*shape).astype(get_default_type())
 
 
 def np_sqrt(x: NDArray[np.floating]) -> NDArray[np.floating]:
     """Return the non-negative square-root of an array, element-wise."""
-    result = np.zeros_like(x, dtype=NN_FLOAT_TYPE)
-    np.sqrt(x, out=result, dtype=NN_FLOAT_TYPE)
+    result = np_empty(x.shape)
+    np.sqrt(x, out=result, dtype=result.dtype)
     return result
 
 
@@ -65,14 +154,19 @@ def np_uniform(
     low: float, high: float, size: tuple[int, ...]
 ) -> NDArray[np.floating]:
     """Draw samples from a uniform distribution."""
-    return np.random.uniform(low, high, size).astype(NN_FLOAT_TYPE)
+    return np.random.uniform(low, high, size).astype(get_default_type())
 
 
 def np_zeros(shape: tuple[int, ...]) -> NDArray[np.floating]:
     """Return a new array of given shape and type, filled with zeros."""
-    return np.zeros(shape, dtype=NN_FLOAT_TYPE)
+    if get_array_pool() is not None:
+        result = np_empty(shape)
+        result.fill(0)
+        return result
+    # the system allocator gets zeroed pages lazily
+    return np.zeros(shape, dtype=get_default_type())
 
 
 def np_zeros_like(a: NDArray[np.floating]) -> NDArray[np.floating]:
     """Return an array of zeros with the same shape and type as a given array."""
-    return np.zeros_like(a, dtype=NN_FLOAT_TYPE)
+    return np_zeros(a.shape)
@@ -1,9 +1,14 @@
+from typing import Any, Callable, Iterator
+
 import numpy as np
 from numpy.typing import NDArray
 
+from common.base import Layer
+from common.default_type_array import get_default_type
+
 
 def single_label_accuracy(
-    y: NDArray[np.floating], t: NDArray[np.floating]
+    y: NDArray[np.floating], t: NDArray[np.floating | np.integer]
 ) -> float:
     """Calculate the accuracy for a single-label classification model.
 
@@ -81,3 +86,239 @@ def multilabel_accuracy(
 
     # Return the calculated accuracy
     return accuracy
+
+
+def evaluate_in_batches(
+    network: Layer,
+    evaluation_fn: Callable[[NDArray[np.floating], NDArray[Any]], float],
+    x: NDArray[np.floating | np.integer],
+    t: NDArray[Any],
+    batch_size: int,
+    loss: Layer | None = None,
+    x_scale: float = 1.0,
+) -> tuple[float, float]:
+    """Evaluate a network on all samples, batch by batch.
+
+    The batches are basic slices, i.e. views of x and t without copy, and the
+    last smaller batch is evaluated too. The metric and the loss are weighted
+    by the batch size, so they are the means over the samples.
+
+    An integer x (like the uint8 images) is converted to the default float
+    type and multiplied by x_scale batch by batch, into one reused buffer.
+
+    Parameters:
+        network (Layer): The network, which should be in the evaluation mode.
+        evaluation_fn (Callable): The metric of a batch, like
+                                  `single_label_accuracy`.
+        x (NDArray[np.floating | np.integer]): Input data.
+        t (NDArray[Any]): True labels.
+        batch_size (int): The number of samples of one forward pass.
+        loss (Layer | None): If provided, calculate the mean loss too.
+        x_scale (float): The factor for converting an integer x, like
+                         1 / 255 for the uint8 images.
+
+    Returns:
+        tuple[float, float]: The mean metric and the mean loss (0.0 if the
+                             loss isn't provided).
+    """
+    num = x.shape[0]
+    metric_sum = 0.0
+    loss_sum = 0.0
+    for y, t_batch in _forward_batches(network, x, t, batch_size, x_scale):
+        size = y.shape[0]
+        metric_sum += evaluation_fn(y, t_batch) * size
+        if loss is not None:
+            loss_sum += loss.forward_to_loss(y, t_batch) * size
+    return metric_sum / num, loss_sum / num
+
+
+class ClassificationMetrics:
+    """Streaming metrics of a single-label classification.
+
+    Every batch updates a confusion matrix (rows: the true classes, columns:
+    the predicted ones) by one `np.bincount`, and the counts of the top-k hits
+    and the loss sum, so the metrics are exact over all samples, whatever the
+    sizes of the batches. The accumulators of the workers can be merged.
+
+    Usage:
+        metrics = ClassificationMetrics(10, top_k=(5,))
+        for x_batch, t_batch in batches:
+            y = network.forward(x_batch)
+            metrics.update(y, t_batch, loss.forward_to_loss(y, t_batch))
+        metrics.accuracy, metrics.top_k_accuracy(5), metrics.recall()
+    """
+
+    def __init__(
+        self, num_classes: int | None = None, top_k: tuple[int, ...] = ()
+    ) -> None:
+        """Initialize the empty metrics.
+
+        Parameters:
+            num_classes : int | None
+                The number of the classes, None for the number of the scores
+                of the first batch. It grows for a larger label.
+            top_k : tuple[int, ...]
+                The k of the top-k accuracies to count, the top-1 is the
+                accuracy.
+        """
+        size = num_classes or 0
+        self.confusion = np.zeros((size, size), dtype=np.int64)
+        self._top_k_hits = {k: 0 for k in top_k}
+        self._loss_sum = 0.0
+        self._loss_count = 0
+
+    @property
+    def num_samples(self) -> int:
+        return int(self.confusion.sum())
+
+    def update(
+        self,
+        y: NDArray[np.floating],
+        t: NDArray[Any],
+        loss: float | None = None,
+    ) -> None:
+        """Add a batch.
+
+        Parameters:
+            y : NDArray[np.floating]
+                The scores, shape (batch_size, num_classes).
+            t : NDArray[Any]
+                The integer class labels, shape (batch_size,), or the one-hot
+                labels, shape (batch_size, num_classes).
+            loss : float | None
+                The mean loss of the batch.
+        """
+        assert y.ndim == 2, "Predictions must be a 2D array"
+        assert t.ndim in (1, 2), "True labels must be a 1D or 2D array"
+        predicted = np.argmax(y, axis=1)
+        labels = t if t.ndim == 1 else np.argmax(t, axis=1)
+        # a label may be out of the scores, it's never predicted
+        num_classes = max(
+            self.confusion.shape[0],
+            y.shape[1],
+            int(labels.max(initial=-1)) + 1,
+        )
+        self._grow(num_classes)
+        self.confusion += np.bincount(
+            labels.astype(np.intp) * num_classes + predicted,
+            minlength=num_classes * num_classes,
+        ).reshape(num_classes, num_classes)
+        for k in self._top_k_hits:
+            if k >= y.shape[1]:
+                self._top_k_hits[k] += y.shape[0]
+                continue
+            top = np.argpartition(y, -k, axis=1)[:, -k:]
+            self._top_k_hits[k] += int(np.sum(top == labels[:, None]))
+        if loss is not None:
+            self._loss_sum += float(loss) * y.shape[0]
+            self._loss_count += y.shape[0]
+
+    def merge(self, other: "ClassificationMetrics") -> "ClassificationMetrics":
+        """Add the counts of the other metrics, like of another worker."""
+        assert self._top_k_hits.keys() == other._top_k_hits.keys()
+        self._grow(other.confusion.shape[0])
+        size = other.confusion.shape[0]
+        self.confusion[:size, :size] += other.confusion
+        for k, hits in other._top_k_hits.items():
+            self._top_k_hits[k] += hits
+        self._loss_sum += other._loss_sum
+        self._loss_count += other._loss_count
+        return self
+
+    def _grow(self, num_classes: int) -> None:
+        size = self.confusion.shape[0]
+        if num_classes > size:
+            confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+            confusion[:size, :size] = self.confusion
+            self.confusion = confusion
+
+    @property
+    def accuracy(self) -> float:
+        return float(np.trace(self.confusion)) / max(self.num_samples, 1)
+
+    @property
+    def loss(self) -> float:
+        """Return the mean loss over the samples, 0.0 without the loss."""
+        return self._loss_sum / max(self._loss_count, 1)
+
+    def top_k_accuracy(self, k: int) -> float:
+        """Return the ratio of the labels within the k best scores.
+
+        Parameters:
+            k : int
+                1 or one of the `top_k` given at the construction.
+        """
+        if k == 1:
+            return self.accuracy
+        if k not in self._top_k_hits:
+            raise ValueError(
+                f"The top-{k} accuracy isn't tracked, the tracked k are "
+                f"{sorted(self._top_k_hits)}."
+            )
+        return self._top_k_hits[k] / max(self.num_samples, 1)
+
+    def precision(self) -> NDArray[np.float64]:
+        """Return the precision of every class, 0 if it's never predicted."""
+        predicted = self.confusion.sum(axis=0)
+        precision: NDArray[np.float64] = np.diag(self.confusion) / np.maximum(
+            predicted, 1
+        )
+        return precision
+
+    def recall(self) -> NDArray[np.float64]:
+        """Return the recall of every class, 0 if it has no sample."""
+        actual = self.confusion.sum(axis=1)
+        recall: NDArray[np.float64] = np.diag(self.confusion) / np.maximum(
+            actual, 1
+        )
+        return recall
+
+
+def evaluate_metrics(
+    network: Layer,
+    x: NDArray[np.floating | np.integer],
+    t: NDArray[Any],
+    batch_size: int,
+    loss: Layer | None = None,
+    x_scale: float = 1.0,
+    top_k: tuple[int, ...] = (),
+) -> ClassificationMetrics:
+    """Evaluate a network on all samples into `ClassificationMetrics`.
+
+    See `evaluate_in_batches` for the parameters.
+    """
+    metrics = ClassificationMetrics(top_k=top_k)
+    for y, t_batch in _forward_batches(network, x, t, batch_size, x_scale):
+        batch_loss = None
+        if loss is not None:
+            batch_loss = loss.forward_to_loss(y, t_batch)
+        metrics.update(y, t_batch, batch_loss)
+    return metrics
+
+
+def _forward_batches(
+    network: Layer,
+    x: NDArray[np.floating | np.integer],
+    t: NDArray[Any],
+    batch_size: int,
+    x_scale: float,
+) -> Iterator[tuple[NDArray[np.floating], NDArray[Any]]]:
+    """Yield the outputs and the labels of the batches of (x, t)."""
+    num = x.shape[0]
+    assert num > 0, "No sample to evaluate."
+    buffer = None
+    if np.issubdtype(x.dtype, np.integer):
+        buffer = np.empty(
+            (min(batch_size, num), *x.shape[1:]), dtype=get_default_type()
+        )
+    for start in range(0, num, batch_size):
+        x_batch: NDArray[Any] = x[start : start + batch_size]
+        t_batch = t[start : start + batch_size]
+        if buffer is not None:
+            x_batch = np.multiply(
+                x_batch,
+                x_scale,
+                out=buffer[: x_batch.shape[0]],
+                dtype=buffer.dtype,
+            )
+        yield network.forward(x_batch), t_batch
@@ -0,0 +1,159 @@
+"""Gradient accumulation over micro-batches.
+
+The activation memory of the forward pass grows with the batch size. To train
+with a large effective batch under a fixed memory, the batch is processed as
+several micro-batches: every micro-batch runs the forward and the backward
+pass, its gradients are summed into persistent buffers, and the optimizer
+updates the parameters once with the mean gradient of all micro-batches.
+
+    effective batch = accumulation_steps * micro-batch
+
+The parameters without gradient (like the running mean and variance of the
+batch norm) are buffers updated by the forward pass. Every micro-batch would
+update them once, i.e. accumulation_steps times per optimizer step. So the
+buffers are restored to their values at the start of the accumulated batch
+before every micro-batch, and set to the sample-weighted mean of their values
+after every micro-batch at the end. For the moving average
+    running = momentum * running + (1 - momentum) * batch_stat
+it's one update with the mean of the micro-batch statistics.
+"""
+
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.default_type_array import get_reduce_type
+
+
+class GradientAccumulator:
+    """Accumulate the gradients of micro-batches in place.
+
+    Usage:
+        accumulator = GradientAccumulator(params, accumulation_steps=4)
+        for x_batch, t_batch in micro_batches:
+            accumulator.start_micro_batch()
+            ...  # forward and backward
+            accumulator.add(network.param_grads(), x_batch.shape[0])
+            if accumulator.ready:
+                optimizer.one_step(params, accumulator.mean_grads())
+        if accumulator.num_pending:  # the rest at the end of the epoch
+            optimizer.one_step(params, accumulator.mean_grads())
+    """
+
+    def __init__(
+        self,
+        params: dict[str, NDArray[np.floating]],
+        accumulation_steps: int,
+    ) -> None:
+        """Initialize the accumulator.
+
+        Parameters:
+            params : dict[str, NDArray[np.floating]]
+                The parameters of the network, the reference from
+                `named_params`.
+            accumulation_steps : int
+                The number of the micro-batches of one optimizer step.
+        """
+        if accumulation_steps < 1:
+            raise ValueError("The accumulation steps should be positive.")
+        self._params = params
+        self._accumulation_steps = accumulation_steps
+        self._grads: dict[str, NDArray[np.floating]] = {}
+        # None until the first gradients tell which parameters are buffers
+        self._buffer_keys: list[str] | None = None
+        self._buffer_start: dict[str, NDArray[Any]] = {}
+        self._buffer_sums: dict[str, NDArray[Any]] = {}
+        self._num_pending = 0
+        self._num_samples = 0
+
+    @property
+    def num_pending(self) -> int:
+        """Return the number of the micro-batches added since the last step."""
+        return self._num_pending
+
+    @property
+    def ready(self) -> bool:
+        """Return True if the accumulated batch is complete."""
+        return self._num_pending >= self._accumulation_steps
+
+    def start_micro_batch(self) -> None:
+        """Prepare the buffers before the forward pass of a micro-batch."""
+        keys = self._params if self._buffer_keys is None else self._buffer_keys
+        if self._num_pending == 0:
+            for key in keys:
+                start = self._buffer_start.get(key)
+                if start is None:
+                    self._buffer_start[key] = self._params[key].copy()
+                else:
+                    np.copyto(start, self._params[key])
+        else:
+            for key in keys:
+                np.copyto(self._params[key], self._buffer_start[key])
+
+    def add(
+        self, grads: dict[str, NDArray[np.floating]], batch_size: int
+    ) -> None:
+        """Add the gradients of a micro-batch, after its backward pass.
+
+        Parameters:
+            grads : dict[str, NDArray[np.floating]]
+                The gradients of the micro-batch, i.e. the means over its
+                samples.
+            batch_size : int
+                The number of samples of the micro-batch, for weighting the
+                micro-batches of different sizes.
+        """
+        if self._buffer_keys is None:
+            self._buffer_keys = [
+                key for key in self._params if key not in grads
+            ]
+            self._buffer_start = {
+                key: self._buffer_start[key] for key in self._buffer_keys
+            }
+
+        first = self._num_pending == 0
+        if first:
+            self._num_samples = 0
+        for key, grad in grads.items():
+            buffer = self._grads.get(key)
+            if buffer is None:
+                # float16 gradients are summed in float32
+                buffer = self._grads[key] = np.empty_like(
+                    grad, dtype=get_reduce_type(grad.dtype)
+                )
+            if first:
+                np.multiply(grad, batch_size, out=buffer)
+            else:
+                buffer += grad * batch_size
+        for key in self._buffer_keys:
+            value = self._params[key]
+            total = self._buffer_sums.get(key)
+            if total is None:
+                total = self._buffer_sums[key] = np.empty_like(value)
+            if first:
+                np.multiply(value, batch_size, out=total)
+            else:
+                total += value * batch_size
+        self._num_pending += 1
+        self._num_samples += batch_size
+
+    def mean_grads(self) -> dict[str, NDArray[np.floating]]:
+        """Finish the accumulated batch, return the mean gradients.
+
+        The buffers are set to the sample-weighted mean over the micro-batches.
+        The returned arrays are reused by the next accumulated batch.
+        """
+        assert self._num_pending > 0, "No micro-batch has been added."
+        assert self._buffer_keys is not None
+        for buffer in self._grads.values():
+            buffer /= self._num_samples
+        for key in self._buffer_keys:
+            np.divide(
+                self._buffer_sums[key],
+                self._num_samples,
+                out=self._params[key],
+                casting="unsafe",
+            )
+        self._num_pending = 0
+        return self._grads
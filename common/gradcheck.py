@@ -0,0 +1,166 @@
+"""Check the backward of a layer by random directional derivatives.
+
+The full numerical gradient needs two forward passes per element of the input
+and the parameters, which is too slow for the convolutions and the blocks of
+the real sizes. Instead, the loss
+
+    L(x, params) = sum(forward(x) * r)
+
+with a fixed random r is differentiated numerically along a few random
+directions v of every tensor, and compared with the directional derivative of
+the backward:
+
+    (L(x + h v) - L(x - h v)) / (2 h)  ~  sum(dL/dx * v)
+
+so a tensor is checked by 2 * num_directions forward passes, whatever its
+size. A wrong element of the gradient is found with probability 1 by any
+random direction.
+
+Usage:
+    layer = Conv2dConfig(...).create()
+    gradcheck(layer, np_randn((2, 3, 8, 8)))
+"""
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.base import Layer
+from common.default_type_array import dtype_policy
+
+INPUT_KEY = "input"
+"""The key of the input in the errors returned by `gradcheck`."""
+
+
+def gradcheck(
+    layer: Layer,
+    x: NDArray[np.floating],
+    t: NDArray[np.floating | np.integer] | None = None,
+    num_directions: int = 3,
+    h: float | None = None,
+    rtol: float | None = None,
+    atol: float | None = None,
+    seed: int | None = 0,
+    raise_on_failure: bool = True,
+) -> dict[str, float]:
+    """Compare the backward of the layer with directional derivatives.
+
+    The input and every parameter with a gradient in `param_grads` are
+    checked. The forward has to be deterministic, so set the training flag of
+    the layers like dropout as needed. The parameters (and the other state in
+    `named_params`, like the running mean of the batch normalization) are
+    restored afterwards.
+
+    Parameters:
+        layer : Layer
+            The layer to check.
+        x : NDArray[np.floating]
+            The input, it isn't modified.
+        t : NDArray[np.floating | np.integer] | None
+            The labels of a loss layer. If given, the loss is
+            `forward_to_loss(x, t)` instead of the projected output.
+        num_directions : int
+            The number of the random directions per tensor.
+        h : float | None
+            The step of the central difference. None chooses it by the float
+            type of x: eps ** (1 / 3), about 6e-6 for float64.
+        rtol : float | None
+            The relative tolerance. None chooses 10 * eps ** (1 / 3).
+        atol : float | None
+            The absolute tolerance. None is the same as rtol.
+        seed : int | None
+            The random seed for r and the directions.
+        raise_on_failure : bool
+            If True, raise an AssertionError for the mismatched tensors.
+
+    Returns:
+        dict[str, float]: The largest relative error of every tensor, by the
+            parameter name, and `INPUT_KEY` for the input.
+    """
+    assert num_directions >= 1
+    eps_third = float(np.finfo(x.dtype).eps) ** (1 / 3)
+    h = eps_third if h is None else h
+    rtol = 10 * eps_third if rtol is None else rtol
+    atol = rtol if atol is None else atol
+    rng = np.random.default_rng(seed)
+
+    with dtype_policy(layer.dtype_policy):
+        state = {
+            key: value.copy() for key, value in layer.named_params().items()
+        }
+        try:
+            errors, failures = _check(
+                layer, x, t, num_directions, h, rtol, atol, rng
+            )
+        finally:
+            for key, value in layer.named_params().items():
+                np.copyto(value, state[key])
+    if failures and raise_on_failure:
+        raise AssertionError(
+            "The backward mismatches the directional derivatives:\n"
+            + "\n".join(failures)
+        )
+    return errors
+
+
+def _check(
+    layer: Layer,
+    x: NDArray[np.floating],
+    t: NDArray[np.floating | np.integer] | None,
+    num_directions: int,
+    h: float,
+    rtol: float,
+    atol: float,
+    rng: np.random.Generator,
+) -> tuple[dict[str, float], list[str]]:
+    if t is None:
+        out = layer.forward(x.copy())
+        r = rng.standard_normal(out.shape).astype(out.dtype)
+        dx = layer.backward(r.copy())
+    else:
+        layer.forward_to_loss(x.copy(), t)
+        r = None
+        dx = layer.backward(np.ones((1,), dtype=x.dtype))
+    # the layers may reuse the buffers of the gradients
+    analytic = {INPUT_KEY: np.array(dx, copy=True)}
+    for key, grad in layer.param_grads().items():
+        analytic[key] = np.array(grad, copy=True)
+
+    def loss(x_in: NDArray[np.floating]) -> float:
+        if t is not None:
+            return float(layer.forward_to_loss(x_in.copy(), t))
+        assert r is not None
+        out = layer.forward(x_in.copy())
+        return float(np.sum(out * r, dtype=np.float64))
+
+    params = layer.named_params()
+    errors: dict[str, float] = {}
+    failures: list[str] = []
+    for key, grad in analytic.items():
+        target = x.copy() if key == INPUT_KEY else params[key]
+        assert grad.shape == target.shape, (
+            f"The gradient of {key} has the shape {grad.shape}, "
+            f"expected {target.shape}."
+        )
+        origin = target.copy()
+        worst = 0.0
+        for _ in range(num_directions):
+            step = h * rng.standard_normal(target.shape)
+            np.add(origin, step, out=target, casting="unsafe")
+            plus = target.astype(np.float64)
+            f_plus = loss(target if key == INPUT_KEY else x)
+            np.subtract(origin, step, out=target, casting="unsafe")
+            minus = target.astype(np.float64)
+            f_minus = loss(target if key == INPUT_KEY else x)
+            np.copyto(target, origin)
+            # the rounded steps of the float type are used for the backward
+            numerical = (f_plus - f_minus) / (2 * h)
+            expected = float(np.sum(grad * (plus - minus))) / (2 * h)
+            diff = abs(numerical - expected)
+            scale = max(abs(numerical), abs(expected))
+            worst = max(worst, diff / scale if scale > 0 else diff)
+            if diff > atol + rtol * scale:
+                failures.append(
+                    f"{key}: numerical {numerical:.6g}, backward {expected:.6g}"
+                )
+        errors[key] = worst
+    return errors, failures
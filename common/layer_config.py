@@ -19,6 +19,7 @@ Classes:
     SigmoidConfig: Configuration for the Sigmoid layer.
     SoftmaxConfig: Configuration for the Softmax layer.
     SoftmaxWithLossConfig: Configuration for the Softmax with loss layer.
+    SyncBatchNorm2dConfig: Configuration for the SyncBatchNorm2d layer.
 Functions:
     create_layers: Creates a list of layers based on the provided configurations.
     assert_keys_if_params_provided: Asserts that the parameters are provided
@@ -26,7 +27,7 @@ Functions:
 """
 
 import pickle
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Sequence
 
 import numpy as np
@@ -57,7 +58,9 @@ from ch08_deep_learning.b_layer_block import (
     GlobalAvgPooling,
     ResBlock,
 )
+from ch08_deep_learning.d_sync_batch_norm import SyncBatchNorm2d
 from common.base import Layer, LayerConfig
+from common.communicator import Communicator
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -271,6 +274,38 @@ class BatchNorm2dConfig(BatchNorm1dConfig):
         )
 
 
+@dataclass(frozen=True, kw_only=True)
+class SyncBatchNorm2dConfig(BatchNorm1dConfig):
+    """Configuration for the SyncBatchNorm2d layer."""
+
+    communicator: Communicator | None = field(
+        default=None, compare=False, repr=False
+    )
+    """The communicator of the worker, None means a single process.
+
+    It is the runtime state of the worker, not a part of the configuration,
+    so the equality, the hash and the `stable_hash` ignore it.
+    """
+
+    def create(
+        self, parameters: dict[str, NDArray[np.floating]] | None = None
+    ) -> Layer:
+        gamma, beta, mean, var = self._get_params(
+            parameters, shape=(1, self.num_feature, 1, 1)
+        )
+        return SyncBatchNorm2d(
+            gamma=gamma,
+            beta=beta,
+            running_mean=mean,
+            running_var=var,
+            momentum=self.momentum,
+            affine=self.affine,
+            track_running_stats=self.track_running_stats,
+            eps=self.eps,
+            communicator=self.communicator,
+        )
+
+
 @dataclass(frozen=True, kw_only=True)
 class Conv2dConfig(LayerConfig):
     """Configuration for the Convolution layer."""
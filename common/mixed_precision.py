@@ -0,0 +1,169 @@
+"""Mixed precision training with float32 master weights.
+
+The network computes in float16: the parameters, the activations and the
+caches of the layers (like the im2col buffer) are float16, which halves their
+memory and bandwidth. The optimizer keeps a float32 master copy of every
+parameter, and updates the master copy with the float32 gradients, so the
+small updates are not lost by the float16 rounding.
+
+The float16 gradients of a small loss underflow to zero, so the loss is
+scaled up before the backward pass (dout = loss_scale instead of 1), and the
+gradients are scaled down in float32 before the update. The dynamic loss
+scaler halves the scale and skips the update when a gradient overflows to
+inf/nan, and doubles the scale after a number of steps without overflow.
+
+Usage:
+    # float16 parameters and activations
+    network = net_config.create_with_policy(DTypePolicy(np.float16))
+    optimizer = MixedPrecisionOptimizer(Adam(lr=0.001), network.named_params())
+    ...
+    loss.backward(np_array([optimizer.loss_scale]))
+    optimizer.one_step(params, network.param_grads())
+"""
+
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.base import Optimizer
+
+MASTER_TYPE = np.float32
+"""The type of the master weights and the unscaled gradients."""
+
+
+class DynamicLossScaler:
+    """Adjust the loss scale by the overflow of the gradients."""
+
+    def __init__(
+        self,
+        init_scale: float = 2.0**15,
+        growth_factor: float = 2.0,
+        backoff_factor: float = 0.5,
+        growth_interval: int = 1000,
+        min_scale: float = 1.0,
+    ) -> None:
+        """Initialize the loss scaler.
+
+        Parameters:
+            init_scale : float
+                The initial loss scale.
+            growth_factor : float
+                The factor to grow the scale after growth_interval steps
+                without overflow.
+            backoff_factor : float
+                The factor to shrink the scale after an overflow.
+            growth_interval : int
+                The number of steps without overflow to grow the scale.
+            min_scale : float
+                The minimum of the loss scale.
+        """
+        assert growth_factor > 1.0 and 0.0 < backoff_factor < 1.0
+        self._scale = init_scale
+        self._growth_factor = growth_factor
+        self._backoff_factor = backoff_factor
+        self._growth_interval = growth_interval
+        self._min_scale = min_scale
+        self._good_steps = 0
+        self.skipped_steps = 0
+
+    @property
+    def scale(self) -> float:
+        """Return the current loss scale."""
+        return self._scale
+
+    def update(self, found_overflow: bool) -> None:
+        """Update the scale after a step, which is skipped if overflowed."""
+        if found_overflow:
+            self._scale = max(
+                self._scale * self._backoff_factor, self._min_scale
+            )
+            self._good_steps = 0
+            self.skipped_steps += 1
+            return
+        self._good_steps += 1
+        if self._good_steps >= self._growth_interval:
+            self._scale *= self._growth_factor
+            self._good_steps = 0
+
+
+class MixedPrecisionOptimizer(Optimizer):
+    """An optimizer wrapper updating the float32 master weights.
+
+    The wrapped optimizer only sees the master weights and the unscaled
+    float32 gradients, so its state (like the moments of Adam) is float32 too.
+    """
+
+    def __init__(
+        self,
+        optimizer: Optimizer,
+        params: dict[str, NDArray[np.floating]],
+        loss_scaler: DynamicLossScaler | None = None,
+    ) -> None:
+        """Initialize the optimizer.
+
+        Parameters:
+            optimizer : Optimizer
+                The optimizer updating the master weights.
+            params : dict[str, NDArray[np.floating]]
+                The (float16) parameters of the network, for creating the
+                master copies.
+            loss_scaler : DynamicLossScaler | None
+                The loss scaler, a default one is created if None.
+        """
+        self._optimizer = optimizer
+        self._loss_scaler = loss_scaler or DynamicLossScaler()
+        self._master: dict[str, NDArray[Any]] = {
+            key: value.astype(MASTER_TYPE) for key, value in params.items()
+        }
+        self._master_grads: dict[str, NDArray[Any]] = {}
+
+    @property
+    def loss_scale(self) -> float:
+        """Return the scale to multiply with the loss before the backward."""
+        return self._loss_scaler.scale
+
+    @property
+    def loss_scaler(self) -> DynamicLossScaler:
+        """Return the loss scaler, like for its skipped steps."""
+        return self._loss_scaler
+
+    @property
+    def master_params(self) -> dict[str, NDArray[Any]]:
+        """Return the float32 master weights."""
+        return self._master
+
+    def one_step(
+        self,
+        params: dict[str, NDArray[np.floating]],
+        grads: dict[str, NDArray[np.floating]],
+    ) -> None:
+        """Update the parameters by the scaled gradients.
+
+        The gradients are unscaled in float32. If any of them isn't finite,
+        the step is skipped and the loss scale shrinks. Otherwise, the master
+        weights are updated and copied (rounded) into the parameters.
+        """
+        inv_scale = 1.0 / self._loss_scaler.scale
+        found_overflow = False
+        for key, grad in grads.items():
+            master_grad = self._master_grads.get(key)
+            if master_grad is None:
+                master_grad = self._master_grads[key] = np.empty_like(
+                    grad, dtype=MASTER_TYPE
+                )
+            # unscale in float32, the small gradients underflow in float16
+            np.copyto(master_grad, grad)
+            master_grad *= inv_scale
+            if not np.isfinite(master_grad).all():
+                found_overflow = True
+                break
+
+        self._loss_scaler.update(found_overflow)
+        if found_overflow:
+            return
+
+        master_grads = {key: self._master_grads[key] for key in grads}
+        self._optimizer.one_step(self._master, master_grads)
+        for key in grads:
+            np.copyto(params[key], self._master[key], casting="same_kind")
@@ -0,0 +1,200 @@
+"""Intra-op thread parallelism over the batch slices of a layer operation.
+
+NumPy releases the GIL inside the large copies (like im2col), the reductions
+and the BLAS calls, so a large layer operation can be split over slices of
+the batch and run by a pool of threads. The BLAS library has its own threads,
+so the number of BLAS threads is limited at the same time (with the optional
+`threadpoolctl`), otherwise the two kinds of threads oversubscribe the cores.
+
+Usage:
+    set_num_threads(4)  # 4 intra-op threads, cpu_count // 4 BLAS threads
+
+    # in the forward of a layer, the output of the slices are concatenated
+    out = parallel_over_batch(lambda xs: im2col(xs, ...) @ w_col_T, x)
+    # in the backward, the results of the slices are summed, like dW
+    dw = parallel_sum_over_batch(lambda xs, ds: xs.T @ ds, x, dout)
+"""
+
+import contextvars
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.default_type_array import get_reduce_type
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # optional dependency
+    threadpool_limits = None
+
+MIN_SAMPLES_PER_THREAD = 4
+"""A batch is split only if every thread gets this number of samples."""
+
+_num_threads = 1
+_blas_threads: int | None = None
+_executor: ThreadPoolExecutor | None = None
+_blas_limiter: Any | None = None
+
+
+def get_num_threads() -> int:
+    """Return the number of the intra-op threads."""
+    return _num_threads
+
+
+def get_blas_threads() -> int | None:
+    """Return the limited number of the BLAS threads, None if not limited."""
+    return _blas_threads
+
+
+def set_num_threads(num_threads: int, blas_threads: int | None = None) -> None:
+    """Set the number of the intra-op threads, and limit the BLAS threads.
+
+    Parameters:
+        num_threads : int
+            The number of threads for splitting a layer operation, 1 means
+            running in the calling thread only.
+        blas_threads : int | None
+            The number of BLAS threads for every intra-op thread. If None,
+            use cpu_count // num_threads for more than one intra-op thread,
+            and don't limit the BLAS for one intra-op thread. It is ignored
+            if the `threadpoolctl` is not installed.
+    """
+    global _num_threads, _blas_threads, _executor, _blas_limiter
+    if num_threads < 1:
+        raise ValueError("The number of threads should be positive.")
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if num_threads > 1:
+        _executor = ThreadPoolExecutor(
+            max_workers=num_threads, thread_name_prefix="intra_op"
+        )
+    _num_threads = num_threads
+
+    if blas_threads is None and num_threads > 1:
+        blas_threads = max(1, (os.cpu_count() or 1) // num_threads)
+    if _blas_limiter is not None:
+        _blas_limiter.restore_original_limits()
+        _blas_limiter = None
+    _blas_threads = None
+    if blas_threads is not None and threadpool_limits is not None:
+        _blas_limiter = threadpool_limits(limits=blas_threads, user_api="blas")
+        _blas_threads = blas_threads
+
+
+@contextmanager
+def intra_op_threads(
+    num_threads: int, blas_threads: int | None = None
+) -> Iterator[None]:
+    """Set the threads temporarily, see `set_num_threads`."""
+    previous = (_num_threads, _blas_threads)
+    set_num_threads(num_threads, blas_threads)
+    try:
+        yield
+    finally:
+        set_num_threads(*previous)
+
+
+def batch_slices(batch_size: int, num_parts: int) -> list[slice]:
+    """Split [0, batch_size) into at most num_parts contiguous slices."""
+    num_parts = max(1, min(num_parts, batch_size))
+    bounds = np.linspace(0, batch_size, num_parts + 1).astype(int)
+    return [
+        slice(int(start), int(end))
+        for start, end in zip(bounds[:-1], bounds[1:])
+        if end > start
+    ]
+
+
+def parallel_over_batch(
+    fn: Callable[..., NDArray[Any]],
+    *arrays: NDArray[Any],
+    out: NDArray[Any] | None = None,
+) -> NDArray[Any]:
+    """Apply fn to the batch slices of the arrays and concatenate the results.
+
+    fn has to be independent over the samples, i.e.
+        fn(x)[a:b] == fn(x[a:b])
+    and write nothing shared, because the slices run at the same time. It runs
+    in a copy of the caller's context, like its `dtype_policy`.
+
+    Parameters:
+        fn : Callable[..., NDArray]
+            The operation, which gets the slices of all arrays.
+        arrays : NDArray
+            The arrays with the same batch size (axis 0).
+        out : NDArray | None
+            The output array, if provided, the results are written into it.
+
+    Returns:
+        NDArray: The concatenated results over axis 0.
+    """
+    slices = _slices_for(arrays)
+    if len(slices) == 1:
+        result = fn(*arrays)
+        if out is None:
+            return result
+        np.copyto(out, result)
+        return out
+
+    futures = _submit_slices(fn, arrays, slices)
+    results = [future.result() for future in futures]
+    if out is None:
+        return np.concatenate(results, axis=0)
+    for part, result in zip(slices, results):
+        out[part] = result
+    return out
+
+
+def parallel_sum_over_batch(
+    fn: Callable[..., NDArray[Any]], *arrays: NDArray[Any]
+) -> NDArray[Any]:
+    """Apply fn to the batch slices of the arrays and sum the results.
+
+    It is for the reductions over the batch, like the gradient of a weight:
+        dW = x.T @ dout = sum(x[part].T @ dout[part] for part in slices)
+    The partial results are summed in the reduce type, i.e. float32 for the
+    float16 results, and cast back to the type of the results.
+    """
+    slices = _slices_for(arrays)
+    if len(slices) == 1:
+        return fn(*arrays)
+
+    futures = _submit_slices(fn, arrays, slices)
+    first = futures[0].result()
+    total = first.astype(get_reduce_type(first.dtype))
+    for future in futures[1:]:
+        total += future.result()
+    return total.astype(first.dtype, copy=False)
+
+
+def _submit_slices(
+    fn: Callable[..., NDArray[Any]],
+    arrays: tuple[NDArray[Any], ...],
+    slices: list[slice],
+) -> list[Future[NDArray[Any]]]:
+    assert _executor is not None
+    # a context can be entered by one thread at once, so one copy per slice
+    return [
+        _executor.submit(
+            contextvars.copy_context().run,
+            fn,
+            *(array[part] for array in arrays),
+        )
+        for part in slices
+    ]
+
+
+def _slices_for(arrays: tuple[NDArray[Any], ...]) -> list[slice]:
+    assert arrays, "At least one array has to be provided."
+    batch_size = arrays[0].shape[0]
+    assert all(array.shape[0] == batch_size for array in arrays)
+    num_parts = min(_num_threads, batch_size // MIN_SAMPLES_PER_THREAD)
+    if num_parts <= 1:
+        return [slice(0, batch_size)]
+    return batch_slices(batch_size, num_parts)
@@ -0,0 +1,326 @@
+"""Mini-batch loader with a pool of worker processes, for online augmentation.
+
+Materializing an augmented dataset multiplies the memory by the augmentation
+factor, and every epoch sees the same variants. Instead, the workers augment
+every mini-batch freshly when it's needed:
+
+    main:    sampler -> tasks (epoch, batch, slot, indices) -> task queue
+    workers: gather from the shared dataset, convert, augment -> slot
+    main:    results in the order of the batches -> train on the slot
+
+The dataset is published once into shared memory (or given as a
+`SharedDataset`), and the mini-batches are written into a fixed number of
+shared slots, so the memory doesn't depend on the number of the augmented
+variants. The generator of every mini-batch is seeded by (seed, epoch, batch),
+so the augmentation is deterministic, whichever worker builds the mini-batch.
+"""
+
+import multiprocessing
+import queue
+import time
+import traceback
+import weakref
+from typing import Any, Callable, Iterator
+
+import numpy as np
+from numpy.typing import DTypeLike, NDArray
+
+from common.data_loader import LoaderStats, gather_batch
+from common.dataset import ArrayDataset, BatchSampler, Dataset
+from common.shared_dataset import SharedArrays, SharedDataset
+
+# the seconds to wait for a result before checking the workers are alive
+_POLL_S = 0.5
+
+BatchTransform = Callable[[NDArray[Any], np.random.Generator], NDArray[Any]]
+"""A transform of the x of a mini-batch, with the generator of the batch."""
+
+
+class ProcessBatchLoader:
+    """Iterate the mini-batches of one epoch, built by worker processes.
+
+    The yielded arrays are views into the shared slots, they are valid until
+    the next mini-batch is requested. The workers are started by the first
+    epoch and kept for the next ones, `close` stops them.
+
+    Usage:
+        augmenter = BatchAugmenter(max_angle=15, max_shift=2)
+        with ProcessBatchLoader(
+            x_train, t_train, 100, num_workers=4, transform=augmenter
+        ) as loader:
+            for epoch in range(epochs):
+                for x_batch, t_batch in loader:
+                    ...
+    """
+
+    def __init__(
+        self,
+        x: NDArray[Any] | Dataset,
+        t: NDArray[Any] | None,
+        batch_size: int,
+        num_workers: int = 2,
+        prefetch: int = 2,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        transform: BatchTransform | None = None,
+        seed: int | None = None,
+        x_dtype: DTypeLike | None = None,
+        x_scale: float = 1.0,
+        sampler: BatchSampler | None = None,
+        context: Any | None = None,
+    ) -> None:
+        """Initialize the loader.
+
+        Parameters:
+            x : NDArray | Dataset
+                The input data, or a dataset of both the input data and the
+                labels. A `SharedDataset` is attached by the workers as it is,
+                the other data is copied into shared memory once.
+            t : NDArray | None
+                The labels, None if x is a dataset.
+            batch_size : int
+                The size of a mini-batch.
+            num_workers : int
+                The number of the worker processes.
+            prefetch : int
+                The number of the mini-batches built ahead of the one used by
+                the consumer, i.e. there are prefetch + 1 shared slots.
+            shuffle : bool
+                If True, use a new random permutation every epoch.
+            drop_last : bool
+                If True, drop the last mini-batch smaller than the batch size.
+            transform : BatchTransform | None
+                An optional transform (like `BatchAugmenter`) called with the
+                x of a mini-batch and its generator in a worker. It has to be
+                picklable.
+            seed : int | None
+                The random seed for the permutation and the transform.
+            x_dtype : DTypeLike | None
+                The type of the yielded x, like the float type of the network
+                for the uint8 x. None keeps the type of x.
+            x_scale : float
+                The factor multiplied with the x converted to x_dtype.
+            sampler : BatchSampler | None
+                The sampler of the mini-batch indices, which replaces shuffle,
+                drop_last and seed of the permutation.
+            context : multiprocessing context | None
+                The context for creating the workers.
+        """
+        assert num_workers >= 1 and prefetch >= 1
+        assert x_dtype is not None or x_scale == 1.0, "x_scale needs x_dtype."
+        self._published: SharedArrays | None = None
+        if isinstance(x, SharedDataset):
+            assert t is None, "The labels are in the dataset."
+            dataset = x
+        else:
+            if not isinstance(x, Dataset):
+                assert t is not None
+                x = ArrayDataset(x, t)
+            self._published = SharedArrays(x=x.x, t=x.t)
+            dataset = SharedDataset(self._published, "x", "t")
+        self._dataset = dataset
+        if sampler is None:
+            sampler = BatchSampler(
+                len(dataset),
+                batch_size,
+                shuffle=shuffle,
+                drop_last=drop_last,
+                seed=seed,
+            )
+        assert sampler.batch_size == batch_size
+        self._sampler = sampler
+        self._num_workers = num_workers
+        self._transform = transform
+        # the seed of the transforms, fixed for the loader even without seed
+        self._seed = np.random.SeedSequence(seed).entropy
+        self._x_dtype = np.dtype(
+            dataset.x.dtype if x_dtype is None else x_dtype
+        )
+        self._x_scale = x_scale
+        self._ctx = (
+            context if context is not None else multiprocessing.get_context()
+        )
+        self.stats = LoaderStats()
+
+        slots_shape = (prefetch + 1, batch_size)
+        x_sample, t_sample = dataset.x.shape[1:], dataset.t.shape[1:]
+        self._slots = SharedArrays(
+            read_only=False,
+            x=np.empty((*slots_shape, *x_sample), self._x_dtype),
+            t=np.empty((*slots_shape, *t_sample), dataset.t.dtype),
+        )
+        self._epoch = 0
+        self._workers: list[Any] = []
+        self._tasks: Any = None
+        self._results: Any = None
+        self._finalizer: weakref.finalize[..., ProcessBatchLoader] | None = None
+
+    def __len__(self) -> int:
+        """Return the number of the mini-batches in one epoch."""
+        return len(self._sampler)
+
+    def __enter__(self) -> "ProcessBatchLoader":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the workers, the next epoch starts them again."""
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        self._workers = []
+
+    def __iter__(self) -> Iterator[tuple[NDArray[Any], NDArray[Any]]]:
+        self._start_workers()
+        self._epoch += 1
+        return self._iterate(self._epoch, list(self._sampler))
+
+    def _start_workers(self) -> None:
+        if self._workers:
+            return
+        self._tasks = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._workers = [
+            self._ctx.Process(
+                target=_run_worker,
+                args=(
+                    self._dataset,
+                    self._slots,
+                    self._transform,
+                    self._seed,
+                    self._x_scale,
+                    self._tasks,
+                    self._results,
+                ),
+                daemon=True,
+            )
+            for _ in range(self._num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._finalizer = weakref.finalize(
+            self, _stop_workers, self._workers, self._tasks
+        )
+
+    def _iterate(
+        self, epoch: int, batch_indices: list[NDArray[np.intp]]
+    ) -> Iterator[tuple[NDArray[Any], NDArray[Any]]]:
+        x_slots, t_slots = self._slots["x"], self._slots["t"]
+        free_slots = list(range(x_slots.shape[0]))
+        ready: dict[int, tuple[int, int]] = {}
+        next_batch = 0
+        outstanding = 0
+        in_use: int | None = None
+        try:
+            for batch in range(len(batch_indices)):
+                if in_use is not None:
+                    free_slots.append(in_use)
+                # submit in the order of the batches, the current one first
+                while free_slots and next_batch < len(batch_indices):
+                    task = (
+                        epoch,
+                        next_batch,
+                        free_slots.pop(),
+                        batch_indices[next_batch],
+                    )
+                    self._tasks.put(task)
+                    next_batch += 1
+                    outstanding += 1
+
+                depth = len(ready)
+                start = time.perf_counter()
+                while batch not in ready:
+                    done, slot, size = self._receive()
+                    ready[done] = (slot, size)
+                    outstanding -= 1
+                self._record(time.perf_counter() - start, depth)
+                in_use, size = ready.pop(batch)
+                yield x_slots[in_use, :size], t_slots[in_use, :size]
+        finally:
+            # the slots of the submitted tasks are reused by the next epoch,
+            # unless the workers have been stopped by an error
+            while outstanding and self._workers:
+                self._receive()
+                outstanding -= 1
+
+    def _receive(self) -> tuple[int, int, int]:
+        while True:
+            try:
+                status, payload = self._results.get(timeout=_POLL_S)
+                break
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self._workers):
+                    self.close()
+                    raise RuntimeError("A batch worker died.") from None
+        if status == "error":
+            self.close()
+            raise RuntimeError(f"The batch worker failed:\n{payload}")
+        batch, slot, size, produce_s = payload
+        self.stats.produce_s += produce_s
+        return batch, slot, size
+
+    def _record(self, stall_s: float, queue_depth: int) -> None:
+        self.stats.batches += 1
+        self.stats.stall_s += stall_s
+        self.stats.queue_depth_sum += queue_depth
+        self.stats.max_queue_depth = max(
+            self.stats.max_queue_depth, queue_depth
+        )
+
+
+def _stop_workers(workers: list[Any], tasks: Any) -> None:
+    for _ in workers:
+        tasks.put(None)
+    for worker in workers:
+        worker.join(timeout=5)
+        if worker.is_alive():
+            worker.terminate()
+            worker.join()
+
+
+def _run_worker(
+    dataset: SharedDataset,
+    slots: SharedArrays,
+    transform: BatchTransform | None,
+    seed: int,
+    x_scale: float,
+    tasks: Any,
+    results: Any,
+) -> None:
+    try:
+        x, t = dataset.x, dataset.t
+        x_slots, t_slots = slots["x"], slots["t"]
+        staging = None
+        if x.dtype != x_slots.dtype or x_scale != 1.0:
+            staging = np.empty(x_slots.shape[1:], dtype=x.dtype)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            epoch, batch, slot, indices = task
+            start = time.perf_counter()
+            size = indices.shape[0]
+            x_batch = x_slots[slot, :size]
+            gather_batch(
+                x,
+                t,
+                indices,
+                x_batch,
+                t_slots[slot, :size],
+                None if staging is None else staging[:size],
+                x_scale,
+            )
+            if transform is not None:
+                rng = np.random.default_rng([seed, epoch, batch])
+                transformed = transform(x_batch, rng)
+                if transformed is not x_batch:
+                    np.copyto(x_batch, transformed)
+            produce_s = time.perf_counter() - start
+            results.put(("ok", (batch, slot, size, produce_s)))
+    except Exception:
+        results.put(("error", traceback.format_exc()))
+    finally:
+        dataset.close()
+        slots.close()
@@ -0,0 +1,410 @@
+"""A tracing profiler of nested spans, with Chrome trace export.
+
+A span is a named interval measured by `time.perf_counter_ns`, nested in the
+enclosing span of the same thread, and tagged with the process and thread IDs.
+Counters record a value over time, like an accuracy or a queue depth.
+
+The profiler is disabled by default, and costs nothing then: `span` returns a
+shared no-op context, and no method is wrapped. When it's enabled, the
+`LayerTrainer` instruments its phases (data, forward, backward, loss,
+optimizer, eval) and every layer call, see `instrument_layer`.
+
+The trace can be exported as Chrome trace events (open it in chrome://tracing
+or https://ui.perfetto.dev), or aggregated into a summary table by the span.
+
+Usage:
+    with profile() as profiler:
+        trainer.train()
+        with span("final evaluation"):
+            trainer.get_final_accuracy()
+    profiler.export_chrome_trace("trace.json")
+    print(profiler.format_summary())
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Any, Callable, ContextManager, Iterable, Iterator
+
+from common.base import Layer
+
+
+@dataclass
+class SpanEvent:
+    """A finished span."""
+
+    name: str
+    category: str
+    start_ns: int
+    duration_ns: int
+    self_ns: int
+    """The duration without the nested spans of the same thread."""
+    pid: int
+    tid: int
+    depth: int
+    args: dict[str, Any]
+
+
+@dataclass
+class CounterEvent:
+    """A value of a counter."""
+
+    name: str
+    time_ns: int
+    value: float
+    pid: int
+
+
+@dataclass
+class SpanSummary:
+    """The statistics of the spans of a name."""
+
+    name: str
+    count: int
+    total_ns: int
+    self_ns: int
+    min_ns: int
+    max_ns: int
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count
+
+
+class Profiler:
+    """The recorder of the spans and the counters of a process."""
+
+    def __init__(self) -> None:
+        self.spans: list[SpanEvent] = []
+        self.counters: list[CounterEvent] = []
+        self._local = threading.local()
+
+    def span(
+        self, name: str, category: str = "", **args: Any
+    ) -> ContextManager[None]:
+        """Return the context manager of a span."""
+        return _Span(self, name, category, args)
+
+    def counter(self, name: str, value: float) -> None:
+        """Record the value of a counter now."""
+        self.counters.append(
+            CounterEvent(name, time.perf_counter_ns(), value, os.getpid())
+        )
+
+    def merge(self, other: "Profiler") -> None:
+        """Add the events of another profiler, like of a worker process."""
+        self.spans.extend(other.spans)
+        self.counters.extend(other.counters)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the stacks of the open spans belong to the threads
+        return {"spans": self.spans, "counters": self.counters}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def chrome_trace(self) -> dict[str, Any]:
+        """Return the trace in the Chrome trace event format."""
+        events: list[dict[str, Any]] = [
+            {
+                "name": event.name,
+                "cat": event.category,
+                "ph": "X",
+                "ts": event.start_ns / 1000,
+                "dur": event.duration_ns / 1000,
+                "pid": event.pid,
+                "tid": event.tid,
+                "args": event.args,
+            }
+            for event in self.spans
+        ]
+        events.extend(
+            {
+                "name": event.name,
+                "ph": "C",
+                "ts": event.time_ns / 1000,
+                "pid": event.pid,
+                "args": {event.name: event.value},
+            }
+            for event in self.counters
+        )
+        events.sort(key=lambda event: event["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, file_name: str) -> None:
+        """Write the Chrome trace events into a JSON file."""
+        with open(file_name, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def summary(self) -> list[SpanSummary]:
+        """Return the statistics by the span name, the longest total first."""
+        summaries: dict[str, SpanSummary] = {}
+        for event in self.spans:
+            summary = summaries.get(event.name)
+            if summary is None:
+                summaries[event.name] = SpanSummary(
+                    event.name,
+                    1,
+                    event.duration_ns,
+                    event.self_ns,
+                    event.duration_ns,
+                    event.duration_ns,
+                )
+                continue
+            summary.count += 1
+            summary.total_ns += event.duration_ns
+            summary.self_ns += event.self_ns
+            summary.min_ns = min(summary.min_ns, event.duration_ns)
+            summary.max_ns = max(summary.max_ns, event.duration_ns)
+        return sorted(summaries.values(), key=lambda s: -s.total_ns)
+
+    def format_summary(self) -> str:
+        """Return the summary as a table, the times in milliseconds."""
+        header = (
+            f"{'span':<32} {'count':>7} {'total':>10} {'self':>10} "
+            f"{'mean':>9} {'min':>9} {'max':>9}"
+        )
+        lines = [header, "-" * len(header)]
+        for s in self.summary():
+            lines.append(
+                f"{s.name[:32]:<32} {s.count:>7} {s.total_ns / 1e6:>10.2f} "
+                f"{s.self_ns / 1e6:>10.2f} {s.mean_ns / 1e6:>9.3f} "
+                f"{s.min_ns / 1e6:>9.3f} {s.max_ns / 1e6:>9.3f}"
+            )
+        return "\n".join(lines)
+
+    def _stack(self) -> list[list[int]]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+class _Span:
+    __slots__ = ("_profiler", "_name", "_category", "_args")
+
+    def __init__(
+        self,
+        profiler: Profiler,
+        name: str,
+        category: str,
+        args: dict[str, Any],
+    ) -> None:
+        self._profiler = profiler
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self) -> None:
+        # [start, the duration of the nested spans]
+        self._profiler._stack().append([time.perf_counter_ns(), 0])
+
+    def __exit__(self, *args: object) -> None:
+        end = time.perf_counter_ns()
+        stack = self._profiler._stack()
+        start, nested_ns = stack.pop()
+        duration = end - start
+        if stack:
+            stack[-1][1] += duration
+        self._profiler.spans.append(
+            SpanEvent(
+                self._name,
+                self._category,
+                start,
+                duration,
+                duration - nested_ns,
+                os.getpid(),
+                threading.get_ident(),
+                len(stack),
+                self._args,
+            )
+        )
+
+
+_NULL_SPAN = nullcontext()
+_profiler: Profiler | None = None
+
+
+def enable(profiler: Profiler | None = None) -> Profiler:
+    """Enable the profiling of the process into the (new) profiler."""
+    global _profiler
+    _profiler = profiler if profiler is not None else Profiler()
+    return _profiler
+
+
+def disable() -> Profiler | None:
+    """Disable the profiling, and return the profiler of the trace."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler() -> Profiler | None:
+    """Return the enabled profiler, None if disabled."""
+    return _profiler
+
+
+def is_enabled() -> bool:
+    return _profiler is not None
+
+
+@contextmanager
+def profile(profiler: Profiler | None = None) -> Iterator[Profiler]:
+    """Enable the profiling within the context."""
+    previous = _profiler
+    enabled = enable(profiler)
+    try:
+        yield enabled
+    finally:
+        if previous is not None:
+            enable(previous)
+        else:
+            disable()
+
+
+def span(name: str, category: str = "", **args: Any) -> ContextManager[None]:
+    """Return the context of a span, a no-op one if disabled."""
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_SPAN
+    return profiler.span(name, category, **args)
+
+
+def counter(name: str, value: float) -> None:
+    """Record the value of a counter, if enabled."""
+    profiler = _profiler
+    if profiler is not None:
+        profiler.counter(name, value)
+
+
+def instrument(
+    obj: Any, methods: dict[str, str], category: str = ""
+) -> Callable[[], None]:
+    """Wrap the methods of the object by spans, and return the undo.
+
+    The wrappers are attributes of the instance, which shadow the methods of
+    the class, so the other instances aren't affected.
+
+    Parameters:
+        obj : Any
+            The object, like an optimizer.
+        methods : dict[str, str]
+            The span name by the method name, like {"one_step": "optimizer"}.
+        category : str
+            The category of the spans.
+    """
+    patched = []
+    for method, name in methods.items():
+        if method in vars(obj):
+            # already instrumented, or an attribute of the instance
+            continue
+        original = getattr(obj, method)
+
+        @functools.wraps(original)
+        def wrapper(
+            *args: Any,
+            _original: Callable[..., Any] = original,
+            _name: str = name,
+            **kwargs: Any,
+        ) -> Any:
+            with span(_name, category):
+                return _original(*args, **kwargs)
+
+        setattr(obj, method, wrapper)
+        patched.append(method)
+
+    def restore() -> None:
+        for method in patched:
+            vars(obj).pop(method, None)
+
+    return restore
+
+
+def instrument_layer(
+    layer: Layer,
+    forward_name: str | None = None,
+    backward_name: str | None = None,
+) -> Callable[[], None]:
+    """Wrap forward, forward_to_loss and backward of the layers by spans.
+
+    The sub-layers (the attributes which are layers, or tuples or lists of
+    layers, like the layers of a `Sequential`) are wrapped too, so their
+    spans are nested.
+
+    Parameters:
+        layer : Layer
+            The layer, like the network.
+        forward_name : str | None
+            The span name of forward and forward_to_loss of the layer itself,
+            like the phase "forward". None names the spans by the class, like
+            "Affine.forward", as for the sub-layers.
+        backward_name : str | None
+            The span name of backward of the layer itself.
+
+    Returns:
+        Callable[[], None]: The undo of all wrappers.
+    """
+    restores: list[Callable[[], None]] = []
+    visited: set[int] = set()
+
+    def visit(target: Layer, forward: str | None, backward: str | None) -> None:
+        if id(target) in visited:
+            return
+        visited.add(id(target))
+        class_name = type(target).__name__
+        names = {
+            "forward": forward or f"{class_name}.forward",
+            "forward_to_loss": forward or f"{class_name}.forward_to_loss",
+            "backward": backward or f"{class_name}.backward",
+        }
+        restores.append(instrument(target, names, "layer"))
+        for sub_layer in _sub_layers(target):
+            visit(sub_layer, None, None)
+
+    visit(layer, forward_name, backward_name)
+
+    def restore() -> None:
+        for undo in reversed(restores):
+            undo()
+
+    return restore
+
+
+class TracedIterable:
+    """An iterable whose every next item is a span, like the data loading.
+
+    The other attributes are the ones of the wrapped iterable.
+    """
+
+    def __init__(self, iterable: Iterable[Any], name: str) -> None:
+        self._iterable = iterable
+        self._name = name
+
+    def __iter__(self) -> Iterator[Any]:
+        iterator = iter(self._iterable)
+        while True:
+            with span(self._name, "data"):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def __len__(self) -> int:
+        return len(self._iterable)  # type: ignore
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._iterable, name)
+
+
+def _sub_layers(layer: Layer) -> Iterator[Layer]:
+    for value in vars(layer).values():
+        if isinstance(value, Layer):
+            yield value
+        elif isinstance(value, (tuple, list)):
+            yield from (item for item in value if isinstance(item, Layer))
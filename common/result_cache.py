@@ -0,0 +1,300 @@
+"""A disk cache of the training results, addressed by their configuration.
+
+Training the same network configuration with the same data, seed, optimizer
+and epochs gives the same result, so a repeated experiment (a rerun of a
+hyperparameter search, a training test) can load the result instead.
+
+The key of a result is a stable hash of everything the training depends on:
+    - the frozen `LayerConfig` dataclasses (and the other dataclasses), by
+      their class and fields,
+    - the optimizer settings, by its class and attributes,
+    - a fingerprint of the data arrays,
+    - the code version, a hash of the source files of the given code,
+    - the other settings, like the seed and the epochs.
+
+Layout of a cache:
+    <cache_dir>/<key>/params.npz     the final parameters
+    <cache_dir>/<key>/result.json    the accuracy history and the metadata
+
+The entries are evicted by the least recent use when the cache is larger than
+its size limit.
+
+Usage:
+    cache = ResultCache("cache/results", max_bytes=1 << 30)
+    network, history = cached_training(
+        cache, config, train_fn, seed=0,
+        optimizer=optimizer, data=(x_train, t_train, x_test, t_test),
+        code=(LayerTrainer, Conv2d), epochs=20, mini_batch_size=100,
+    )
+"""
+
+import dataclasses
+import enum
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.base import Layer, LayerConfig
+from common.dataset import fingerprint_arrays
+
+PARAMS_FILE = "params.npz"
+RESULT_FILE = "result.json"
+
+History = tuple[list[float], list[float]]
+"""The train and test accuracy history."""
+
+
+def stable_hash(*parts: Any) -> str:
+    """Return a hash of the parts, which is the same in every process.
+
+    The parts can be the builtin scalars and containers, NumPy scalars and
+    arrays (by their fingerprint), dataclasses (like the `LayerConfig`s),
+    enums, functions and classes (by their qualified name), and the other
+    objects by their class and attributes, like the optimizers.
+
+    Raises:
+        TypeError: If a part can't be hashed stably.
+    """
+    text = json.dumps(_canonical(parts), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def code_version(*objects: Any) -> str:
+    """Return a hash of the source files of the modules of the objects.
+
+    Parameters:
+        objects : Any
+            The functions, classes or modules, whose modules the result
+            depends on, like the trainer and the layers.
+    """
+    digest = hashlib.sha256()
+    for name in sorted({_module_name(obj) for obj in objects}):
+        module = sys.modules[name]
+        digest.update(name.encode())
+        try:
+            digest.update(inspect.getsource(module).encode())
+        except (OSError, TypeError):
+            # a module without a source, like a builtin one
+            digest.update(str(getattr(module, "__version__", "")).encode())
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedResult:
+    """A result of the training."""
+
+    params: dict[str, NDArray[Any]]
+    history: History
+    meta: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+
+class ResultCache:
+    """A size-bounded store of the training results, by their key."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1 << 30) -> None:
+        """Open the cache.
+
+        Parameters:
+            cache_dir : str
+                The directory of the cache, created if necessary.
+            max_bytes : int
+                The size limit of the entries. The least recently used ones
+                are removed after storing a new entry above the limit, the
+                new entry is always kept.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self._dir = cache_dir
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> CachedResult | None:
+        """Return the cached result, None if it's missing."""
+        entry = os.path.join(self._dir, key)
+        try:
+            with open(os.path.join(entry, RESULT_FILE)) as f:
+                stored = json.load(f)
+            with np.load(os.path.join(entry, PARAMS_FILE)) as npz:
+                params = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # the modification time of the entry is its last use
+        os.utime(entry)
+        self.hits += 1
+        train_acc, test_acc = stored["history"]
+        return CachedResult(params, (train_acc, test_acc), stored["meta"])
+
+    def put(
+        self,
+        key: str,
+        params: dict[str, NDArray[Any]],
+        history: History,
+        meta: dict[str, Any] | None = None,
+    ) -> None:
+        """Store the result, replacing nothing if the key exists."""
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self._dir)
+        try:
+            arrays: dict[str, Any] = params
+            np.savez(os.path.join(tmp, PARAMS_FILE), **arrays)
+            with open(os.path.join(tmp, RESULT_FILE), "w") as f:
+                json.dump(
+                    {
+                        "key": key,
+                        "history": [list(history[0]), list(history[1])],
+                        "meta": meta or {},
+                    },
+                    f,
+                )
+            try:
+                os.rename(tmp, os.path.join(self._dir, key))
+            except OSError:
+                # another process has stored the same key
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict(keep=key)
+
+    def get_or_train(
+        self,
+        key: str,
+        train_fn: Callable[[], tuple[dict[str, NDArray[Any]], History]],
+        meta: dict[str, Any] | None = None,
+    ) -> CachedResult:
+        """Return the cached result, or train and store it.
+
+        Parameters:
+            key : str
+                The key, like `stable_hash` of the configuration.
+            train_fn : Callable[[], tuple[dict[str, NDArray], History]]
+                The training, returning the final parameters and the history.
+            meta : dict[str, Any] | None
+                The JSON metadata stored with a new result.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        params, history = train_fn()
+        params = {name: np.array(value) for name, value in params.items()}
+        self.put(key, params, history, meta)
+        return CachedResult(params, history, meta or {})
+
+    def size(self) -> int:
+        """Return the bytes of all entries."""
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self) -> list[tuple[float, str, int]]:
+        entries = []
+        for name in os.listdir(self._dir):
+            path = os.path.join(self._dir, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, name, size))
+            except FileNotFoundError:
+                # removed by another process
+                continue
+        return entries
+
+    def _evict(self, keep: str) -> None:
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, name, size in entries:
+            if total <= self._max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self._dir, name), ignore_errors=True)
+            total -= size
+
+
+def cached_training(
+    cache: ResultCache,
+    config: LayerConfig,
+    train_fn: Callable[[Layer], History],
+    seed: int,
+    **key_parts: Any,
+) -> tuple[Layer, History]:
+    """Train the network of the config, or load it from the cache.
+
+    Parameters:
+        cache : ResultCache
+            The cache.
+        config : LayerConfig
+            The configuration of the network, created with the cached
+            parameters on a hit.
+        train_fn : Callable[[Layer], History]
+            Train the created network, like by a `LayerTrainer`, and return
+            its accuracy history.
+        seed : int
+            The seed of the global random state, set before creating the
+            network.
+        key_parts : Any
+            Everything else the result depends on, like optimizer=...,
+            data=(x_train, ...), code=code_version(...), epochs=...
+
+    Returns:
+        tuple[Layer, History]: The trained network and its history.
+    """
+    key = stable_hash(config, seed, key_parts)
+    cached = cache.get(key)
+    if cached is not None:
+        return config.create(cached.params), cached.history
+
+    np.random.seed(seed)
+    network = config.create()
+    history = train_fn(network)
+    cache.put(key, network.named_params(), history)
+    return network, history
+
+
+def _module_name(obj: Any) -> str:
+    if inspect.ismodule(obj):
+        return obj.__name__
+    return str(obj.__module__)
+
+
+def _canonical(obj: Any) -> Any:
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return obj
+    if isinstance(obj, float):
+        return {"float": repr(obj)}
+    if isinstance(obj, np.generic):
+        return {"np": obj.dtype.str, "value": _canonical(obj.item())}
+    if isinstance(obj, np.ndarray):
+        return {"array": fingerprint_arrays(obj)}
+    if isinstance(obj, (tuple, list)):
+        return [_canonical(item) for item in obj]
+    if isinstance(obj, dict):
+        items = [[_canonical(k), _canonical(v)] for k, v in obj.items()]
+        return {"dict": sorted(items, key=json.dumps)}
+    if isinstance(obj, enum.Enum):
+        return {"enum": _qualname(type(obj)), "name": obj.name}
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {
+            "type": _qualname(type(obj)),
+            "fields": {
+                field.name: _canonical(getattr(obj, field.name))
+                for field in dataclasses.fields(obj)
+                if field.compare
+            },
+        }
+    if inspect.isfunction(obj) or inspect.isclass(obj):
+        return {"callable": _qualname(obj)}
+    if hasattr(obj, "__dict__"):
+        return {"type": _qualname(type(obj)), "state": _canonical(vars(obj))}
+    raise TypeError(f"{type(obj).__name__} can't be hashed stably.")
+
+
+def _qualname(obj: Any) -> str:
+    return f"{obj.__module__}.{obj.__qualname__}"
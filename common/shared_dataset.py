@@ -0,0 +1,169 @@
+"""Arrays published once into shared memory, for multi-process training.
+
+Every worker process (a hyperparameter trial, a data-parallel worker) would
+load its own copy of the dataset. Instead, the main process publishes the
+arrays into `multiprocessing.shared_memory` segments once, and gives the
+workers a handle. A worker attaches the segments by name on the first access
+and gets read-only NumPy views, without copying or pickling the data.
+
+The publishing process owns the segments. They are released by `close`, or
+when the owner is garbage collected or exits. The workers only detach.
+
+Usage:
+    (x_train, t_train), (x_test, t_test) = load_mnist()
+    with SharedArrays(x_train=x_train, t_train=t_train) as shared:
+        train = SharedDataset(shared, "x_train", "t_train")
+        processes = [Process(target=worker, args=(train,)) for _ in range(4)]
+        ...  # in the worker: train.x, train.t are read-only views
+"""
+
+import os
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Iterator
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.dataset import Dataset
+
+
+def _release(segments: list[SharedMemory], owner_pid: int) -> None:
+    for shm in segments:
+        try:
+            shm.close()
+        except BufferError:
+            # a view is still alive, the memory stays mapped until it's gone
+            pass
+        # a forked child has a copy of the object, but doesn't own it
+        if os.getpid() != owner_pid:
+            continue
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedArrays:
+    """Named arrays in shared memory, readable by the child processes.
+
+    The object is picklable, it's pickled as the names, shapes and types of
+    the segments, so it can be given to `multiprocessing.Process` (or a pool)
+    as an argument.
+    """
+
+    def __init__(self, read_only: bool = True, **arrays: NDArray[Any]) -> None:
+        """Copy the arrays into new shared memory segments.
+
+        Parameters:
+            read_only : bool
+                If True, the views are read-only. False for the buffers
+                written by the workers, like the slots of the mini-batches.
+            **arrays : NDArray
+                The arrays by name, like x_train=..., t_train=... They can be
+                memory maps, which are read once.
+        """
+        self._read_only = read_only
+        self._specs: dict[str, tuple[str, tuple[int, ...], str]] = {}
+        self._segments: dict[str, SharedMemory] = {}
+        self._owner_pid = os.getpid()
+        try:
+            for key, array in arrays.items():
+                # a segment can't be empty
+                shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._segments[key] = shm
+                self._specs[key] = (shm.name, array.shape, array.dtype.str)
+                np.copyto(self._view(key, shm), array)
+        except BaseException:
+            _release(list(self._segments.values()), self._owner_pid)
+            raise
+        self._views: dict[str, NDArray[Any]] = {}
+        # release the segments at the exit of the owner, even without close
+        self._finalizer: weakref.finalize[..., SharedArrays] | None = (
+            weakref.finalize(
+                self, _release, list(self._segments.values()), self._owner_pid
+            )
+        )
+
+    @property
+    def is_owner(self) -> bool:
+        """Return True in the process that published the arrays."""
+        return self._finalizer is not None and os.getpid() == self._owner_pid
+
+    def keys(self) -> Iterator[str]:
+        return iter(self._specs)
+
+    def __getitem__(self, key: str) -> NDArray[Any]:
+        """Return the read-only view of the array, attaching if necessary."""
+        view = self._views.get(key)
+        if view is None:
+            shm = self._segments.get(key)
+            if shm is None:
+                if not self._specs:
+                    raise ValueError("The shared arrays have been closed.")
+                shm = self._segments[key] = SharedMemory(
+                    name=self._specs[key][0]
+                )
+            view = self._views[key] = self._view(key, shm)
+            view.flags.writeable = not self._read_only
+        return view
+
+    def close(self) -> None:
+        """Detach the segments, and release them in the owner process.
+
+        The views returned before shouldn't be used afterwards.
+        """
+        self._views.clear()
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        else:
+            _release(list(self._segments.values()), owner_pid=-1)
+        self._segments.clear()
+        self._specs.clear()
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def _view(self, key: str, shm: SharedMemory) -> NDArray[Any]:
+        _, shape, dtype = self._specs[key]
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the attached memory belongs to the process, attach again after
+        # unpickling; only the publishing process releases the segments.
+        return {
+            "_specs": self._specs,
+            "_owner_pid": self._owner_pid,
+            "_read_only": self._read_only,
+        }
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._segments = {}
+        self._views = {}
+        self._finalizer = None
+
+
+class SharedDataset(Dataset):
+    """A dataset of two arrays of a `SharedArrays`, picklable by name."""
+
+    def __init__(self, arrays: SharedArrays, x_key: str, t_key: str) -> None:
+        self._arrays = arrays
+        self._x_key = x_key
+        self._t_key = t_key
+
+    @property
+    def x(self) -> NDArray[Any]:
+        return self._arrays[self._x_key]
+
+    @property
+    def t(self) -> NDArray[Any]:
+        return self._arrays[self._t_key]
+
+    def close(self) -> None:
+        """Close the shared arrays, see `SharedArrays.close`."""
+        self._arrays.close()
@@ -0,0 +1,159 @@
+"""A ring buffer of array slots in shared memory, for streaming arrays from a
+producer process to a consumer process without pickling.
+
+Every slot has a small header (tag, ndim, dtype, shape) and a fixed size data
+region, so arrays of different shapes and types can be sent through one ring,
+as long as they are not larger than the slot.
+"""
+
+import multiprocessing
+import os
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+MAX_NDIM = 8
+# tag, ndim, dtype char, nbytes, shape...
+_HEADER_SIZE = 4 + MAX_NDIM
+# keep every data region 64-byte aligned
+_ALIGNMENT = 64
+_HEADER_NBYTES = 128
+
+
+class SharedRingBuffer:
+    """Single-producer single-consumer ring buffer in shared memory.
+
+    Two semaphores count the empty and the full slots. The producer and the
+    consumer keep their own slot index, which is valid because every message
+    is written and read in order. The object is picklable, so it can be given
+    to `multiprocessing.Process` as an argument; the creating process owns the
+    shared memory and has to call `close` to release it.
+    """
+
+    def __init__(
+        self, num_slots: int, slot_nbytes: int, context: Any | None = None
+    ) -> None:
+        """Initialize the ring buffer.
+
+        Parameters:
+            num_slots : int
+                The number of the slots, i.e. how many arrays can be in flight.
+            slot_nbytes : int
+                The maximum number of bytes of one array.
+            context : multiprocessing context | None
+                The context used for creating the semaphores, it should be the
+                same as the one creating the processes.
+        """
+        assert num_slots >= 1 and slot_nbytes >= 1
+        ctx = context if context is not None else multiprocessing
+        self._num_slots = num_slots
+        self._slot_nbytes = slot_nbytes
+        data_nbytes = -(-slot_nbytes // _ALIGNMENT) * _ALIGNMENT
+        self._stride = _HEADER_NBYTES + data_nbytes
+        self._shm: SharedMemory | None = SharedMemory(
+            create=True, size=num_slots * self._stride
+        )
+        self._shm_name = self._shm.name
+        self._owner_pid = os.getpid()
+        self._empty = ctx.Semaphore(num_slots)
+        self._full = ctx.Semaphore(0)
+        self._write_idx = 0
+        self._read_idx = 0
+
+    @property
+    def slot_nbytes(self) -> int:
+        return self._slot_nbytes
+
+    def put(
+        self,
+        array: NDArray[Any],
+        tag: int = 0,
+        timeout: float | None = None,
+    ) -> None:
+        """Copy the array into the next empty slot, block if the ring is full.
+
+        Parameters:
+            array : NDArray[Any]
+                The array to be sent.
+            tag : int
+                A user defined integer sent with the array, like the index of
+                the micro-batch.
+            timeout : float | None
+                The maximum seconds to wait for an empty slot.
+
+        Raises:
+            ValueError: If the array doesn't fit into a slot.
+            TimeoutError: If there is no empty slot within the timeout.
+        """
+        if array.nbytes > self._slot_nbytes or array.ndim > MAX_NDIM:
+            raise ValueError(
+                f"The array ({array.shape}, {array.dtype}) doesn't fit into "
+                f"the slot of {self._slot_nbytes} bytes."
+            )
+        if not self._empty.acquire(timeout=timeout):
+            raise TimeoutError("No empty slot in the ring buffer.")
+        header, data = self._slot(self._write_idx)
+        header[:4] = (tag, array.ndim, ord(array.dtype.char), array.nbytes)
+        header[4 : 4 + array.ndim] = array.shape
+        np.copyto(
+            data[: array.nbytes].view(array.dtype).reshape(array.shape), array
+        )
+        self._write_idx = (self._write_idx + 1) % self._num_slots
+        self._full.release()
+
+    def get(self, timeout: float | None = None) -> tuple[int, NDArray[Any]]:
+        """Copy the array out of the next full slot, block if it's empty.
+
+        Parameters:
+            timeout : float | None
+                The maximum seconds to wait for a full slot.
+
+        Returns:
+            tuple[int, NDArray[Any]]: The tag and a copy of the array.
+
+        Raises:
+            TimeoutError: If there is no full slot within the timeout.
+        """
+        if not self._full.acquire(timeout=timeout):
+            raise TimeoutError("No full slot in the ring buffer.")
+        header, data = self._slot(self._read_idx)
+        tag, ndim, dtype_char, nbytes = (int(value) for value in header[:4])
+        shape = tuple(int(dim) for dim in header[4 : 4 + ndim])
+        array = data[:nbytes].view(np.dtype(chr(dtype_char))).reshape(shape)
+        array = array.copy()
+        self._read_idx = (self._read_idx + 1) % self._num_slots
+        self._empty.release()
+        return tag, array
+
+    def close(self) -> None:
+        """Detach the shared memory, and release it in the owner process."""
+        if self._shm is None:
+            return
+        self._shm.close()
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
+        self._shm = None
+
+    def _slot(self, idx: int) -> tuple[NDArray[np.int64], NDArray[np.uint8]]:
+        if self._shm is None:
+            self._shm = SharedMemory(name=self._shm_name)
+        offset = idx * self._stride
+        header = np.ndarray(
+            (_HEADER_SIZE,), dtype=np.int64, buffer=self._shm.buf, offset=offset
+        )
+        data = np.ndarray(
+            (self._stride - _HEADER_NBYTES,),
+            dtype=np.uint8,
+            buffer=self._shm.buf,
+            offset=offset + _HEADER_NBYTES,
+        )
+        return header, data
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the attached memory belongs to the process, attach again after
+        # unpickling.
+        state = self.__dict__.copy()
+        state["_shm"] = None
+        return state
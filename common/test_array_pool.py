@@ -0,0 +1,128 @@
+import threading
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.array_pool import (
+    ALIGNMENT,
+    OLD_COLLECT_STEPS,
+    ArrayPool,
+    array_pool,
+    size_class,
+)
+from common.default_type_array import (
+    np_empty,
+    np_ones,
+    np_sqrt,
+    np_zeros,
+    np_zeros_like,
+)
+
+
+def test_size_class() -> None:
+    assert size_class(1) == 64
+    assert size_class(64) == 64
+    assert size_class(65) == 80
+    assert size_class(1000) == 1024
+    assert size_class(1025) == 1280
+    for nbytes in range(1, 5000, 7):
+        assert nbytes <= size_class(nbytes) <= max(64, nbytes * 1.25)
+
+
+def test_pool_recycles_released_arrays() -> None:
+    pool = ArrayPool()
+    a = pool.empty((10, 10), np.float32)
+    assert a.ctypes.data % ALIGNMENT == 0
+    view = a[2:]
+    del a
+    b = pool.empty((10, 10), np.float32)
+    # the view keeps the buffer of a alive
+    assert not np.shares_memory(view, b)
+    address = view.base.ctypes.data  # type: ignore[union-attr]
+    del view
+    c = pool.empty((5, 20), np.float32)
+    assert c.base.ctypes.data == address  # type: ignore[union-attr]
+
+    stats = pool.stats()
+    assert stats.allocations == 3
+    assert stats.new_buffers == 2
+    assert stats.live_bytes == 2 * size_class(400)
+    del b, c
+    assert pool.stats().live_bytes == 0
+    assert pool.stats().peak_live_bytes == 2 * size_class(400)
+
+
+def test_helpers_allocate_from_pool() -> None:
+    pool = ArrayPool()
+    with array_pool(pool):
+        for _ in range(3):
+            assert np.all(np_zeros((3, 4)) == 0)
+            assert np.all(np_ones((3, 4)) == 1)
+            assert np_zeros_like(np.ones((2, 2))).shape == (2, 2)
+            np.testing.assert_allclose(
+                np_sqrt(np.array([4.0, 9.0])), [2.0, 3.0]
+            )
+            np_empty((7,))
+            pool.end_step()
+
+    stats = pool.stats()
+    assert stats.step_allocations == (5, 5, 5)
+    # the arrays of every step are dropped, so the buffers are reused
+    assert stats.new_buffers <= 5
+    assert np_zeros((2,)).base is None
+
+
+def test_pool_is_thread_safe() -> None:
+    pool = ArrayPool()
+
+    def work() -> None:
+        for _ in range(200):
+            array = pool.empty((16,), np.float64)
+            array.fill(1.0)
+            assert np.all(array == 1.0)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pool.stats().allocations == 800
+    assert pool.stats().live_bytes == 0
+
+
+class _CountingPool(ArrayPool):
+    def __init__(self) -> None:
+        self.checks = 0
+        super().__init__()
+
+    def _refcount(  # type: ignore[override]
+        self, buffers: list[NDArray[np.uint8]], idx: int
+    ) -> int:
+        self.checks += 1
+        return super()._refcount(buffers, idx)
+
+
+def test_long_lived_buffers_are_not_checked_every_allocation() -> None:
+    pool = _CountingPool()
+    params = [pool.empty((16,), np.float32) for _ in range(100)]
+    for _ in range(3):
+        for _ in range(10):
+            pool.empty((16,), np.float32)
+        pool.end_step()
+
+    pool.checks = 0
+    for _ in range(10):
+        pool.empty((16,), np.float32)
+    pool.end_step()
+    # the new buffers only, not the 100 parameters
+    assert pool.checks <= 20
+
+    new_buffers = pool.stats().new_buffers
+    del params
+    for _ in range(OLD_COLLECT_STEPS):
+        pool.end_step()
+    # the released parameters are collected at last
+    arrays = [pool.empty((16,), np.float32) for _ in range(100)]
+    assert len(arrays) == 100
+    assert pool.stats().new_buffers == new_buffers
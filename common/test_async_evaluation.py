@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common.async_evaluation import AsyncEvaluator
+from common.evaluation import evaluate_in_batches, single_label_accuracy
+from common.testing import TanhLinear
+
+
+def _bad_accuracy(y: NDArray[np.floating], t: NDArray[np.floating]) -> float:
+    raise ValueError("bad metric")
+
+
+def test_async_evaluator_matches_sync_evaluation() -> None:
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((25, 4)).astype(np.float32)
+    t = rng.integers(0, 3, size=25)
+    network = TanhLinear(np.zeros((4, 3), dtype=np.float32), w_name="W1")
+    snapshots = [
+        rng.standard_normal((4, 3)).astype(np.float32) for _ in range(4)
+    ]
+
+    results = []
+    with AsyncEvaluator(
+        network, single_label_accuracy, [(x, t), (x[:10], t[:10])], 7
+    ) as evaluator:
+        for step, w in enumerate(snapshots):
+            evaluator.submit(step, {"W1": w})
+            results += evaluator.results()
+        results += evaluator.close()
+
+    assert [step for step, _ in results] == [0, 1, 2, 3]
+    for (_, metrics), w in zip(results, snapshots):
+        replica = TanhLinear(w, w_name="W1")
+        expected = [
+            evaluate_in_batches(replica, single_label_accuracy, xs, ts, 7)[0]
+            for xs, ts in [(x, t), (x[:10], t[:10])]
+        ]
+        np.testing.assert_allclose(metrics, expected)
+
+
+def test_async_evaluator_raises_worker_error() -> None:
+    x = np.ones((4, 2), dtype=np.float32)
+    t = np.zeros(4, dtype=np.int64)
+    network = TanhLinear(np.ones((2, 2), dtype=np.float32), w_name="W1")
+    evaluator = AsyncEvaluator(network, _bad_accuracy, [(x, t)], 2)
+    evaluator.submit(0, network.named_params())
+    with pytest.raises(RuntimeError, match="bad metric"):
+        evaluator.close()
+
+
+def test_evaluate_in_batches_converts_uint8() -> None:
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 256, (11, 3), dtype=np.uint8)
+    t = rng.integers(0, 2, 11)
+    network = TanhLinear(
+        rng.standard_normal((3, 2)).astype(np.float32), w_name="W1"
+    )
+    expected = evaluate_in_batches(
+        network, single_label_accuracy, x.astype(np.float32) / 255, t, 4
+    )
+    result = evaluate_in_batches(
+        network, single_label_accuracy, x, t, 4, x_scale=1 / 255
+    )
+    np.testing.assert_allclose(result, expected)
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common.augmentation_cache import AugmentationCache
+
+
+class _AddNoise:
+    def __init__(self, scale: float) -> None:
+        self.scale = scale
+        self.calls = 0
+
+    def config(self) -> dict[str, float]:
+        return {"scale": self.scale}
+
+    def __call__(
+        self, x: NDArray[np.floating], rng: np.random.Generator
+    ) -> NDArray[np.floating]:
+        self.calls += 1
+        return x + self.scale * rng.random(x.shape, dtype=np.float32)
+
+
+def _data() -> tuple[NDArray[np.floating], NDArray[np.int64]]:
+    x = np.arange(20, dtype=np.float32).reshape(10, 2)
+    return x, np.arange(10)
+
+
+def test_cache_renders_once_and_replays(tmp_path: Path) -> None:
+    x, t = _data()
+    transform = _AddNoise(0.5)
+    cache = AugmentationCache(
+        str(tmp_path), "aug", x, t, transform, 2, factor=1.5, chunk_size=4
+    )
+    assert cache.rendered and transform.calls == 2 * 4
+    x0, t0 = cache.epoch(0)
+    assert isinstance(x0, np.memmap) and x0.shape == (15, 2)
+    # every sample once, and half of them twice
+    assert set(np.bincount(t0, minlength=10)) == {1, 2}
+    assert np.all((x0 >= x[t0]) & (x0 < x[t0] + 0.5))
+    assert not np.array_equal(cache.epoch(1)[0], x0)
+
+    again = AugmentationCache(
+        str(tmp_path), "aug", x, t, _AddNoise(0.5), 2, factor=1.5, chunk_size=4
+    )
+    assert not again.rendered and again.key == cache.key
+    np.testing.assert_array_equal(again.epoch(0)[0], x0)
+    assert len(again.dataset(1)) == 15
+
+
+@pytest.mark.parametrize(
+    ("scale", "seed", "factor", "chunk_size"),
+    [
+        (0.1, 0, 1.0, 1024),
+        (0.5, 1, 1.0, 1024),
+        (0.5, 0, 2.0, 1024),
+        (0.5, 0, 1.0, 2),
+    ],
+    ids=["transform", "seed", "factor", "chunk_size"],
+)
+def test_cache_invalidated_by_config(
+    tmp_path: Path, scale: float, seed: int, factor: float, chunk_size: int
+) -> None:
+    x, t = _data()
+    AugmentationCache(str(tmp_path), "aug", x, t, _AddNoise(0.5), 1)
+    changed = AugmentationCache(
+        str(tmp_path),
+        "aug",
+        x,
+        t,
+        _AddNoise(scale),
+        1,
+        factor=factor,
+        seed=seed,
+        chunk_size=chunk_size,
+    )
+    assert changed.rendered
+    # the source data is a part of the key too
+    x[0] += 1
+    assert AugmentationCache(
+        str(tmp_path), "aug", x, t, _AddNoise(0.5), 1
+    ).rendered
+
+
+def test_cache_removes_only_a_store(tmp_path: Path) -> None:
+    x, t = _data()
+    for name in ["", ".", "..", "a/../..", str(tmp_path / "aug")]:
+        with pytest.raises(ValueError, match="isn't in the cache"):
+            AugmentationCache(str(tmp_path), name, x, t, _AddNoise(0.5), 1)
+
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "notes.txt").write_text("keep")
+    with pytest.raises(ValueError, match="isn't an augmentation store"):
+        AugmentationCache(str(tmp_path), "other", x, t, _AddNoise(0.5), 1)
+    assert (tmp_path / "other" / "notes.txt").exists()
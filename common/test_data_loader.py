@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common.data_loader import PrefetchBatchLoader
+
+
+def _data(num: int) -> tuple[NDArray[np.floating], NDArray[np.int64]]:
+    x = np.arange(num * 3, dtype=np.float32).reshape(num, 3)
+    t = np.arange(num, dtype=np.int64)
+    return x, t
+
+
+@pytest.mark.parametrize("prefetch", [0, 1, 3])
+@pytest.mark.parametrize("drop_last", [True, False])
+def test_loader_covers_epoch(prefetch: int, drop_last: bool) -> None:
+    x, t = _data(23)
+    loader = PrefetchBatchLoader(
+        x, t, batch_size=5, prefetch=prefetch, drop_last=drop_last, seed=0
+    )
+    for _ in range(2):
+        seen = []
+        for x_batch, t_batch in loader:
+            np.testing.assert_array_equal(x_batch, x[t_batch])
+            seen.append(t_batch.copy())
+        assert len(seen) == len(loader) == (4 if drop_last else 5)
+        labels = np.concatenate(seen)
+        assert len(np.unique(labels)) == len(labels)
+        if not drop_last:
+            assert sorted(labels) == list(range(23))
+
+    assert loader.stats.batches == 2 * len(loader)
+    assert loader.stats.stall_s >= 0
+    assert loader.stats.max_queue_depth <= prefetch + 1
+
+
+def test_loader_same_seed_same_order() -> None:
+    x, t = _data(20)
+    orders = []
+    for prefetch in [0, 2]:
+        loader = PrefetchBatchLoader(x, t, 4, prefetch=prefetch, seed=1)
+        orders.append([t_batch.copy() for _, t_batch in loader])
+    np.testing.assert_array_equal(orders[0], orders[1])
+
+
+def test_loader_transform_and_early_break() -> None:
+    x, t = _data(20)
+    loader = PrefetchBatchLoader(
+        x, t, 4, prefetch=2, shuffle=False, transform=lambda xb: xb * 2
+    )
+    for x_batch, t_batch in loader:
+        np.testing.assert_array_equal(x_batch, 2 * x[t_batch])
+        break
+    # the producer is stopped, a new epoch starts from the beginning
+    x_batch, t_batch = next(iter(loader))
+    np.testing.assert_array_equal(t_batch, np.arange(4))
+
+
+def test_loader_raises_producer_error() -> None:
+    x, t = _data(8)
+
+    def bad_transform(xb: NDArray[np.floating]) -> NDArray[np.floating]:
+        raise RuntimeError("augmentation failed")
+
+    loader = PrefetchBatchLoader(x, t, 4, prefetch=1, transform=bad_transform)
+    with pytest.raises(RuntimeError, match="augmentation failed"):
+        list(loader)
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_loader_converts_uint8_batches(prefetch: int) -> None:
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 256, (13, 2, 3), dtype=np.uint8)
+    t = np.arange(13, dtype=np.int64)
+    loader = PrefetchBatchLoader(
+        x, t, 5, prefetch=prefetch, x_dtype=np.float32, x_scale=1 / 255
+    )
+    buffers = set()
+    for x_batch, t_batch in loader:
+        assert x_batch.dtype == np.float32
+        np.testing.assert_allclose(x_batch, x[t_batch] / 255, rtol=1e-6)
+        buffers.add(x_batch.__array_interface__["data"][0])
+    # the float buffers of the slots are reused
+    assert len(buffers) <= prefetch + 1
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from common.data_loader import PrefetchBatchLoader
+from common.dataset import ArrayDataset, BatchSampler
+
+
+@pytest.mark.parametrize("block_size", [None, 4])
+def test_sampler_covers_epoch(block_size: int | None) -> None:
+    sampler = BatchSampler(23, 5, block_size=block_size, seed=0)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 5
+    assert sorted(np.concatenate(batches)) == list(range(23))
+
+
+def test_block_shuffle_keeps_batches_local() -> None:
+    sampler = BatchSampler(40, 4, block_size=8, seed=1)
+    orders = []
+    for batch in sampler:
+        # a batch in one block is sorted and spans less than a block
+        assert np.all(np.diff(batch) > 0)
+        assert batch[-1] // 8 == batch[0] // 8
+        orders.append(batch.copy())
+    # another epoch has another order
+    assert not all(np.array_equal(a, b) for a, b in zip(orders, list(sampler)))
+
+
+def test_loader_reads_dataset_with_sampler() -> None:
+    x = np.arange(30, dtype=np.float32).reshape(10, 3)
+    dataset = ArrayDataset(x, np.arange(10))
+    sampler = BatchSampler(10, 4, block_size=5, drop_last=True, seed=0)
+    loader = PrefetchBatchLoader(dataset, None, 4, prefetch=1, sampler=sampler)
+    seen = 0
+    for x_batch, t_batch in loader:
+        np.testing.assert_array_equal(x_batch, x[t_batch])
+        seen += t_batch.shape[0]
+    assert len(loader) == 2 and seen == 8
@@ -0,0 +1,118 @@
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.base import Layer, LayerConfig
+from common.default_type_array import (
+    DTypePolicy,
+    dtype_policy,
+    get_default_type,
+    get_policy,
+    np_randn,
+    np_zeros,
+    set_default_type,
+)
+from common.parallel import intra_op_threads, parallel_over_batch
+
+
+def test_dtype_policy_context() -> None:
+    assert get_default_type() == np.float32
+    with dtype_policy(DTypePolicy(np.float64)) as policy:
+        assert np_zeros((2,)).dtype == np.float64
+        assert policy.reduce_type == np.float64
+        with dtype_policy(None):
+            assert get_policy() is policy
+    assert np_zeros((2,)).dtype == np.float32
+    assert DTypePolicy(np.float16).reduce_type == np.float32
+
+
+def test_set_default_type_keeps_entered_policy() -> None:
+    try:
+        with dtype_policy(DTypePolicy(np.float64)):
+            set_default_type(np.float16)
+            assert get_default_type() == np.float64
+        assert get_default_type() == np.float16
+    finally:
+        set_default_type(np.float32)
+
+
+def test_threads_use_their_own_policy() -> None:
+    dtypes: dict[str, np.dtype] = {}
+    barrier = threading.Barrier(2)
+
+    def run(name: str, float_type: type) -> None:
+        with dtype_policy(DTypePolicy(float_type)):
+            barrier.wait()
+            dtypes[name] = np_randn((3,)).dtype
+
+    threads = [
+        threading.Thread(target=run, args=("f16", np.float16)),
+        threading.Thread(target=run, args=("f64", np.float64)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert dtypes == {"f16": np.float16, "f64": np.float64}
+
+
+def test_intra_op_threads_use_caller_policy() -> None:
+    x = np.ones((16, 2))
+    with intra_op_threads(2), dtype_policy(DTypePolicy(np.float64)):
+        y = parallel_over_batch(lambda xs: np_zeros(xs.shape), x)
+    assert y.dtype == np.float64
+
+
+class _Zeros(Layer):
+    """y = zeros in the default type, a buffer like the ones of the layers."""
+
+    def __init__(self, w: NDArray[np.floating]) -> None:
+        self._params = {"w": w}
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return self._params
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        return np_zeros(x.shape)
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        return np_zeros(dout.shape)
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+
+@dataclass(frozen=True, kw_only=True)
+class _ZerosConfig(LayerConfig):
+    def create(
+        self, parameters: dict[str, NDArray[np.floating]] | None = None
+    ) -> Layer:
+        if parameters is not None:
+            return _Zeros(parameters["w"])
+        return _Zeros(np_randn((2, 3)))
+
+
+def test_create_with_policy() -> None:
+    policy = DTypePolicy(np.float64)
+    layer = _ZerosConfig().create_with_policy(policy)
+
+    assert layer.dtype_policy is policy
+    assert Layer.dtype_policy is None
+    assert get_default_type() == np.float32
+    assert layer.named_params()["w"].dtype == np.float64
+
+    # the calls outside of any dtype_policy, in this thread and in another
+    x = np.ones((4, 3), dtype=np.float32)
+    outputs = [layer.forward(x), layer.backward(x)]
+    thread = threading.Thread(
+        target=lambda: outputs.extend([layer.forward(x), layer.backward(x)])
+    )
+    thread.start()
+    thread.join()
+    assert [y.dtype for y in outputs] == [np.float64] * 4
+    assert get_default_type() == np.float32
+    # a layer without a policy uses the current one
+    assert _ZerosConfig().create().forward(x).dtype == np.float32
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common.evaluation import (
+    ClassificationMetrics,
+    evaluate_in_batches,
+    evaluate_metrics,
+    single_label_accuracy,
+)
+from common.testing import Identity
+
+
+def _scores_and_labels(
+    num: int, num_classes: int, seed: int = 0
+) -> tuple[NDArray[np.floating], NDArray[np.integer]]:
+    rng = np.random.default_rng(seed)
+    return rng.random((num, num_classes)), rng.integers(0, num_classes, num)
+
+
+def test_confusion_matrix_and_metrics() -> None:
+    y = np.array([[0.9, 0.1, 0.0], [0.2, 0.7, 0.1], [0.6, 0.3, 0.1]])
+    t = np.array([0, 1, 1])
+    metrics = ClassificationMetrics()
+    metrics.update(y, t)
+    np.testing.assert_array_equal(
+        metrics.confusion, [[1, 0, 0], [1, 1, 0], [0, 0, 0]]
+    )
+    assert metrics.accuracy == pytest.approx(2 / 3)
+    np.testing.assert_allclose(metrics.precision(), [0.5, 1.0, 0.0])
+    np.testing.assert_allclose(metrics.recall(), [1.0, 0.5, 0.0])
+
+
+def test_one_hot_labels_same_as_integer() -> None:
+    y, t = _scores_and_labels(50, 4)
+    by_index = ClassificationMetrics(top_k=(2,))
+    by_index.update(y, t)
+    one_hot = ClassificationMetrics(top_k=(2,))
+    one_hot.update(y, np.eye(4)[t])
+    np.testing.assert_array_equal(by_index.confusion, one_hot.confusion)
+    assert by_index.top_k_accuracy(2) == one_hot.top_k_accuracy(2)
+    assert by_index.accuracy == pytest.approx(single_label_accuracy(y, t))
+
+
+def test_top_k_accuracy() -> None:
+    y, t = _scores_and_labels(200, 5)
+    metrics = ClassificationMetrics(top_k=(3, 5))
+    metrics.update(y[:70], t[:70])
+    metrics.update(y[70:], t[70:])
+    ranks = np.argsort(-y, axis=1)
+    expected = np.mean(np.any(ranks[:, :3] == t[:, None], axis=1))
+    assert metrics.top_k_accuracy(3) == pytest.approx(expected)
+    assert metrics.top_k_accuracy(5) == 1.0
+    assert metrics.top_k_accuracy(1) == metrics.accuracy
+
+
+def test_top_k_accuracy_of_an_untracked_k() -> None:
+    y, t = _scores_and_labels(10, 5)
+    metrics = ClassificationMetrics(top_k=(3, 5))
+    metrics.update(y, t)
+    with pytest.raises(ValueError, match=r"top-2 .* \[3, 5\]"):
+        metrics.top_k_accuracy(2)
+
+
+def test_merge_equals_one_accumulator() -> None:
+    y, t = _scores_and_labels(90, 3)
+    whole = ClassificationMetrics(top_k=(2,))
+    whole.update(y, t, loss=0.5)
+    parts = [ClassificationMetrics(top_k=(2,)) for _ in range(3)]
+    for i, part in enumerate(parts):
+        part.update(y[i * 30 : (i + 1) * 30], t[i * 30 : (i + 1) * 30], 0.5)
+    merged = ClassificationMetrics(top_k=(2,))
+    for part in parts:
+        merged.merge(part)
+    np.testing.assert_array_equal(merged.confusion, whole.confusion)
+    assert merged.top_k_accuracy(2) == whole.top_k_accuracy(2)
+    assert merged.loss == pytest.approx(whole.loss)
+
+
+def test_label_out_of_the_scores() -> None:
+    metrics = ClassificationMetrics()
+    metrics.update(np.array([[1.0, 0.0], [0.0, 1.0]]), np.array([0, 2]))
+    assert metrics.confusion.shape == (3, 3)
+    assert metrics.accuracy == 0.5
+
+
+def test_evaluate_metrics_unbiased_by_batch_size() -> None:
+    y, t = _scores_and_labels(7, 3)
+    network = Identity()
+    metrics = evaluate_metrics(network, y, t, batch_size=3, loss=network)
+    assert metrics.num_samples == 7
+    assert metrics.accuracy == pytest.approx(single_label_accuracy(y, t))
+    # the loss is the mean over the samples, not over the batches
+    assert metrics.loss == pytest.approx(np.mean(y[:, 0]))
+    acc, loss = evaluate_in_batches(
+        network, single_label_accuracy, y, t, batch_size=3, loss=network
+    )
+    assert acc == pytest.approx(metrics.accuracy)
+    assert loss == pytest.approx(metrics.loss)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common.grad_accumulation import GradientAccumulator
+
+MOMENTUM = 0.9
+
+
+def _forward_backward(
+    params: dict[str, NDArray[np.floating]],
+    x: NDArray[np.floating],
+    t: NDArray[np.floating],
+) -> dict[str, NDArray[np.floating]]:
+    """A linear model with the mean square loss, and a running mean buffer."""
+    params["running_mean"] *= MOMENTUM
+    params["running_mean"] += (1 - MOMENTUM) * x.mean(axis=0)
+    y = x @ params["W1"]
+    return {"W1": x.T @ (y - t) / x.shape[0]}
+
+
+def test_accumulated_grads_equal_full_batch() -> None:
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((10, 3))
+    t = rng.standard_normal((10, 2))
+    params: dict[str, NDArray[np.floating]] = {
+        "W1": rng.standard_normal((3, 2)),
+        "running_mean": np.zeros(3),
+    }
+    expected = {key: value.copy() for key, value in params.items()}
+    expected_grads = _forward_backward(expected, x, t)
+
+    accumulator = GradientAccumulator(params, accumulation_steps=3)
+    for part in np.array_split(np.arange(10), 3):
+        assert not accumulator.ready
+        accumulator.start_micro_batch()
+        grads = _forward_backward(params, x[part], t[part])
+        accumulator.add(grads, part.shape[0])
+    assert accumulator.ready
+    grads = accumulator.mean_grads()
+
+    assert accumulator.num_pending == 0
+    np.testing.assert_allclose(grads["W1"], expected_grads["W1"])
+    # one update of the running mean with the mean of the micro-batches
+    np.testing.assert_allclose(params["running_mean"], expected["running_mean"])
+    np.testing.assert_allclose(params["W1"], expected["W1"])
+
+
+def test_accumulator_reuses_buffers() -> None:
+    params: dict[str, NDArray[np.floating]] = {"W1": np.ones((2, 2))}
+    accumulator = GradientAccumulator(params, accumulation_steps=2)
+    first = None
+    for step in range(4):
+        accumulator.start_micro_batch()
+        accumulator.add({"W1": np.full((2, 2), float(step))}, 1)
+        if accumulator.ready:
+            grads = accumulator.mean_grads()
+            first = grads["W1"] if first is None else first
+            assert grads["W1"] is first
+            np.testing.assert_allclose(grads["W1"], step - 0.5)
+
+    with pytest.raises(ValueError):
+        GradientAccumulator(params, accumulation_steps=0)
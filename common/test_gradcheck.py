@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common.gradcheck import INPUT_KEY, gradcheck
+from common.testing import MeanSquareLoss, TanhLinear
+
+
+def _linear(
+    dtype: type, wrong_dw: bool = False, size: int = 6
+) -> tuple[TanhLinear, NDArray[np.floating]]:
+    rng = np.random.default_rng(0)
+    w = (rng.standard_normal((size, 4)) / np.sqrt(size)).astype(dtype)
+    b: NDArray[np.floating] = rng.standard_normal(4).astype(dtype)
+    x: NDArray[np.floating] = rng.standard_normal((5, size)).astype(dtype)
+    return TanhLinear(w, b, wrong_dw=wrong_dw), x
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_gradcheck_passes(dtype: type) -> None:
+    layer, x = _linear(dtype)
+    x0 = x.copy()
+    params0 = {k: v.copy() for k, v in layer.named_params().items()}
+    errors = gradcheck(layer, x)
+    assert set(errors) == {INPUT_KEY, "w", "b"}
+    assert max(errors.values()) < (1e-6 if dtype == np.float64 else 1e-2)
+    # the input and the parameters are unchanged
+    assert np.array_equal(x, x0)
+    for key, value in layer.named_params().items():
+        assert np.array_equal(value, params0[key])
+
+
+def test_gradcheck_detects_wrong_gradient() -> None:
+    layer, x = _linear(np.float64, wrong_dw=True)
+    with pytest.raises(AssertionError, match="w: numerical"):
+        gradcheck(layer, x)
+    errors = gradcheck(layer, x, raise_on_failure=False)
+    assert errors["w"] > 1e-3
+    assert errors["b"] < 1e-6 and errors[INPUT_KEY] < 1e-6
+
+
+def test_gradcheck_forward_passes_independent_of_size() -> None:
+    layer, x = _linear(np.float64, size=500)
+    gradcheck(layer, x, num_directions=2)
+    # one for the backward, then 2 * 2 per tensor: input, w and b
+    assert layer.forward_calls == 1 + 3 * 4
+
+
+def test_gradcheck_loss_layer() -> None:
+    rng = np.random.default_rng(1)
+    x = rng.standard_normal((4, 3))
+    t = rng.standard_normal((4, 3))
+    errors = gradcheck(MeanSquareLoss(), x, t=t)
+    assert errors[INPUT_KEY] < 1e-6
@@ -0,0 +1,41 @@
+import numpy as np
+
+from common.mixed_precision import DynamicLossScaler, MixedPrecisionOptimizer
+from common.testing import PlainSGD
+
+
+def test_loss_scaler_backoff_and_growth() -> None:
+    scaler = DynamicLossScaler(init_scale=8.0, growth_interval=2)
+    scaler.update(found_overflow=True)
+    assert scaler.scale == 4.0 and scaler.skipped_steps == 1
+    scaler.update(found_overflow=False)
+    assert scaler.scale == 4.0
+    scaler.update(found_overflow=False)
+    assert scaler.scale == 8.0
+
+
+def test_master_weights_keep_small_updates() -> None:
+    params = {"W1": np.ones((2, 2), dtype=np.float16)}
+    optimizer = MixedPrecisionOptimizer(PlainSGD(lr=1e-4), params)
+    for _ in range(100):
+        # the gradient 1 scaled by the loss scale, like from the backward
+        grads = {"W1": np.full((2, 2), optimizer.loss_scale, np.float16)}
+        optimizer.one_step(params, grads)
+
+    # every update (1e-4) is smaller than the float16 spacing at 1.0
+    np.testing.assert_allclose(optimizer.master_params["W1"], 0.99, rtol=1e-5)
+    np.testing.assert_allclose(params["W1"], 0.99, rtol=1e-3)
+    assert params["W1"].dtype == np.float16
+
+
+def test_overflow_skips_step() -> None:
+    params = {"W1": np.ones(3, dtype=np.float16)}
+    optimizer = MixedPrecisionOptimizer(
+        PlainSGD(lr=0.1), params, DynamicLossScaler(init_scale=1024.0)
+    )
+    grads = {"W1": np.array([1.0, np.inf, 1.0], dtype=np.float16)}
+    optimizer.one_step(params, grads)
+
+    np.testing.assert_array_equal(params["W1"], 1.0)
+    assert optimizer.loss_scale == 512.0
+    assert optimizer.loss_scaler.skipped_steps == 1
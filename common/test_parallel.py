@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from common.default_type_array import np_randn
+from common.parallel import (
+    MIN_SAMPLES_PER_THREAD,
+    batch_slices,
+    get_num_threads,
+    intra_op_threads,
+    parallel_over_batch,
+    parallel_sum_over_batch,
+    set_num_threads,
+)
+
+
+@pytest.mark.parametrize(
+    "batch_size, num_parts, expected",
+    [
+        (10, 2, [slice(0, 5), slice(5, 10)]),
+        (10, 3, [slice(0, 3), slice(3, 6), slice(6, 10)]),
+        (2, 4, [slice(0, 1), slice(1, 2)]),
+        (5, 1, [slice(0, 5)]),
+    ],
+)
+def test_batch_slices(
+    batch_size: int, num_parts: int, expected: list[slice]
+) -> None:
+    assert batch_slices(batch_size, num_parts) == expected
+
+
+@pytest.mark.parametrize("num_threads", [1, 2, 3])
+def test_parallel_over_batch(num_threads: int) -> None:
+    x = np_randn((8 * MIN_SAMPLES_PER_THREAD, 5))
+    w = np_randn((5, 3))
+    with intra_op_threads(num_threads, blas_threads=1):
+        result = parallel_over_batch(lambda xs: xs @ w, x)
+        out = np.empty((x.shape[0], 3), dtype=x.dtype)
+        result_out = parallel_over_batch(lambda xs: xs @ w, x, out=out)
+
+    np.testing.assert_allclose(result, x @ w, rtol=1e-6)
+    assert result_out is out
+    np.testing.assert_allclose(out, x @ w, rtol=1e-6)
+
+
+@pytest.mark.parametrize("num_threads", [1, 2, 3])
+def test_parallel_sum_over_batch(num_threads: int) -> None:
+    x = np_randn((8 * MIN_SAMPLES_PER_THREAD, 5))
+    dout = np_randn((8 * MIN_SAMPLES_PER_THREAD, 3))
+    with intra_op_threads(num_threads):
+        dw = parallel_sum_over_batch(lambda xs, ds: xs.T @ ds, x, dout)
+
+    np.testing.assert_allclose(dw, x.T @ dout, rtol=1e-5, atol=1e-5)
+
+
+def test_intra_op_threads_restores_setting() -> None:
+    assert get_num_threads() == 1
+    with intra_op_threads(2):
+        assert get_num_threads() == 2
+    assert get_num_threads() == 1
+
+    with pytest.raises(ValueError):
+        set_num_threads(0)
@@ -0,0 +1,71 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common.process_batch_loader import ProcessBatchLoader
+
+
+def _add_noise(
+    x_batch: NDArray[np.floating], rng: np.random.Generator
+) -> NDArray[np.floating]:
+    return x_batch + rng.integers(0, 1000, (x_batch.shape[0], 1))
+
+
+def _fail(
+    x_batch: NDArray[np.floating], rng: np.random.Generator
+) -> NDArray[np.floating]:
+    raise ValueError("augmentation failed")
+
+
+def _epochs(num_workers: int) -> list[list[NDArray[np.floating]]]:
+    x = np.arange(22, dtype=np.uint8).reshape(11, 2)
+    t = np.arange(11)
+    epochs = []
+    with ProcessBatchLoader(
+        x,
+        t,
+        4,
+        num_workers=num_workers,
+        prefetch=2,
+        transform=_add_noise,
+        seed=0,
+        x_dtype=np.float32,
+        x_scale=0.5,
+        context=multiprocessing.get_context("spawn"),
+    ) as loader:
+        assert len(loader) == 3
+        for _ in range(2):
+            batches = []
+            for x_batch, t_batch in loader:
+                assert x_batch.dtype == np.float32
+                noise = x_batch - x[t_batch] * 0.5
+                # one noise per sample, the same over the features
+                np.testing.assert_array_equal(noise[:, 0], noise[:, 1])
+                batches.append(np.concatenate([x_batch, t_batch[:, None]], 1))
+            epochs.append(batches)
+    return epochs
+
+
+def test_workers_are_deterministic() -> None:
+    one, three = _epochs(1), _epochs(3)
+    for batches_one, batches_three in zip(one, three):
+        for a, b in zip(batches_one, batches_three):
+            np.testing.assert_array_equal(a, b)
+    # every epoch gets new variants
+    assert not np.array_equal(one[0][0], one[1][0])
+
+
+def test_worker_error_and_early_break() -> None:
+    x = np.ones((8, 2), dtype=np.float32)
+    t = np.zeros(8)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessBatchLoader(x, t, 2, context=ctx) as loader:
+        for _ in loader:
+            break
+        # the next epoch reuses the slots of the abandoned one
+        assert sum(1 for _ in loader) == 4
+    with ProcessBatchLoader(x, t, 2, transform=_fail, context=ctx) as loader:
+        with pytest.raises(RuntimeError, match="augmentation failed"):
+            list(loader)
@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from common import profiler
+from common.base import Layer
+from common.profiler import (
+    Profiler,
+    TracedIterable,
+    counter,
+    instrument,
+    instrument_layer,
+    profile,
+    span,
+)
+from common.utils import log_duration
+
+
+class _Double(Layer):
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        return 2 * x
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        return 2 * dout
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+
+class _Chain(Layer):
+    def __init__(self, layers: tuple[Layer, ...]) -> None:
+        self._layers = layers
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        for layer in self._layers:
+            x = layer.forward(x)
+        return x
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        for layer in reversed(self._layers):
+            dout = layer.backward(dout)
+        return dout
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+
+def test_disabled_is_a_no_op() -> None:
+    assert not profiler.is_enabled()
+    assert span("a") is span("b")
+    with span("a"):
+        counter("c", 1.0)
+    assert profiler.get_profiler() is None
+
+
+def test_nested_spans_and_self_time() -> None:
+    with profile() as prof:
+        with span("outer", "test", step=1):
+            time.sleep(0.002)
+            with span("inner"):
+                time.sleep(0.003)
+        counter("accuracy", 0.5)
+    assert not profiler.is_enabled()
+
+    inner, outer = prof.spans
+    assert (inner.name, inner.depth) == ("inner", 1)
+    assert (outer.name, outer.depth, outer.args) == ("outer", 0, {"step": 1})
+    assert outer.start_ns <= inner.start_ns
+    assert outer.duration_ns >= inner.duration_ns + 2_000_000
+    assert outer.self_ns == outer.duration_ns - inner.duration_ns
+    assert inner.self_ns == inner.duration_ns
+    assert prof.counters[0].name == "accuracy"
+    assert prof.counters[0].value == 0.5
+
+
+def test_threads_have_their_own_nesting() -> None:
+    with profile() as prof:
+        with span("main"):
+            worker = threading.Thread(target=_traced_work)
+            worker.start()
+            worker.join()
+    by_name = {event.name: event for event in prof.spans}
+    assert by_name["worker"].depth == 0
+    assert by_name["worker"].tid != by_name["main"].tid
+    # the span of the other thread isn't nested into main
+    assert by_name["main"].self_ns == by_name["main"].duration_ns
+
+
+def _traced_work() -> None:
+    with span("worker"):
+        pass
+
+
+def test_chrome_trace_and_summary(tmp_path: Path) -> None:
+    with profile() as prof:
+        for i in range(3):
+            with span("step", "train", index=i):
+                with span("forward"):
+                    pass
+            counter("loss", 1.0 / (i + 1))
+
+    file_name = str(tmp_path / "trace.json")
+    prof.export_chrome_trace(file_name)
+    with open(file_name) as f:
+        trace = json.load(f)
+    events = trace["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+    counters = [event for event in events if event["ph"] == "C"]
+    assert len(spans) == 6 and len(counters) == 3
+    assert {"name", "cat", "ts", "dur", "pid", "tid", "args"} <= set(spans[0])
+    assert counters[-1]["args"] == {"loss": 1 / 3}
+    assert [event["ts"] for event in events] == sorted(
+        event["ts"] for event in events
+    )
+
+    summary = {s.name: s for s in prof.summary()}
+    assert summary["step"].count == summary["forward"].count == 3
+    assert summary["step"].total_ns >= summary["forward"].total_ns
+    assert summary["step"].min_ns <= summary["step"].mean_ns
+    table = prof.format_summary()
+    assert "step" in table and "forward" in table
+
+
+def test_instrument_layer_nests_the_layer_calls() -> None:
+    network = _Chain((_Double(), _Chain((_Double(),))))
+    x = np.ones(2)
+    undo = instrument_layer(network, "forward", "backward")
+    with profile() as prof:
+        np.testing.assert_array_equal(network.forward(x), 4 * x)
+        network.backward(x)
+    undo()
+    names = [(event.name, event.depth) for event in prof.spans]
+    assert names == [
+        ("_Double.forward", 1),
+        ("_Double.forward", 2),
+        ("_Chain.forward", 1),
+        ("forward", 0),
+        ("_Double.backward", 2),
+        ("_Chain.backward", 1),
+        ("_Double.backward", 1),
+        ("backward", 0),
+    ]
+    # the wrappers are removed
+    assert "forward" not in vars(network)
+    assert "forward" not in vars(network._layers[0])
+
+
+def test_instrument_restores_the_method() -> None:
+    class _Optimizer:
+        def one_step(self) -> int:
+            return 1
+
+    optimizer = _Optimizer()
+    undo = instrument(optimizer, {"one_step": "optimizer"})
+    with profile() as prof:
+        assert optimizer.one_step() == 1
+    undo()
+    assert [event.name for event in prof.spans] == ["optimizer"]
+    assert "one_step" not in vars(optimizer)
+
+
+def test_traced_iterable() -> None:
+    items = TracedIterable([1, 2, 3], "data")
+    assert len(items) == 3
+    assert items.count(2) == 1  # the attributes of the list
+    with profile() as prof:
+        assert list(items) == [1, 2, 3]
+    # the last one is the StopIteration
+    assert [event.name for event in prof.spans] == ["data"] * 4
+
+
+def test_log_duration_records_a_span(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    with profile(Profiler()) as prof:
+        with log_duration("training"):
+            pass
+    assert [event.name for event in prof.spans] == ["training"]
+    assert capsys.readouterr().out == ""
+
+    with log_duration("training"):
+        pass
+    assert capsys.readouterr().out == "training_duration_s: 0.0.\n"
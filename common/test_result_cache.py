@@ -0,0 +1,149 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from ch06_learning_technique.a_optimization import SGD
+from common.base import Layer, LayerConfig
+from common.layer_config import AffineConfig, ParameterInitConfig
+from common.result_cache import (
+    History,
+    ResultCache,
+    cached_training,
+    code_version,
+    stable_hash,
+)
+from common.testing import Scale
+
+
+def test_stable_hash_of_configs() -> None:
+    config = AffineConfig(in_size=3, out_size=2, param_suffix="1")
+    same = AffineConfig(in_size=3, out_size=2, param_suffix="1")
+    assert stable_hash(config) == stable_hash(same)
+    assert stable_hash(config) != stable_hash(
+        AffineConfig(in_size=3, out_size=4, param_suffix="1")
+    )
+    assert stable_hash(config) != stable_hash(
+        AffineConfig(
+            in_size=3,
+            out_size=2,
+            param_suffix="1",
+            param_init=ParameterInitConfig(
+                initializer="normal", mode="fan_in", weight_init_std=0.1
+            ),
+        )
+    )
+
+
+def test_stable_hash_of_values() -> None:
+    assert stable_hash({"a": 1, "b": 2.0}) == stable_hash({"b": 2.0, "a": 1})
+    assert stable_hash(1) != stable_hash(1.0)
+    assert stable_hash(np.float32(0.5)) != stable_hash(np.float64(0.5))
+    assert stable_hash(np.arange(3)) == stable_hash(np.arange(3))
+    assert stable_hash(np.arange(3)) != stable_hash(np.arange(1, 4))
+    assert stable_hash(SGD(lr=0.1)) == stable_hash(SGD(lr=0.1))
+    assert stable_hash(SGD(lr=0.1)) != stable_hash(SGD(lr=0.2))
+    with pytest.raises(TypeError, match="can't be hashed"):
+        stable_hash(object())
+
+
+def test_code_version() -> None:
+    assert code_version(SGD) == code_version(SGD)
+    assert code_version(SGD) != code_version(AffineConfig)
+    assert code_version(SGD, AffineConfig) == code_version(AffineConfig, SGD)
+
+
+def _params(size: int) -> dict[str, NDArray[np.floating]]:
+    return {"w": np.arange(size, dtype=np.float64)}
+
+
+def test_result_cache_round_trip(tmp_path: Path) -> None:
+    cache = ResultCache(str(tmp_path))
+    assert cache.get("key") is None
+    cache.put("key", _params(3), ([0.1, 0.2], [0.3, 0.4]), meta={"lr": 0.1})
+    cached = cache.get("key")
+    assert cached is not None
+    assert np.array_equal(cached.params["w"], np.arange(3))
+    assert cached.history == ([0.1, 0.2], [0.3, 0.4])
+    assert cached.meta == {"lr": 0.1}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_result_cache_get_or_train(tmp_path: Path) -> None:
+    cache = ResultCache(str(tmp_path))
+    calls = []
+
+    def train() -> tuple[dict[str, NDArray[np.floating]], History]:
+        calls.append(1)
+        return _params(2), ([0.5], [0.6])
+
+    first = cache.get_or_train("key", train)
+    second = cache.get_or_train("key", train)
+    assert len(calls) == 1
+    assert second.history == first.history == ([0.5], [0.6])
+    assert np.array_equal(second.params["w"], first.params["w"])
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = ResultCache(str(tmp_path), max_bytes=1 << 40)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, _params(1000), ([0.0], [0.0]))
+        # the entries are used one after the other
+        os.utime(os.path.join(tmp_path, key), (1000 + i, 1000 + i))
+    entry_size = cache.size() // 3
+    assert cache.get("a") is not None  # now the most recent one
+
+    cache = ResultCache(str(tmp_path), max_bytes=3 * entry_size + 10)
+    cache.put("d", _params(1000), ([0.0], [0.0]))
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ["a", "c", "d"])
+    assert cache.size() <= 3 * entry_size + 10
+
+
+@dataclass(frozen=True, kw_only=True)
+class _ScaleConfig(LayerConfig):
+    size: int
+
+    def create(
+        self, parameters: dict[str, NDArray[np.floating]] | None = None
+    ) -> Layer:
+        if parameters is not None:
+            return Scale(parameters["w"])
+        return Scale(np.random.randn(self.size))
+
+
+def test_cached_training(tmp_path: Path) -> None:
+    cache = ResultCache(str(tmp_path))
+    config = _ScaleConfig(size=4)
+    x = np.ones((2, 4))
+    calls = []
+
+    def train(network: Layer) -> tuple[list[float], list[float]]:
+        calls.append(1)
+        network.named_params()["w"] *= 2
+        return [0.5], [0.25]
+
+    optimizer = SGD(lr=0.1)
+    network, history = cached_training(
+        cache, config, train, 0, optimizer=optimizer, data=(x,), epochs=1
+    )
+    loaded, loaded_history = cached_training(
+        cache, config, train, 0, optimizer=optimizer, data=(x,), epochs=1
+    )
+    assert len(calls) == 1
+    assert loaded_history == history
+    np.testing.assert_array_equal(
+        loaded.named_params()["w"], network.named_params()["w"]
+    )
+
+    # another setting trains again
+    cached_training(
+        cache, config, train, 0, optimizer=optimizer, data=(x,), epochs=2
+    )
+    cached_training(
+        cache, config, train, 1, optimizer=optimizer, data=(x,), epochs=1
+    )
+    assert len(calls) == 3
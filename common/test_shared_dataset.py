@@ -0,0 +1,55 @@
+import multiprocessing
+import pickle
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from common.shared_dataset import SharedArrays, SharedDataset
+
+
+def _sum_in_worker(dataset: SharedDataset) -> tuple[float, int, bool]:
+    x, t = dataset.x, dataset.t
+    return float(x.sum()), int(t.sum()), bool(x.flags.writeable)
+
+
+def test_workers_attach_read_only_views() -> None:
+    x = np.arange(12, dtype=np.float32).reshape(4, 3)
+    t = np.array([1, 0, 1, 1], dtype=np.uint8)
+    ctx = multiprocessing.get_context("spawn")
+    with SharedArrays(x_train=x, t_train=t) as shared:
+        dataset = SharedDataset(shared, "x_train", "t_train")
+        assert shared.is_owner and len(dataset) == 4
+        np.testing.assert_array_equal(dataset.x, x)
+        with pytest.raises(ValueError):
+            dataset.x[0, 0] = 1.0
+        with ctx.Pool(2) as pool:
+            results = pool.map(_sum_in_worker, [dataset, dataset])
+        assert results == [(66.0, 3, False)] * 2
+
+
+def test_owner_releases_segments() -> None:
+    shared = SharedArrays(x=np.ones(3), empty=np.zeros((0, 2)))
+    assert shared["empty"].shape == (0, 2)
+    names = [spec[0] for spec in shared._specs.values()]
+    attached = pickle.loads(pickle.dumps(shared))
+    assert not attached.is_owner
+    np.testing.assert_array_equal(attached["x"], 1.0)
+    attached.close()
+    # the segment is still there after a worker detached
+    SharedMemory(name=names[0]).close()
+
+    shared.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name)
+    with pytest.raises(ValueError, match="closed"):
+        shared["x"]
+
+
+def test_segments_released_when_garbage_collected() -> None:
+    shared = SharedArrays(x=np.ones(3))
+    name = next(iter(shared._specs.values()))[0]
+    del shared
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
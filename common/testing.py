@@ -0,0 +1,166 @@
+"""Small layers and optimizers for the tests.
+
+They don't depend on the exercises, so the tests of the infrastructure (the
+trainer, the pipeline, the gradient check...) pass before the layers are
+implemented.
+"""
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.base import Layer, Optimizer
+
+
+class Identity(Layer):
+    """y = x, which records the batch sizes of the forward passes.
+
+    As a loss layer, the loss is the mean of the first score, so it depends
+    on the batch.
+    """
+
+    def __init__(self) -> None:
+        self.batch_sizes: list[int] = []
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        self.batch_sizes.append(x.shape[0])
+        return x
+
+    def forward_to_loss(
+        self, x: NDArray[np.floating], t: NDArray[np.floating | np.integer]
+    ) -> float:
+        return float(np.mean(x[:, 0]))
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        return dout
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+
+class Scale(Layer):
+    """y = x * w, element-wise, without parameter gradients."""
+
+    def __init__(self, w: NDArray[np.floating], name: str = "w") -> None:
+        self._params = {name: w}
+        self._name = name
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return self._params
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        return x * self._params[self._name]
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        return dout * self._params[self._name]
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+
+class TanhLinear(Layer):
+    """y = tanh(x @ w + b), with an optional bug in the gradient of w."""
+
+    def __init__(
+        self,
+        w: NDArray[np.floating],
+        b: NDArray[np.floating] | None = None,
+        w_name: str = "w",
+        b_name: str = "b",
+        wrong_dw: bool = False,
+    ) -> None:
+        """Initialize the layer.
+
+        Parameters:
+            w : NDArray[np.floating]
+                The weight, shape (in_size, out_size).
+            b : NDArray[np.floating] | None
+                The bias, None for no bias.
+            w_name, b_name : str
+                The names of the parameters.
+            wrong_dw : bool
+                If True, the gradient of w[0, 0] is off by one.
+        """
+        self._params = {w_name: w}
+        if b is not None:
+            self._params[b_name] = b
+        self._w_name = w_name
+        self._b_name = b_name
+        self._wrong_dw = wrong_dw
+        self._x: NDArray[np.floating] | None = None
+        self._y: NDArray[np.floating] | None = None
+        self._grads: dict[str, NDArray[np.floating]] = {}
+        self.forward_calls = 0
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return self._params
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        self.forward_calls += 1
+        self._x = x
+        pre = x @ self._params[self._w_name]
+        if self._b_name in self._params:
+            pre = pre + self._params[self._b_name]
+        self._y = np.tanh(pre)
+        return self._y
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        assert self._x is not None and self._y is not None
+        d_pre = dout * (1 - self._y**2)
+        dw = self._x.T @ d_pre
+        if self._wrong_dw:
+            dw[0, 0] += 1.0
+        self._grads = {self._w_name: dw}
+        if self._b_name in self._params:
+            self._grads[self._b_name] = d_pre.sum(axis=0)
+        dx: NDArray[np.floating] = d_pre @ self._params[self._w_name].T
+        return dx
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return self._grads
+
+
+class MeanSquareLoss(Layer):
+    """The loss 0.5 * sum((x - t)^2) / batch size."""
+
+    def __init__(self) -> None:
+        self._diff: NDArray[np.floating] | None = None
+
+    def named_params(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+    def forward(self, x: NDArray[np.floating]) -> NDArray[np.floating]:
+        # the prediction is the input itself, the target is only known by
+        # forward_to_loss
+        return x
+
+    def forward_to_loss(
+        self, x: NDArray[np.floating], t: NDArray[np.floating | np.integer]
+    ) -> float:
+        self._diff = x - t
+        return float(0.5 * np.sum(self._diff**2) / x.shape[0])
+
+    def backward(self, dout: NDArray[np.floating]) -> NDArray[np.floating]:
+        assert self._diff is not None
+        dx: NDArray[np.floating] = dout * self._diff / self._diff.shape[0]
+        return dx
+
+    def param_grads(self) -> dict[str, NDArray[np.floating]]:
+        return {}
+
+
+class PlainSGD(Optimizer):
+    """params -= lr * grads, lr=0 for no update."""
+
+    def __init__(self, lr: float) -> None:
+        self._lr = lr
+
+    def one_step(
+        self,
+        params: dict[str, NDArray[np.floating]],
+        grads: dict[str, NDArray[np.floating]],
+    ) -> None:
+        for key, grad in grads.items():
+            params[key] -= self._lr * grad
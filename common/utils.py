@@ -4,12 +4,16 @@ from typing import Iterator
 
 from common.base import Layer
 from common.default_type_array import get_default_type
+from common.profiler import is_enabled, span
 
 
 @contextmanager
 def log_duration(process: str) -> Iterator[None]:
     """Log duration of some processes.
 
+    If the profiler is enabled, the duration is recorded as a span of it, see
+    `common.profiler`. Otherwise it's printed.
+
     Parameters
     ----------
     process : str
@@ -23,15 +27,17 @@ def log_duration(process: str) -> Iterator[None]:
     if process == "":
         raise ValueError("The process description cannot be empty.")
 
-    start_time = time.time()
+    if is_enabled():
+        with span(process, "log"):
+            yield
+        return
+
+    start_ns = time.perf_counter_ns()
     try:
         yield
     finally:
-        end_time = time.time()
-        print(
-            f"{process}_duration_s: {end_time - start_time:.1f}. "
-            f"start_time_s: {start_time:.4f}; end_time_s: {end_time:.4f}."
-        )
+        duration_s = (time.perf_counter_ns() - start_ns) / 1e9
+        print(f"{process}_duration_s: {duration_s:.1f}.")
 
 
 def assert_layer_parameter_type(layer: Layer) -> None:
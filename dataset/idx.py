@@ -0,0 +1,161 @@
+"""A streaming reader of the IDX files, the format of the MNIST dataset.
+
+An IDX file is a header and the big-endian array data:
+    magic: 0x00 0x00 <type code> <number of dimensions>
+    dims:  one big-endian int32 per dimension
+    data:  the array in C order
+
+`convert_idx` decompresses a (gzip) IDX file chunk by chunk directly into a
+.npy file mapped into memory, so the file is never read into the memory as a
+whole, and a dataset larger than the memory can be converted.
+"""
+
+import gzip
+import io
+import os
+import struct
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+from common.dataset import ArrayDataset
+
+# the type codes of the IDX format, the multi-byte types are big-endian
+IDX_TYPES: dict[int, np.dtype[Any]] = {
+    0x08: np.dtype(np.uint8),
+    0x09: np.dtype(np.int8),
+    0x0B: np.dtype(">i2"),
+    0x0C: np.dtype(">i4"),
+    0x0D: np.dtype(">f4"),
+    0x0E: np.dtype(">f8"),
+}
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+"""The bytes decompressed at a time."""
+
+
+def read_idx_header(
+    f: io.BufferedIOBase,
+) -> tuple[np.dtype[Any], tuple[int, ...]]:
+    """Read the header of an IDX file, return the (dtype, shape) of its data.
+
+    The file position is at the start of the data afterwards.
+    """
+    magic = f.read(4)
+    if len(magic) != 4 or magic[:2] != b"\x00\x00":
+        raise ValueError("Not an IDX file.")
+    type_code, ndim = magic[2], magic[3]
+    if type_code not in IDX_TYPES:
+        raise ValueError(f"Unknown IDX type code: {type_code:#x}.")
+    dims = f.read(4 * ndim)
+    if len(dims) != 4 * ndim:
+        raise ValueError("Truncated IDX header.")
+    shape: tuple[int, ...] = struct.unpack(f">{ndim}I", dims)
+    return IDX_TYPES[type_code], shape
+
+
+def _open(path: str) -> io.BufferedIOBase:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def convert_idx(
+    idx_path: str,
+    npy_path: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> np.memmap:
+    """Convert an IDX file (.gz or raw) into a .npy file, chunk by chunk.
+
+    Parameters:
+        idx_path : str
+            The IDX file, decompressed on the fly if it ends with .gz.
+        npy_path : str
+            The .npy file to be written. It's written to a temporary file
+            first, so a concurrent reader never sees a partial file.
+        chunk_size : int
+            The bytes decompressed into the mapped file at a time, which
+            bounds the memory of the conversion.
+
+    Returns:
+        np.memmap: The converted array, mapped read-only.
+    """
+    tmp_path = f"{npy_path}.{os.getpid()}.tmp"
+    with _open(idx_path) as f:
+        dtype, shape = read_idx_header(f)
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=dtype, shape=shape
+        )
+        try:
+            _read_into(f, out, chunk_size)
+            out.flush()
+        except BaseException:
+            del out
+            os.remove(tmp_path)
+            raise
+        del out
+    os.replace(tmp_path, npy_path)
+    mapped: np.memmap = np.load(npy_path, mmap_mode="r")
+    return mapped
+
+
+def load_idx_dataset(
+    images_path: str,
+    labels_path: str,
+    cache_dir: str,
+    flatten: bool = True,
+) -> ArrayDataset:
+    """Return the dataset of the IDX images and labels, as memory maps.
+
+    The IDX files are converted into .npy files in the cache_dir once, and
+    again only if an IDX file is newer than its .npy file.
+
+    Parameters:
+        images_path : str
+            The IDX file of the images, (N, H, W).
+        labels_path : str
+            The IDX file of the labels, (N,).
+        cache_dir : str
+            The directory of the converted .npy files.
+        flatten : bool
+            If True, the images are (N, H * W), otherwise (N, 1, H, W).
+
+    Returns:
+        ArrayDataset: The read-only memory maps of the images and labels.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    images, labels = (
+        _load_cached(path, cache_dir) for path in (images_path, labels_path)
+    )
+    num = images.shape[0]
+    if flatten:
+        x = images.reshape(num, -1)
+    else:
+        x = images.reshape(num, 1, *images.shape[1:])
+    return ArrayDataset(x, labels)
+
+
+def _load_cached(idx_path: str, cache_dir: str) -> np.memmap:
+    name = os.path.basename(idx_path).removesuffix(".gz")
+    npy_path = os.path.join(cache_dir, name + ".npy")
+    fresh = os.path.exists(npy_path) and (
+        os.path.getmtime(npy_path) >= os.path.getmtime(idx_path)
+    )
+    if fresh:
+        mapped: np.memmap = np.load(npy_path, mmap_mode="r")
+        return mapped
+    return convert_idx(idx_path, npy_path)
+
+
+def _read_into(
+    f: io.BufferedIOBase, out: NDArray[Any], chunk_size: int
+) -> None:
+    buffer = out.reshape(-1).view(np.uint8).data
+    offset = 0
+    while offset < buffer.nbytes:
+        stop = min(offset + chunk_size, buffer.nbytes)
+        read = f.readinto(buffer[offset:stop])
+        if not read:
+            raise ValueError("Truncated IDX data.")
+        offset += read
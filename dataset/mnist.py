@@ -1,5 +1,4 @@
 # copied from https://github.com/oreilly-japan/deep-learning-from-scratch/blob/master/dataset/mnist.py
-import gzip
 import os
 import os.path
 import pickle
@@ -8,6 +7,8 @@ import urllib.request
 import numpy as np
 
 from common.default_type_array import get_default_type
+from common.shared_dataset import SharedArrays
+from dataset.idx import convert_idx
 
 # url_base = 'http://yann.lecun.com/exdb/mnist/'
 url_base = "https://ossci-datasets.s3.amazonaws.com/mnist/"  # mirror site
@@ -22,6 +23,8 @@ key_file = {
 current_dir = os.path.dirname(os.path.abspath(__file__))
 dataset_dir = current_dir + "/MNIST/raw"
 save_file = current_dir + "/MNIST/mnist.pkl"
+# the pre-processed arrays in .npy files, for the memory mapping
+cache_dir = current_dir + "/MNIST/cache"
 
 # train_num = 60000
 # test_num = 10000
@@ -53,27 +56,26 @@ def download_mnist():
         _download(v)
 
 
-def _load_label(file_name):
+def _convert_idx(file_name):
+    """Stream the gzip IDX file into a memory-mapped .npy file."""
     file_path = dataset_dir + "/" + file_name
+    npy_path = file_path.removesuffix(".gz") + ".npy"
 
     print("Converting " + file_name + " to NumPy Array ...")
-    with gzip.open(file_path, "rb") as f:
-        labels = np.frombuffer(f.read(), DEFAULT_INT_TYPE, offset=8)
+    data = convert_idx(file_path, npy_path)
     print("Done")
 
-    return labels
+    # a plain array view of the mapped file, for pickling
+    return np.asarray(data)
 
 
-def _load_img(file_name):
-    file_path = dataset_dir + "/" + file_name
+def _load_label(file_name):
+    return _convert_idx(file_name).astype(DEFAULT_INT_TYPE, copy=False)
 
-    print("Converting " + file_name + " to NumPy Array ...")
-    with gzip.open(file_path, "rb") as f:
-        data = np.frombuffer(f.read(), DEFAULT_INT_TYPE, offset=16)
-    data = data.reshape(-1, img_size)
-    print("Done")
 
-    return data
+def _load_img(file_name):
+    data = _convert_idx(file_name).astype(DEFAULT_INT_TYPE, copy=False)
+    return data.reshape(-1, img_size)
 
 
 def _convert_numpy():
@@ -96,18 +98,69 @@ def init_mnist():
 
 
 def _change_one_hot_label(X):
-    T = np.zeros((X.size, 10))
-    for idx, row in enumerate(T):
-        row[X[idx]] = 1
+    T = np.zeros((X.size, 10), dtype=DEFAULT_INT_TYPE)
+    T[np.arange(X.size), X] = 1
 
     return T
 
 
+def _cache_files(normalize, flatten, one_hot_label, dtype):
+    """Return the .npy file of every array, keyed by the pre-processing."""
+    tag = (
+        f"norm{int(normalize)}_flat{int(flatten)}_onehot{int(one_hot_label)}"
+        f"_{np.dtype(dtype).name}"
+    )
+    return {key: f"{cache_dir}/{key}_{tag}.npy" for key in key_file}
+
+
+def _is_cache_valid(files):
+    """The cache is valid if it's newer than the pickle file."""
+    source_time = os.path.getmtime(save_file)
+    return all(
+        os.path.exists(file) and os.path.getmtime(file) >= source_time
+        for file in files.values()
+    )
+
+
+def _build_cache(normalize, flatten, one_hot_label, dtype, files):
+    with open(save_file, "rb") as f:
+        dataset = pickle.load(f)
+
+    for key in ("train_img", "test_img"):
+        dataset[key] = dataset[key].astype(dtype)
+        if normalize:
+            dataset[key] /= 255.0
+        if not flatten:
+            dataset[key] = dataset[key].reshape(-1, 1, 28, 28)
+
+    for key in ("train_label", "test_label"):
+        if one_hot_label:
+            dataset[key] = _change_one_hot_label(dataset[key])
+        dataset[key] = dataset[key].astype(DEFAULT_INT_TYPE)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for key, file in files.items():
+        # write to a temporary file first, a concurrent reader never sees a
+        # partial file
+        tmp_file = f"{file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, dataset[key])
+        os.replace(tmp_file, file)
+
+
 def load_mnist(
-    normalize: bool = True, flatten: bool = True, one_hot_label: bool = False
+    normalize: bool = True,
+    flatten: bool = True,
+    one_hot_label: bool = False,
+    mmap_mode: str | None = "c",
+    keep_uint8: bool = False,
 ) -> tuple:
     """Load the MNIST dataset.
 
+    The pre-processed arrays are cached in .npy files for every combination
+    of the parameters and the default float type, so the later loads only map
+    the files into memory, without unpickling, converting and normalizing.
+
     Parameters:
         normalize : bool
             If True, normalize the image pixel values to the range [0, 1]. Default is True.
@@ -116,6 +169,18 @@ def load_mnist(
         one_hot_label : bool
             If True, convert labels to one-hot encoding. Default is False.
             # one hot means the label is one hot encoded like [0, 0, 1, 0, 0].
+        mmap_mode : str | None
+            The mode of `np.load` for the cached arrays. The default "c" maps
+            the files copy-on-write: the arrays are writable like the loaded
+            ones, the pages are read lazily and copied only when written,
+            and the cache files are never modified. "r" maps them read-only,
+            for sharing the pages of the same file between the processes.
+            None reads the arrays into the memory.
+        keep_uint8 : bool
+            If True, keep the raw uint8 pixels, a quarter of the float32
+            memory, and ignore normalize. The mini-batches are converted and
+            normalized by the batch pipeline, like `LayerTrainer` with
+            input_scale=1 / 255.
 
     Returns:
         tuple: A tuple containing two tuples:
@@ -125,28 +190,45 @@ def load_mnist(
     if not os.path.exists(save_file):
         init_mnist()
 
-    with open(save_file, "rb") as f:
-        dataset = pickle.load(f)
+    dtype = np.uint8 if keep_uint8 else get_default_type()
+    normalize = normalize and not keep_uint8
+    files = _cache_files(normalize, flatten, one_hot_label, dtype)
+    if not _is_cache_valid(files):
+        _build_cache(normalize, flatten, one_hot_label, dtype, files)
 
-    if normalize:
-        for key in ("train_img", "test_img"):
-            dataset[key] = dataset[key].astype(get_default_type())
-            dataset[key] /= 255.0
+    dataset = {
+        key: np.load(file, mmap_mode=mmap_mode) for key, file in files.items()
+    }
+    return (
+        dataset["train_img"],
+        dataset["train_label"],
+    ), (
+        dataset["test_img"],
+        dataset["test_label"],
+    )
 
-    if one_hot_label:
-        dataset["train_label"] = _change_one_hot_label(dataset["train_label"])
-        dataset["test_label"] = _change_one_hot_label(dataset["test_label"])
 
-    if not flatten:
-        for key in ("train_img", "test_img"):
-            dataset[key] = dataset[key].reshape(-1, 1, 28, 28)
+def load_shared_mnist(**kwargs) -> SharedArrays:
+    """Load the MNIST dataset once into shared memory.
 
-    return (
-        dataset["train_img"].astype(get_default_type()),
-        dataset["train_label"].astype(DEFAULT_INT_TYPE),
-    ), (
-        dataset["test_img"].astype(get_default_type()),
-        dataset["test_label"].astype(DEFAULT_INT_TYPE),
+    The arrays are named train_img, train_label, test_img and test_label.
+    Give the result (or `SharedDataset`s of it) to the worker processes, they
+    attach the same memory instead of loading their own copies. The calling
+    process owns the memory, close it after the workers finished.
+
+    Parameters:
+        **kwargs : dict
+            The parameters of `load_mnist`, like keep_uint8=True.
+
+    Returns:
+        SharedArrays: The arrays in shared memory.
+    """
+    (train_img, train_label), (test_img, test_label) = load_mnist(**kwargs)
+    return SharedArrays(
+        train_img=train_img,
+        train_label=train_label,
+        test_img=test_img,
+        test_label=test_label,
     )
 
 
@@ -0,0 +1,63 @@
+import gzip
+import struct
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from dataset.idx import convert_idx, load_idx_dataset
+
+
+def _write_idx(path: Path, array: NDArray[Any], type_code: int) -> None:
+    header = bytes([0, 0, type_code, array.ndim])
+    header += struct.pack(f">{array.ndim}I", *array.shape)
+    with gzip.open(path, "wb") as f:
+        f.write(header + array.tobytes())
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1 << 20])
+def test_convert_idx_streams_chunks(tmp_path: Path, chunk_size: int) -> None:
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (6, 4, 5), dtype=np.uint8)
+    floats = rng.standard_normal((3, 2)).astype(">f4")
+    _write_idx(tmp_path / "img.gz", images, 0x08)
+    _write_idx(tmp_path / "f.gz", floats, 0x0D)
+
+    result = convert_idx(
+        str(tmp_path / "img.gz"), str(tmp_path / "img.npy"), chunk_size
+    )
+    assert isinstance(result, np.memmap) and not result.flags.writeable
+    np.testing.assert_array_equal(result, images)
+    result = convert_idx(
+        str(tmp_path / "f.gz"), str(tmp_path / "f.npy"), chunk_size
+    )
+    np.testing.assert_array_equal(result, floats)
+
+
+def test_convert_idx_rejects_truncated(tmp_path: Path) -> None:
+    header = bytes([0, 0, 0x08, 1]) + struct.pack(">I", 10)
+    with gzip.open(tmp_path / "bad.gz", "wb") as f:
+        f.write(header + bytes(4))
+    with pytest.raises(ValueError, match="Truncated"):
+        convert_idx(str(tmp_path / "bad.gz"), str(tmp_path / "bad.npy"))
+    assert list(tmp_path.iterdir()) == [tmp_path / "bad.gz"]
+
+
+def test_load_idx_dataset(tmp_path: Path) -> None:
+    images = np.arange(3 * 2 * 2, dtype=np.uint8).reshape(3, 2, 2)
+    labels = np.array([2, 0, 1], dtype=np.uint8)
+    _write_idx(tmp_path / "img.gz", images, 0x08)
+    _write_idx(tmp_path / "lbl.gz", labels, 0x08)
+    cache = str(tmp_path / "cache")
+
+    dataset = load_idx_dataset(
+        str(tmp_path / "img.gz"), str(tmp_path / "lbl.gz"), cache
+    )
+    assert len(dataset) == 3 and dataset.x.shape == (3, 4)
+    np.testing.assert_array_equal(dataset.t, labels)
+    dataset = load_idx_dataset(
+        str(tmp_path / "img.gz"), str(tmp_path / "lbl.gz"), cache, False
+    )
+    assert dataset.x.shape == (3, 1, 2, 2)
@@ -0,0 +1,88 @@
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+import dataset.mnist as mnist
+
+FakeMnist = dict[str, NDArray[np.uint8]]
+
+
+@pytest.fixture
+def fake_mnist(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> FakeMnist:
+    rng = np.random.default_rng(0)
+    data = {
+        "train_img": rng.integers(0, 256, (20, 784), dtype=np.uint8),
+        "train_label": rng.integers(0, 10, 20).astype(np.uint8),
+        "test_img": rng.integers(0, 256, (5, 784), dtype=np.uint8),
+        "test_label": rng.integers(0, 10, 5).astype(np.uint8),
+    }
+    save_file = str(tmp_path / "mnist.pkl")
+    with open(save_file, "wb") as f:
+        pickle.dump(data, f)
+    monkeypatch.setattr(mnist, "save_file", save_file)
+    monkeypatch.setattr(mnist, "cache_dir", str(tmp_path / "cache"))
+    return data
+
+
+def test_change_one_hot_label() -> None:
+    one_hot = mnist._change_one_hot_label(np.array([3, 0, 9], np.uint8))
+    expected = np.zeros((3, 10), dtype=np.uint8)
+    expected[[0, 1, 2], [3, 0, 9]] = 1
+    np.testing.assert_array_equal(one_hot, expected)
+
+
+def test_load_mnist_maps_cached_arrays(fake_mnist: FakeMnist) -> None:
+    (x_train, t_train), (x_test, t_test) = mnist.load_mnist(
+        flatten=False, one_hot_label=True
+    )
+
+    assert isinstance(x_train, np.memmap) and x_train.flags.writeable
+    assert x_train.shape == (20, 1, 28, 28) and x_train.dtype == np.float32
+    np.testing.assert_allclose(
+        x_test.reshape(5, -1), fake_mnist["test_img"] / 255.0, rtol=1e-6
+    )
+    np.testing.assert_array_equal(
+        t_train.argmax(axis=1), fake_mnist["train_label"]
+    )
+    assert t_test.dtype == np.uint8
+    assert len(os.listdir(mnist.cache_dir)) == 4
+
+    # another pre-processing has its own cache files
+    (x_train, t_train), _ = mnist.load_mnist(normalize=False, mmap_mode=None)
+    assert not isinstance(x_train, np.memmap)
+    np.testing.assert_array_equal(x_train, fake_mnist["train_img"])
+    np.testing.assert_array_equal(t_train, fake_mnist["train_label"])
+    assert len(os.listdir(mnist.cache_dir)) == 8
+
+
+def test_load_mnist_writes_never_reach_the_cache(fake_mnist: FakeMnist) -> None:
+    (x_train, _), _ = mnist.load_mnist(normalize=False)
+    x_train[:] = 0
+    (x_train, _), _ = mnist.load_mnist(normalize=False)
+    np.testing.assert_array_equal(x_train, fake_mnist["train_img"])
+
+    # the read-only map is opt-in
+    (x_train, _), _ = mnist.load_mnist(normalize=False, mmap_mode="r")
+    assert not x_train.flags.writeable
+
+
+def test_load_mnist_rebuilds_stale_cache(fake_mnist: FakeMnist) -> None:
+    mnist.load_mnist()
+    fake_mnist["test_label"][:] = 7
+    with open(mnist.save_file, "wb") as f:
+        pickle.dump(fake_mnist, f)
+    future = os.path.getmtime(mnist.save_file) + 10
+    os.utime(mnist.save_file, (future, future))
+
+    _, (_, t_test) = mnist.load_mnist()
+    np.testing.assert_array_equal(t_test, 7)
+
+
+def test_load_mnist_keeps_uint8(fake_mnist: FakeMnist) -> None:
+    (x_train, _), (x_test, _) = mnist.load_mnist(keep_uint8=True)
+    assert x_train.dtype == np.uint8 and x_test.shape == (5, 784)
+    np.testing.assert_array_equal(x_train, fake_mnist["train_img"])